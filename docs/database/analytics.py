@@ -0,0 +1,506 @@
+"""
+Sales Analytics - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ + RQ-Scheduler (DEC-P04)
+
+Revenue trends and best-selling products from pre-bucketed rollups. Copy
+into core/analytics.py.
+
+SalesRollup and ProductSalesRollup hold totals per business at day, week
+(Monday start) and month grain. refresh_rollups() keeps them current
+incrementally:
+1. Find the (business, day) pairs touched since the last run: new
+   water/retail/LPG sales by primary key watermark, new or changed laundry
+   jobs by updated_at watermark (BatchJobState, one row per source).
+2. Recompute the day rows for those pairs from the raw sales.
+3. Recompute the weeks and months containing them from the day rows.
+Days in a closed accounting period are frozen and skipped; period close
+rebuilds the month once before closing it.
+
+Charts then read a few dozen rollup rows whatever the range:
+sales_trend() for revenue/margin/transaction series net of VAT (whole
+periods from their own rows, partial edge periods from day rows),
+top_products() for best sellers over any date range (whole months from
+month rows, ragged edges from day rows). Payloads are bare label and number arrays (no
+Decimal strings, no per-point objects), sized for phone charts.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+import django_rq
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+from django.utils import timezone
+from decimal import Decimal
+
+from db_routing import reporting
+from django_models import (
+    AccountingPeriod,
+    BatchJobState,
+    LaundryJob,
+    LaundryJobItem,
+    ProductSalesRollup,
+    RetailLPGExchange,
+    RetailSale,
+    RetailSaleItem,
+    SalesRollup,
+    WaterSale,
+)
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_JOB_PREFIX = 'sales_rollup'
+
+# Re-read a short window behind each watermark so rows committed by
+# transactions that started before the previous run are not missed.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Days recomputed per aggregate query on a full rebuild
+DAYS_PER_QUERY = 366
+
+ZERO = Decimal('0.00')
+
+# stream -> (queryset, business field, date field, transaction count, revenue, tax, cost)
+# Revenue is VAT-inclusive after discounts, so revenue - tax is the net sale.
+SALES_SOURCES = {
+    'water': (
+        lambda: WaterSale.objects.exclude(journal_entry__status='reversed'),
+        'business_id', 'sale_date', Count('id'), 'total_amount', 'tax_amount', 'cost_amount',
+    ),
+    'laundry': (
+        lambda: LaundryJob.objects.exclude(status='cancelled'),
+        'business_id', 'received_date', Count('id'), 'total_amount', 'tax_amount', None,
+    ),
+    'retail': (
+        lambda: RetailSaleItem.objects.exclude(sale__journal_entry__status='reversed'),
+        'sale__business_id', 'sale__sale_date', Count('sale_id', distinct=True),
+        Coalesce(F('net_amount') + F('tax_amount'), 'line_total'), 'tax_amount', 'cost_amount',
+    ),
+    'lpg': (
+        lambda: RetailLPGExchange.objects.exclude(journal_entry__status='reversed'),
+        'business_id', 'exchange_date', Count('id'), 'total_amount', 'tax_amount', 'cost_amount',
+    ),
+}
+
+# stream -> (queryset, business field, date field, product field, name field, quantity, revenue)
+# LPG refills have no product row: they are keyed by cylinder capacity.
+PRODUCT_SOURCES = {
+    'water': (
+        lambda: WaterSale.objects.exclude(journal_entry__status='reversed'),
+        'business_id', 'sale_date', 'product_size_id', 'product_size__name',
+        Sum('quantity_sold'), 'total_amount',
+    ),
+    'laundry': (
+        lambda: LaundryJobItem.objects.exclude(job__status='cancelled'),
+        'job__business_id', 'job__received_date', 'service_type_id', 'service_type__name',
+        Sum('quantity'), 'line_total',
+    ),
+    'retail': (
+        lambda: RetailSaleItem.objects.exclude(sale__journal_entry__status='reversed'),
+        'sale__business_id', 'sale__sale_date', 'product_id', 'product__name',
+        Sum('quantity'), 'line_total',
+    ),
+    'lpg': (
+        lambda: RetailLPGExchange.objects.exclude(journal_entry__status='reversed'),
+        'business_id', 'exchange_date', 'capacity_kg', None,
+        Count('id'), 'total_amount',
+    ),
+}
+
+# Append-only sources tracked by primary key: model -> date field
+ID_WATERMARKED = {
+    WaterSale: 'sale_date',
+    RetailSale: 'sale_date',
+    RetailLPGExchange: 'exchange_date',
+}
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+PERIOD_START = {'day': lambda day: day, 'week': week_start, 'month': month_start}
+
+
+# -----------------------------------------------------------------------------
+# Refresh
+# -----------------------------------------------------------------------------
+
+def _state(table):
+    state, _ = BatchJobState.objects.select_for_update().get_or_create(
+        job_name=f'{ROLLUP_JOB_PREFIX}:{table}'
+    )
+    return state
+
+
+def _touched_by_id(model, date_field, now, touched):
+    """Add (business, day) pairs of rows above the id watermark; advance it."""
+    state = _state(model._meta.db_table)
+    rows = model.objects.all()
+    if state.watermark_id is not None:
+        rows = rows.filter(id__gt=state.watermark_id)
+    for business_id, day in rows.values_list('business_id', date_field).distinct():
+        touched[business_id].add(day)
+
+    # Only move past rows old enough that no earlier id can still commit
+    settled = rows.filter(created_at__lte=now - WATERMARK_OVERLAP).aggregate(Max('id'))['id__max']
+    if settled is not None:
+        state.watermark_id = settled
+    state.last_run_at = now
+    state.save()
+
+
+def _touched_laundry(now, touched):
+    """Add (business, day) pairs of laundry jobs changed since the last run."""
+    state = _state(LaundryJob._meta.db_table)
+    jobs = LaundryJob.objects.all()
+    if state.watermark_at is not None:
+        jobs = jobs.filter(updated_at__gt=state.watermark_at - WATERMARK_OVERLAP)
+    for business_id, day in jobs.values_list('business_id', 'received_date').distinct():
+        touched[business_id].add(day)
+    state.watermark_at = now
+    state.last_run_at = now
+    state.save()
+
+
+def _day_rows(business_id, days, now):
+    """Fresh day-grain rollup rows for one business and a set of days."""
+    sales, products = [], []
+    days = sorted(days)
+    for start in range(0, len(days), DAYS_PER_QUERY):
+        chunk = days[start:start + DAYS_PER_QUERY]
+
+        for stream, (queryset, business, date, count, revenue, tax, cost) in SALES_SOURCES.items():
+            totals = {
+                'transactions_sum': count,
+                'revenue_sum': Sum(revenue),
+                'tax_sum': Sum(tax),
+            }
+            if cost is not None:
+                totals['cost_sum'] = Sum(cost)
+            rows = (
+                queryset()
+                .filter(**{business: business_id, f'{date}__in': chunk})
+                .values(date)
+                .annotate(**totals)
+            )
+            for row in rows:
+                sales.append(SalesRollup(
+                    business_id=business_id,
+                    grain='day',
+                    period_start=row[date],
+                    stream=stream,
+                    transactions=row['transactions_sum'],
+                    revenue=row['revenue_sum'] or ZERO,
+                    tax_amount=row['tax_sum'] or ZERO,
+                    cost_amount=row.get('cost_sum') or ZERO,
+                    computed_at=now,
+                ))
+
+        for stream, (queryset, business, date, product, name, quantity, revenue) in PRODUCT_SOURCES.items():
+            fields = [date, product] + ([name] if name else [])
+            rows = (
+                queryset()
+                .filter(**{business: business_id, f'{date}__in': chunk})
+                .values(*fields)
+                .annotate(quantity_sum=quantity, revenue_sum=Sum(revenue))
+            )
+            for row in rows:
+                if name:
+                    key, label = f'{stream}:{row[product]}', row[name]
+                else:
+                    capacity = _number(row[product])
+                    key, label = f'{stream}:{capacity}kg', f'LPG {capacity}kg refill'
+                products.append(ProductSalesRollup(
+                    business_id=business_id,
+                    grain='day',
+                    period_start=row[date],
+                    product_key=key,
+                    product_name=label,
+                    quantity=row['quantity_sum'] or ZERO,
+                    revenue=row['revenue_sum'] or ZERO,
+                    computed_at=now,
+                ))
+    return sales, products
+
+
+def _period_rows(business_id, grain, periods, now):
+    """Week or month rollup rows rebuilt from the day rows they contain."""
+    trunc = TruncWeek if grain == 'week' else TruncMonth
+    span = 6 if grain == 'week' else 30
+    day_range = (min(periods), max(periods) + timedelta(days=span))
+
+    sales = (
+        SalesRollup.objects
+        .filter(business_id=business_id, grain='day', period_start__range=day_range)
+        .annotate(period=trunc('period_start'))
+        .filter(period__in=periods)
+        .values('period', 'stream')
+        .annotate(
+            transactions_sum=Sum('transactions'),
+            revenue_sum=Sum('revenue'),
+            tax_sum=Sum('tax_amount'),
+            cost_sum=Sum('cost_amount'),
+        )
+    )
+    products = (
+        ProductSalesRollup.objects
+        .filter(business_id=business_id, grain='day', period_start__range=day_range)
+        .annotate(period=trunc('period_start'))
+        .filter(period__in=periods)
+        .values('period', 'product_key')
+        .annotate(name=Max('product_name'), quantity_sum=Sum('quantity'), revenue_sum=Sum('revenue'))
+    )
+    return (
+        [
+            SalesRollup(
+                business_id=business_id, grain=grain, period_start=row['period'],
+                stream=row['stream'], transactions=row['transactions_sum'],
+                revenue=row['revenue_sum'], tax_amount=row['tax_sum'],
+                cost_amount=row['cost_sum'], computed_at=now,
+            )
+            for row in sales
+        ],
+        [
+            ProductSalesRollup(
+                business_id=business_id, grain=grain, period_start=row['period'],
+                product_key=row['product_key'], product_name=row['name'],
+                quantity=row['quantity_sum'], revenue=row['revenue_sum'], computed_at=now,
+            )
+            for row in products
+        ],
+    )
+
+
+def _replace(business_id, grain, periods, rows):
+    """Swap the rollup rows of the given periods for freshly computed ones."""
+    sales, products = rows
+    for model, new_rows in ((SalesRollup, sales), (ProductSalesRollup, products)):
+        # Delete first: a period or product can disappear (cancelled job)
+        model.objects.filter(
+            business_id=business_id, grain=grain, period_start__in=periods
+        ).delete()
+        model.objects.bulk_create(new_rows, batch_size=1000)
+
+
+def rebuild_rollups(business_id, days, now=None):
+    """
+    Recompute day rollups for the given days, then their weeks and months.
+
+    Days in closed accounting periods are left as frozen at close.
+    """
+    now = now or timezone.now()
+    days = set(days)
+    closed = set(AccountingPeriod.objects.filter(
+        business_id=business_id,
+        status='closed',
+        period_start__in={month_start(day) for day in days},
+    ).values_list('period_start', flat=True))
+    days = {day for day in days if month_start(day) not in closed}
+    if not days:
+        return
+    with transaction.atomic():
+        _replace(business_id, 'day', days, _day_rows(business_id, days, now))
+        for grain in ('week', 'month'):
+            periods = {PERIOD_START[grain](day) for day in days}
+            _replace(business_id, grain, periods, _period_rows(business_id, grain, periods, now))
+
+
+@django_rq.job('default')
+def refresh_rollups():
+    """
+    Bring the rollups up to date with sales recorded since the last run.
+
+    Scheduled every 15 minutes (see schedule_rollups). The first run
+    builds the full history. Safe to run twice: touched periods are
+    recomputed, not incremented.
+    """
+    now = timezone.now()
+    touched = defaultdict(set)
+    with transaction.atomic():
+        for model, date_field in ID_WATERMARKED.items():
+            _touched_by_id(model, date_field, now, touched)
+        _touched_laundry(now, touched)
+
+        for business_id in sorted(touched):
+            rebuild_rollups(business_id, touched[business_id], now)
+
+    stats = {
+        'businesses': len(touched),
+        'days': sum(len(days) for days in touched.values()),
+    }
+    logger.info("Sales rollups refreshed: %(days)d days across %(businesses)d businesses", stats)
+    return stats
+
+
+def schedule_rollups(cron_string='*/15 * * * *'):
+    """Register the rollup refresh with RQ-Scheduler (call once at deploy)."""
+    scheduler = django_rq.get_scheduler('default')
+    for scheduled in scheduler.get_jobs():
+        if scheduled.func_name.endswith('refresh_rollups'):
+            scheduler.cancel(scheduled)
+    return scheduler.cron(cron_string, func=refresh_rollups, queue_name='default')
+
+
+# -----------------------------------------------------------------------------
+# Chart API
+# -----------------------------------------------------------------------------
+
+def _number(value):
+    """Whole amounts as int, anything with cents as float (compact JSON)."""
+    value = value or ZERO
+    return int(value) if value == value.to_integral_value() else float(round(value, 2))
+
+
+def _next_period(grain, start):
+    if grain == 'day':
+        return start + timedelta(days=1)
+    if grain == 'week':
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _periods(grain, date_from, date_to):
+    start = PERIOD_START[grain](date_from)
+    periods = []
+    while start <= date_to:
+        periods.append(start)
+        start = _next_period(grain, start)
+    return periods
+
+
+def _trend_filter(grain, periods, date_from, date_to):
+    """Periods inside the range from their own rows, partial edge periods from day rows."""
+    whole = [
+        period for period in periods
+        if period >= date_from and _next_period(grain, period) - timedelta(days=1) <= date_to
+    ]
+    if not whole:
+        return Q(grain='day', period_start__range=(date_from, date_to))
+    return (
+        Q(grain=grain, period_start__in=whole)
+        | Q(grain='day', period_start__gte=date_from, period_start__lt=whole[0])
+        | Q(grain='day', period_start__gte=_next_period(grain, whole[-1]), period_start__lte=date_to)
+    )
+
+
+def _label(grain, period):
+    return period.strftime('%Y-%m') if grain == 'month' else period.isoformat()
+
+
+@reporting()
+def sales_trend(business_ids, date_from, date_to, grain='month', metric='revenue', streams=None):
+    """
+    Sales series per stream for a chart.
+
+    metric is 'revenue' (net of VAT), 'margin' (net revenue less stored
+    cost) or 'transactions'. A first or last period the range only partly
+    covers counts just the days inside the range. Periods with no sales
+    are zero-filled. Returns
+    {'grain', 'metric', 'labels': [...], 'series': {stream: [...]},
+    'total': [...]}.
+    """
+    if grain not in PERIOD_START:
+        raise ValueError(f"Unknown grain: {grain}")
+    if date_to < date_from:
+        raise ValueError("Trend end date is before its start date.")
+    periods = _periods(grain, date_from, date_to)
+    index = {period: position for position, period in enumerate(periods)}
+
+    rows = SalesRollup.objects.filter(
+        _trend_filter(grain, periods, date_from, date_to), business_id__in=business_ids
+    )
+    if streams:
+        rows = rows.filter(stream__in=streams)
+    rows = rows.values('period_start', 'stream').annotate(
+        transactions_sum=Sum('transactions'),
+        revenue_sum=Sum('revenue'),
+        tax_sum=Sum('tax_amount'),
+        cost_sum=Sum('cost_amount'),
+    )
+
+    series = {}
+    total = [ZERO] * len(periods)
+    for row in rows:
+        if metric == 'revenue':
+            value = row['revenue_sum'] - row['tax_sum']
+        elif metric == 'margin':
+            value = row['revenue_sum'] - row['tax_sum'] - row['cost_sum']
+        elif metric == 'transactions':
+            value = Decimal(row['transactions_sum'])
+        else:
+            raise ValueError(f"Unknown metric: {metric}")
+        # Day rows of an edge period add into the period they fall in
+        position = index[PERIOD_START[grain](row['period_start'])]
+        values = series.setdefault(row['stream'], [ZERO] * len(periods))
+        values[position] += value
+        total[position] += value
+
+    return {
+        'grain': grain,
+        'metric': metric,
+        'labels': [_label(grain, period) for period in periods],
+        'series': {stream: [_number(v) for v in values] for stream, values in sorted(series.items())},
+        'total': [_number(v) for v in total],
+    }
+
+
+def _covering_filter(date_from, date_to):
+    """Whole months inside the range from month rows, the ragged edges from day rows."""
+    first_month = month_start(date_from)
+    if first_month < date_from:
+        first_month = (first_month + timedelta(days=32)).replace(day=1)
+    months = []
+    month = first_month
+    while (month + timedelta(days=32)).replace(day=1) - timedelta(days=1) <= date_to:
+        months.append(month)
+        month = (month + timedelta(days=32)).replace(day=1)
+
+    if not months:
+        return Q(grain='day', period_start__range=(date_from, date_to))
+    after_months = (months[-1] + timedelta(days=32)).replace(day=1)
+    return (
+        Q(grain='month', period_start__in=months)
+        | Q(grain='day', period_start__gte=date_from, period_start__lt=months[0])
+        | Q(grain='day', period_start__gte=after_months, period_start__lte=date_to)
+    )
+
+
+@reporting()
+def top_products(business_ids, date_from, date_to, limit=10, order_by='revenue', stream=None):
+    """
+    Best-selling products over any date range.
+
+    order_by is 'revenue' or 'quantity'. Returns {'columns': [...],
+    'rows': [[name, quantity, revenue], ...]}, best first.
+    """
+    if order_by not in ('revenue', 'quantity'):
+        raise ValueError(f"Unknown ordering: {order_by}")
+    rows = ProductSalesRollup.objects.filter(
+        _covering_filter(date_from, date_to), business_id__in=business_ids
+    )
+    if stream:
+        rows = rows.filter(product_key__startswith=f'{stream}:')
+    rows = (
+        rows.values('product_key')
+        .annotate(name=Max('product_name'), quantity_sum=Sum('quantity'), revenue_sum=Sum('revenue'))
+        .order_by(f'-{order_by}_sum', 'product_key')[:limit]
+    )
+    return {
+        'columns': ['product', 'quantity', 'revenue'],
+        'rows': [
+            [row['name'], _number(row['quantity_sum']), _number(row['revenue_sum'])]
+            for row in rows
+        ],
+    }
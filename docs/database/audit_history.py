@@ -0,0 +1,356 @@
+"""
+Audit History - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Compact AuditLog storage and record rebuilds. Copy into
+core/audit_history.py.
+
+AuditLog used to store a record's full state on every save, so seven
+years of audit history outgrew the business data it describes. Rows for
+audited records now hold one of:
+- a snapshot (is_snapshot): the record's full state in new_data, written
+  on create and then every SNAPSHOT_EVERY rows of the record
+- a diff: only the fields that changed, with their new values, in
+  new_data
+- a delete: no data; the last state is in the rows before it (kept in
+  old_data only for a record with no earlier rows)
+old_data and changed_fields are no longer written: the old values of a
+diff are the state before it, and the changed fields are its keys. A
+save that changes nothing writes no row.
+
+record_state() rebuilds a record as of any moment from at most
+SNAPSHOT_EVERY rows, read with one index scan backwards on
+(table_name, record_id, created_at, id). record_history() replays a
+record's whole trail with old and new state per change. (Audit rows are
+appended under the chain head lock, so created_at follows id order.)
+Writers compute diffs against the state rebuilt the same way, under the
+audit chain head lock (hash_chain.py), so concurrent writers cannot diff
+against a stale state.
+
+history_view() is the history API: audit rows newest first, filtered by
+business, user, action, table and record, paged by keyset on
+(created_at, id) (pagination.py). Each filter has an index ending in
+(created_at, id), so any page - the first or the ten-thousandth - is one
+index range scan of ``limit`` rows.
+
+Deploy: existing rows hold full states. Run compact_history() once,
+before backfill_chains(AuditLog), to rewrite them in this format. Where
+the audit chain is already live, chained rows stay in full-state form
+(rewriting them would break their hashes) and are read as full states;
+the record's next SNAPSHOT_EVERY writes end in a snapshot as usual.
+benchmarks.audit_history_benchmark() measures storage and rebuild latency.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.dateparse import parse_datetime
+
+from django_models import AuditLog
+from hash_chain import AUDIT_CHAIN, append_audit_logs, lock_chain_heads
+from instrumentation import query_budget
+from pagination import KeysetPaginator, page_response
+
+
+# A record's full state is stored at least once every this many rows
+SNAPSHOT_EVERY = 50
+STREAM_CHUNK_SIZE = 5000
+
+RECORD_ACTIONS = ('create', 'update', 'delete')
+HISTORY_FIELDS = ('action', 'new_data', 'is_snapshot')
+
+HISTORY_COLUMNS = (
+    'id', 'created_at', 'table_name', 'record_id', 'action', 'business_id',
+    'changed_by_id', 'is_snapshot', 'old_data', 'new_data', 'changed_fields', 'ip_address',
+)
+
+
+def _json_state(data):
+    """The state as it reads back from JSONB (decimals and dates as strings)."""
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def _replay(rows, state=None, since_snapshot=0):
+    """
+    Fold (action, new_data, is_snapshot) rows, in id order, into a state.
+
+    Returns (state, rows since the last snapshot); state is None for a
+    deleted record or when the rows hold no snapshot. A create or update
+    with no state before it is a full-state row chained before
+    compact_history() ran, and is read as the state.
+    """
+    for action, values, is_snapshot in rows:
+        if is_snapshot:
+            state, since_snapshot = dict(values), 0
+            continue
+        since_snapshot += 1
+        if action == 'delete':
+            state = None
+        elif state is None:
+            state = dict(values) if values is not None else None
+        else:
+            state.update(values)
+    return state, since_snapshot
+
+
+def _encode(state, since_snapshot, action, data):
+    """
+    Storage form of a change: (new_data, is_snapshot, state, since_snapshot).
+
+    ``state`` and ``since_snapshot`` describe the record before the
+    change; the returned ones describe it after.
+    """
+    if action == 'delete':
+        return None, False, None, since_snapshot + 1
+    if state is None or since_snapshot + 1 >= SNAPSHOT_EVERY:
+        return data, True, data, 0
+    changes = {field: value for field, value in data.items() if state.get(field) != value}
+    return changes, False, dict(state, **changes), since_snapshot + 1
+
+
+def _current_states(keys):
+    """{(table_name, record_id): (state, since_snapshot)} with one query."""
+    record_ids = {}
+    for table_name, record_id in keys:
+        record_ids.setdefault(table_name, set()).add(record_id)
+    scope = Q()
+    for table_name, ids in record_ids.items():
+        scope |= Q(table_name=table_name, record_id__in=ids)
+
+    rows = {}
+    # The last SNAPSHOT_EVERY rows of a record always include a snapshot
+    for table_name, record_id, *row in AuditLog.objects.filter(scope).annotate(
+        recency=Window(
+            RowNumber(),
+            partition_by=[F('table_name'), F('record_id')],
+            order_by=F('id').desc(),
+        )
+    ).filter(recency__lte=SNAPSHOT_EVERY).order_by('id').values_list(
+        'table_name', 'record_id', *HISTORY_FIELDS
+    ):
+        rows.setdefault((table_name, record_id), []).append(row)
+    return {key: _replay(key_rows) for key, key_rows in rows.items()}
+
+
+@transaction.atomic
+def write_audit_entries(entries):
+    """
+    Write create/update/delete audit entries in the compact format.
+
+    Each entry is a dict with table_name, record_id, action, data (the
+    record's full state after the change, or before a delete),
+    changed_by_id and business_id. Returns the AuditLog rows written.
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+    # Writers queue on the chain head, so the states read below are current
+    lock_chain_heads({AUDIT_CHAIN})
+    states = _current_states({(entry['table_name'], entry['record_id']) for entry in entries})
+
+    rows = []
+    for entry in entries:
+        key = (entry['table_name'], entry['record_id'])
+        state, since_snapshot = states.get(key, (None, 0))
+        data = _json_state(entry['data'])
+        # A record deleted with no audit history keeps its last state
+        old_data = data if entry['action'] == 'delete' and state is None else None
+        values, is_snapshot, state, since_snapshot = _encode(
+            state, since_snapshot, entry['action'], data
+        )
+        if values == {} and not is_snapshot:
+            continue
+        states[key] = (state, since_snapshot)
+        rows.append(AuditLog(
+            table_name=entry['table_name'],
+            record_id=entry['record_id'],
+            action=entry['action'],
+            old_data=old_data,
+            new_data=values,
+            is_snapshot=is_snapshot,
+            changed_by_id=entry['changed_by_id'],
+            business_id=entry['business_id'],
+        ))
+    return append_audit_logs(rows)
+
+
+# -----------------------------------------------------------------------------
+# Rebuilds
+# -----------------------------------------------------------------------------
+
+def record_state(table_name, record_id, at=None):
+    """
+    A record's full state as of ``at`` (default: now), from its audit rows.
+
+    Returns None if the record did not exist yet or had been deleted.
+    """
+    rows = AuditLog.objects.filter(table_name=table_name, record_id=record_id)
+    if at is not None:
+        rows = rows.filter(created_at__lte=at)
+    recent = list(rows.order_by('-created_at', '-id').values_list(*HISTORY_FIELDS)[:SNAPSHOT_EVERY])
+    state, _ = _replay(reversed(recent))
+    return state
+
+
+def record_history(table_name, record_id):
+    """
+    Yield a record's changes in order, as dicts with created_at, action,
+    changed_by_id, changed_fields and the old and new full state.
+    """
+    state = None
+    for row in AuditLog.objects.filter(
+        table_name=table_name, record_id=record_id
+    ).order_by('id').values('created_at', 'changed_by_id', *HISTORY_FIELDS):
+        old = state
+        state, _ = _replay([(row['action'], row['new_data'], row['is_snapshot'])], state and dict(state))
+        if row['is_snapshot']:
+            changed = sorted(field for field in state if old is None or old.get(field) != state[field])
+        else:
+            changed = sorted(row['new_data'] or old or [])
+        yield {
+            'created_at': row['created_at'],
+            'action': row['action'],
+            'changed_by_id': row['changed_by_id'],
+            'changed_fields': changed,
+            'old': old,
+            'new': state,
+        }
+
+
+def compact_history(batch_size=STREAM_CHUNK_SIZE):
+    """
+    Rewrite full-state audit rows in the compact format.
+
+    One-off, during the deploy window and before backfill_chains(AuditLog).
+    Chained rows are left as they are, since rewriting them would break
+    their hashes; _replay() reads them as full states. Returns the number
+    of rows rewritten.
+    """
+    rewritten = 0
+    batch = []
+    key = None
+    state, since_snapshot = None, 0
+    rows = AuditLog.objects.filter(action__in=RECORD_ACTIONS, row_hash='').order_by(
+        'table_name', 'record_id', 'id'
+    ).only('id', 'table_name', 'record_id', 'action', 'old_data', 'new_data').iterator(chunk_size=batch_size)
+    for row in rows:
+        if (row.table_name, row.record_id) != key:
+            key = (row.table_name, row.record_id)
+            state, since_snapshot = None, 0
+        if row.action != 'delete' or state is not None:
+            row.old_data = None
+        row.new_data, row.is_snapshot, state, since_snapshot = _encode(
+            state, since_snapshot, row.action, row.new_data
+        )
+        row.changed_fields = None
+        batch.append(row)
+        if len(batch) >= batch_size:
+            AuditLog.objects.bulk_update(batch, ['new_data', 'old_data', 'changed_fields', 'is_snapshot'])
+            rewritten += len(batch)
+            batch = []
+    if batch:
+        AuditLog.objects.bulk_update(batch, ['new_data', 'old_data', 'changed_fields', 'is_snapshot'])
+        rewritten += len(batch)
+    return rewritten
+
+
+# -----------------------------------------------------------------------------
+# History API
+# -----------------------------------------------------------------------------
+
+# Newest first on (created_at, id); checks an index serves each filter
+HISTORY_PAGINATOR = KeysetPaginator(AuditLog, prefixes=[
+    (),
+    ('table_name', 'record_id'),
+    ('table_name',),
+    ('business',),
+    ('changed_by',),
+    ('action',),
+])
+
+
+def history_queryset(business_ids=None, changed_by_id=None, action=None, table_name=None,
+                     record_id=None, since=None, until=None):
+    """
+    Audit rows matching the filters, newest first.
+
+    ``business_ids`` restricts to those businesses (None: all). Page it
+    with HISTORY_PAGINATOR, or walk it with HISTORY_PAGINATOR.iterate().
+    """
+    rows = AuditLog.objects.all()
+    if business_ids is not None:
+        rows = rows.filter(business_id__in=business_ids)
+    if changed_by_id is not None:
+        rows = rows.filter(changed_by_id=changed_by_id)
+    if action:
+        rows = rows.filter(action=action)
+    if table_name:
+        rows = rows.filter(table_name=table_name)
+    if record_id is not None:
+        rows = rows.filter(record_id=record_id)
+    if since is not None:
+        rows = rows.filter(created_at__gte=since)
+    if until is not None:
+        rows = rows.filter(created_at__lt=until)
+    return rows.order_by(*HISTORY_PAGINATOR.order_by)
+
+
+def _datetime_param(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    return parsed
+
+
+def _history_row(row):
+    if row['changed_fields'] is None and not row['is_snapshot'] and row['action'] == 'update':
+        row['changed_fields'] = sorted(row['new_data'] or {})
+    return row
+
+
+@query_budget(max_queries=4)  # session, user, business access, page
+def history_view(request):
+    """
+    GET the audit history, newest first.
+
+    Filters: business, user, action, table, record, since, until (ISO
+    datetimes). Pages with ``limit`` and ``cursor``, the ``next`` value of
+    the previous page (pagination.py). Owners see every business;
+    accountants see the businesses they have access to.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if not (user.is_owner or user.is_superuser or user.is_accountant):
+        return HttpResponseForbidden()
+
+    params = request.GET
+    try:
+        business_ids = None
+        if params.get('business'):
+            business_ids = [int(params['business'])]
+            if not user.has_business_access(business_ids[0]):
+                return HttpResponseForbidden()
+        elif not (user.is_owner or user.is_superuser):
+            business_ids = list(user.businesses.values_list('id', flat=True))
+        rows = history_queryset(
+            business_ids=business_ids,
+            changed_by_id=int(params['user']) if params.get('user') else None,
+            action=params.get('action'),
+            table_name=params.get('table'),
+            record_id=int(params['record']) if params.get('record') else None,
+            since=_datetime_param(params.get('since')),
+            until=_datetime_param(params.get('until')),
+        )
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return page_response(request, HISTORY_PAGINATOR, rows, HISTORY_COLUMNS, _history_row)
@@ -0,0 +1,561 @@
+"""
+Benchmark Suite - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Benchmarks for the hot paths the mission cares about: recording a sale,
+posting a journal, loading the dashboard, generating a P&L or cashflow
+and syncing an offline device. Copy into core/benchmarks.py.
+
+Data sizes
+----------
+Run against a local PostgreSQL database per size, each filled once with
+synthetic_data.generate_history():
+
+    prepare_dataset('medium')        # 365 days of trading
+    run_suite('medium', 'bench/medium.json', baseline='bench/medium.baseline.json')
+
+Every benchmark is timed over several iterations after a warm-up, with
+its queries counted (instrumentation.record_queries). Benchmarks that
+write run inside a transaction that is rolled back, so the dataset is
+identical for every run and every iteration.
+
+Results and baselines
+---------------------
+Results are JSON: p50/p95/p99 and mean latency, throughput (units per
+second, e.g. journal entries for the batch benchmark) and query counts
+per benchmark, plus the dataset's row counts. compare() flags a
+regression when p95 grows beyond the tolerance or any benchmark issues
+more queries than in the baseline (query counts are deterministic, so
+any increase is a real change).
+
+The ledger_list_page_* benchmarks read page 1 and page 1000 of the
+retail ledger list through its keyset cursor, and page 1000 with OFFSET
+for comparison: the keyset pages should cost the same.
+
+audit_history_benchmark() writes a long audit trail for a sample of
+laundry jobs (rolled back) and reports the compact format's storage
+against full-state rows under 'audit_storage', and record_state()
+rebuild latency as the 'audit_rebuild_state' benchmark.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import json
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from decimal import Decimal
+
+from audit_history import record_state, write_audit_entries
+from cashflow import cashflow_statement
+from costing import gross_margin
+from django_models import (
+    AuditLog,
+    InventoryCostLayer,
+    JournalEntry,
+    LaundryJob,
+    LaundryJobItem,
+    LaundryOverdueSummary,
+    LaundryServiceType,
+    Ledger,
+    RetailInventory,
+    RetailLPGExchange,
+    RetailSaleItem,
+    TransactionType,
+    WaterSale,
+)
+from instrumentation import record_queries
+from laundry_services import create_laundry_job, price_job_item
+from ledger_posting import get_accounts, post_journal_entries, post_journal_entry
+from load_test import ReferenceContext, summarize
+from lpg_services import fleet_dashboard, record_lpg_exchange
+from pagination import LIST_DATASETS
+from period_close import profit_and_loss
+from retail_services import record_retail_sale
+from synthetic_data import generate_history
+from water_services import record_water_sales
+
+
+# Days of synthetic history per data size
+SIZES = {
+    'small': 30,
+    'medium': 365,
+    'large': 1095,
+}
+
+DEFAULT_ITERATIONS = 30
+WARMUP_ITERATIONS = 3
+DEFAULT_TOLERANCE = 0.20
+
+# Offline devices replay their queue in one request on reconnect
+SYNC_QUEUE_LENGTH = 25
+
+_benchmarks = {}
+
+
+def benchmark(name, units=1, writes=False, iterations=DEFAULT_ITERATIONS):
+    """
+    Register a benchmark.
+
+    ``units`` is how many items one call processes (for throughput);
+    ``writes`` rolls every iteration back.
+    """
+    def decorator(func):
+        _benchmarks[name] = {'func': func, 'units': units, 'writes': writes, 'iterations': iterations}
+        return func
+    return decorator
+
+
+def prepare_dataset(size, start_date=None, seed=42):
+    """Fill the current (empty) database with the synthetic history for a size."""
+    days = SIZES[size]
+    if start_date is None:
+        start_date = timezone.localdate() - timedelta(days=days)
+    return generate_history(start_date, days, seed=seed)
+
+
+def _laundry_items(ctx, rng, count=4):
+    items = []
+    for _ in range(count):
+        service_type = rng.choice(ctx.service_types)
+        item = {'service_type_id': service_type.id, 'item_description': 'Benchmark', 'quantity': 2}
+        if service_type.pricing_type == 'per_kg':
+            item['weight_kg'] = Decimal('5.0')
+        items.append(item)
+    return items
+
+
+# -----------------------------------------------------------------------------
+# Sale recording
+# -----------------------------------------------------------------------------
+
+@benchmark('record_sale_water', writes=True)
+def bench_water_sale(ctx, rng):
+    record_water_sales(
+        ctx.water,
+        [{'product_size_id': rng.choice(ctx.water_size_ids), 'quantity_sold': 2, 'payment_method': 'cash'}],
+        ctx.today,
+        ctx.user,
+    )
+
+
+@benchmark('record_sale_retail', writes=True)
+def bench_retail_sale(ctx, rng):
+    product_ids = rng.sample(ctx.retail_product_ids, min(len(ctx.retail_product_ids), 3))
+    record_retail_sale(
+        ctx.retail, [{'product_id': product_id, 'quantity': 1} for product_id in product_ids], 'm_pesa', ctx.user,
+    )
+
+
+@benchmark('record_sale_lpg_exchange', writes=True)
+def bench_lpg_exchange(ctx, rng):
+    record_lpg_exchange(ctx.retail, rng.choice(ctx.full_cylinder_ids), Decimal('200.00'), 'm_pesa', ctx.user)
+
+
+@benchmark('record_laundry_job_bulk', writes=True)
+def bench_laundry_job_bulk(ctx, rng):
+    create_laundry_job(ctx.laundry, rng.choice(ctx.laundry_customers), _laundry_items(ctx, rng, 8), ctx.user)
+
+
+@benchmark('record_laundry_job_per_save', writes=True)
+def bench_laundry_job_per_save(ctx, rng):
+    """The pre-service path: one save() per item, header re-saved to keep totals in sync."""
+    service_types = {service_type.id: service_type for service_type in LaundryServiceType.objects.filter(is_active=True)}
+    job = LaundryJob(
+        business=ctx.laundry,
+        customer=rng.choice(ctx.laundry_customers),
+        received_date=ctx.today,
+        received_by=ctx.user,
+    )
+    job.save()
+    for item in _laundry_items(ctx, rng, 8):
+        service_type = service_types[item['service_type_id']]
+        unit_price, line_total = price_job_item(service_type, item['quantity'], item.get('weight_kg'))
+        LaundryJobItem(
+            job=job, service_type=service_type, item_description=item['item_description'],
+            quantity=item['quantity'], unit_price=unit_price, line_total=line_total,
+        ).save()
+        job.subtotal_amount += line_total
+        job.total_amount = job.subtotal_amount
+        job.save()
+
+
+# -----------------------------------------------------------------------------
+# Journal posting
+# -----------------------------------------------------------------------------
+
+def _entry_lines(ctx):
+    accounts = ctx.water_accounts
+    return [
+        (accounts['cash'], True, Decimal('100.00'), 'Benchmark'),
+        (accounts['revenue'], False, Decimal('100.00'), 'Benchmark'),
+    ]
+
+
+@benchmark('post_journal_single', writes=True)
+def bench_post_single(ctx, rng):
+    post_journal_entry(ctx.water, 'SALE', ctx.today, 'Benchmark entry', _entry_lines(ctx), ctx.user)
+
+
+@benchmark('post_journal_batch_100', units=100, writes=True, iterations=10)
+def bench_post_batch(ctx, rng):
+    post_journal_entries([
+        {
+            'business': ctx.water,
+            'transaction_type': ctx.sale_type,
+            'transaction_date': ctx.today,
+            'description': f'Benchmark entry {index}',
+            'created_by': ctx.user,
+            'lines': _entry_lines(ctx),
+        }
+        for index in range(100)
+    ])
+
+
+# -----------------------------------------------------------------------------
+# Dashboard and reports
+# -----------------------------------------------------------------------------
+
+@benchmark('dashboard_load')
+def bench_dashboard(ctx, rng):
+    """What the owner's dashboard reads: margins today, LPG fleet, laundry overdue."""
+    for business in (ctx.water, ctx.laundry, ctx.retail):
+        gross_margin.uncached(business, ctx.today, ctx.today)
+    fleet_dashboard(ctx.retail)
+    list(LaundryOverdueSummary.objects.all())
+
+
+@benchmark('pnl_month')
+def bench_pnl_month(ctx, rng):
+    profit_and_loss(ctx.retail, ctx.today.replace(day=1), ctx.today)
+
+
+@benchmark('pnl_year', iterations=10)
+def bench_pnl_year(ctx, rng):
+    profit_and_loss(ctx.retail, ctx.today - timedelta(days=365), ctx.today)
+
+
+@benchmark('cashflow_year', iterations=10)
+def bench_cashflow_year(ctx, rng):
+    cashflow_statement(ctx.today - timedelta(days=365), ctx.today)
+
+
+@benchmark('gross_margin_year_stored_cost', iterations=10)
+def bench_margin_stored(ctx, rng):
+    gross_margin.uncached(ctx.retail, ctx.today - timedelta(days=365), ctx.today)
+
+
+@benchmark('gross_margin_year_fifo_replay', iterations=5)
+def bench_margin_replay(ctx, rng):
+    """
+    The pre-costing-engine approach: replay every receipt and sale of the
+    year through FIFO in Python to find the cost of goods sold.
+    """
+    date_from = ctx.today - timedelta(days=365)
+    layers = defaultdict(list)
+    for sku_id, quantity, unit_cost in InventoryCostLayer.objects.filter(
+        business=ctx.retail, sku_type='retail'
+    ).order_by('received_date', 'id').values_list('sku_id', 'quantity_received', 'unit_cost').iterator(chunk_size=2000):
+        layers[sku_id].append([quantity, unit_cost])
+    fallback = dict(
+        RetailInventory.objects.filter(business=ctx.retail).values_list('product_id', 'buying_price')
+    )
+
+    revenue = cost = Decimal('0.00')
+    for product_id, quantity, line_total in RetailSaleItem.objects.filter(
+        sale__business=ctx.retail, sale__sale_date__range=(date_from, ctx.today)
+    ).order_by('sale__sale_date', 'id').values_list('product_id', 'quantity', 'line_total').iterator(chunk_size=2000):
+        revenue += line_total
+        for layer in layers[product_id]:
+            taken = min(quantity, layer[0])
+            layer[0] -= taken
+            quantity -= taken
+            cost += taken * layer[1]
+            if not quantity:
+                break
+        cost += quantity * fallback.get(product_id, Decimal('0.00'))
+    return revenue - cost
+
+
+# -----------------------------------------------------------------------------
+# Offline sync
+# -----------------------------------------------------------------------------
+
+@benchmark('offline_sync_replay', units=SYNC_QUEUE_LENGTH, writes=True, iterations=10)
+def bench_offline_sync(ctx, rng):
+    """
+    A device coming back online replays its queued laundry jobs in one
+    request, then pulls what changed on the server since its last sync.
+    """
+    since = timezone.now() - timedelta(hours=8)
+    for _ in range(SYNC_QUEUE_LENGTH):
+        create_laundry_job(ctx.laundry, rng.choice(ctx.laundry_customers), _laundry_items(ctx, rng, 3), ctx.user)
+    list(LaundryJob.objects.filter(business=ctx.laundry, updated_at__gte=since).values(
+        'id', 'job_number', 'status', 'balance_due', 'updated_at'
+    ))
+
+
+# -----------------------------------------------------------------------------
+# List pages
+# -----------------------------------------------------------------------------
+
+LIST_PAGE_SIZE = 50
+DEEP_PAGE = 1000
+
+
+def _ledger_list(ctx):
+    return Ledger.objects.filter(business=ctx.retail)
+
+
+@benchmark('ledger_list_page_1')
+def bench_list_first_page(ctx, rng):
+    paginator, _, fields = LIST_DATASETS['ledger']
+    paginator.page(_ledger_list(ctx), None, LIST_PAGE_SIZE, fields)
+
+
+@benchmark('ledger_list_page_1000')
+def bench_list_deep_page(ctx, rng):
+    """Page 1000 from the cursor that came with page 999."""
+    paginator, _, fields = LIST_DATASETS['ledger']
+    paginator.page(_ledger_list(ctx), ctx.deep_page_cursor, LIST_PAGE_SIZE, fields)
+
+
+@benchmark('ledger_list_page_1000_offset', iterations=10)
+def bench_list_deep_offset(ctx, rng):
+    """The same page with OFFSET, as list views paged before pagination.py."""
+    paginator, _, fields = LIST_DATASETS['ledger']
+    offset = (DEEP_PAGE - 1) * LIST_PAGE_SIZE
+    list(_ledger_list(ctx).order_by(*paginator.order_by).values(*fields)[offset:offset + LIST_PAGE_SIZE])
+
+
+# -----------------------------------------------------------------------------
+# Audit history
+# -----------------------------------------------------------------------------
+
+AUDIT_RECORDS = 200
+AUDIT_VERSIONS = 120
+AUDIT_LOOKUPS = 300
+
+
+def _laundry_job_versions(job, versions, rng):
+    """Successive full states of a laundry job, as its saves would audit them."""
+    state = {field.attname: field.value_from_object(job) for field in LaundryJob._meta.concrete_fields}
+    statuses = [status for status, _ in LaundryJob.STATUS_CHOICES]
+    moment = timezone.now()
+    for _ in range(versions):
+        moment += timedelta(minutes=rng.randint(1, 600))
+        state = dict(state, updated_at=moment)
+        if rng.random() < 0.5:
+            state['status'] = rng.choice(statuses)
+        else:
+            paid = min(state['total_amount'], state['amount_paid'] + Decimal(rng.randint(10, 200)))
+            state.update(amount_paid=paid, balance_due=state['total_amount'] - paid)
+        yield state
+
+
+def audit_history_benchmark(records=AUDIT_RECORDS, versions=AUDIT_VERSIONS,
+                            lookups=AUDIT_LOOKUPS, seed=7):
+    """
+    Storage and rebuild latency of the compact audit format.
+
+    Writes ``versions`` saves of each of ``records`` laundry jobs through
+    write_audit_entries(), in a transaction that is rolled back, then
+    measures:
+    - storage: bytes of the rows' JSON (pg_column_size) against the full
+      state every row stored before, and the ratio
+    - rebuild: latency and queries of record_state() as of random points
+      in a job's history, checked against the state written there
+    Returns (storage, rebuild stats in the suite's format).
+    """
+    rng = random.Random(seed)
+    table_name = LaundryJob._meta.db_table
+    jobs = list(LaundryJob.objects.order_by('id')[:records])
+    expected = {}
+    with transaction.atomic():
+        after_id = AuditLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        histories = {job.id: _laundry_job_versions(job, versions, rng) for job in jobs}
+        full_states = []
+        for version in range(versions):
+            entries = []
+            for job in jobs:
+                state = next(histories[job.id])
+                entries.append({
+                    'table_name': table_name,
+                    'record_id': job.id,
+                    'action': 'create' if version == 0 else 'update',
+                    'data': state,
+                    'changed_by_id': job.received_by_id,
+                    'business_id': job.business_id,
+                })
+                full_states.append(json.dumps(state, cls=DjangoJSONEncoder))
+                expected[job.id, version] = json.loads(full_states[-1])
+            write_audit_entries(entries)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE is_snapshot),
+                       SUM(COALESCE(pg_column_size(old_data), 0)
+                           + COALESCE(pg_column_size(new_data), 0)
+                           + COALESCE(pg_column_size(changed_fields), 0))
+                FROM audit_log WHERE id > %s
+                """,
+                [after_id],
+            )
+            rows, snapshots, compact_bytes = cursor.fetchone()
+            cursor.execute(
+                "SELECT SUM(pg_column_size(state::jsonb)) FROM unnest(%s::text[]) AS state",
+                [full_states],
+            )
+            full_bytes = cursor.fetchone()[0]
+
+        moments = defaultdict(list)
+        for record_id, created_at in AuditLog.objects.filter(id__gt=after_id).order_by('id').values_list(
+            'record_id', 'created_at'
+        ):
+            moments[record_id].append(created_at)
+
+        samples = []
+        mismatches = 0
+        for _ in range(lookups):
+            job = rng.choice(jobs)
+            version = rng.randrange(versions)
+            with record_queries() as recorder:
+                state = record_state(table_name, job.id, moments[job.id][version])
+            samples.append(('audit_rebuild_state', 'ok', recorder.total_ms, recorder.queries))
+            mismatches += state != expected[job.id, version]
+        transaction.set_rollback(True)
+
+    storage = {
+        'records': len(jobs),
+        'versions_per_record': versions,
+        'rows': rows,
+        'snapshots': snapshots,
+        'compact_bytes': compact_bytes,
+        'full_state_bytes': full_bytes,
+        'ratio': round(full_bytes / compact_bytes, 2) if compact_bytes else None,
+    }
+    elapsed = sum(sample[2] for sample in samples) / 1000
+    rebuild = summarize(samples, elapsed)['audit_rebuild_state']
+    rebuild['units_per_call'] = 1
+    rebuild['mismatches'] = mismatches
+    return storage, rebuild
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+
+def _prepare_context():
+    ctx = ReferenceContext()
+    ctx.sale_type = TransactionType.objects.get(code='SALE')
+    ctx.water_accounts = get_accounts(ctx.water, 'cash', 'revenue')
+    # Last row of page 999 of the retail ledger (its last row on small datasets)
+    paginator, _, _ = LIST_DATASETS['ledger']
+    ledger = _ledger_list(ctx).order_by(*paginator.order_by)
+    ctx.deep_page_cursor = paginator.encode_cursor(
+        ledger[min((DEEP_PAGE - 1) * LIST_PAGE_SIZE, ledger.count()) - 1]
+    )
+    return ctx
+
+
+def _call(spec, ctx, rng):
+    if not spec['writes']:
+        spec['func'](ctx, rng)
+        return
+    with transaction.atomic():
+        spec['func'](ctx, rng)
+        transaction.set_rollback(True)
+
+
+def _row_counts():
+    return {
+        model._meta.db_table: model.objects.count()
+        for model in (Ledger, JournalEntry, WaterSale, LaundryJob, RetailSaleItem, RetailLPGExchange)
+    }
+
+
+def run_benchmarks(names=None, seed=7):
+    """Run the selected (default: all) benchmarks and return their statistics."""
+    ctx = _prepare_context()
+    results = {}
+    for name, spec in _benchmarks.items():
+        if names and name not in names:
+            continue
+        rng = random.Random(seed)
+        for _ in range(WARMUP_ITERATIONS):
+            _call(spec, ctx, rng)
+
+        samples = []
+        for _ in range(spec['iterations']):
+            with record_queries() as recorder:
+                _call(spec, ctx, rng)
+            samples.append((name, 'ok', recorder.total_ms, recorder.queries))
+
+        elapsed = sum(sample[2] for sample in samples) / 1000
+        stats = summarize(samples, elapsed)[name]
+        stats['units_per_call'] = spec['units']
+        stats['throughput_per_s'] = round(spec['units'] * len(samples) / elapsed, 2) if elapsed else None
+        results[name] = stats
+    return results
+
+
+def run_suite(size, output_path, baseline=None, tolerance=DEFAULT_TOLERANCE, names=None):
+    """
+    Run the suite, write JSON results and compare with a baseline file.
+
+    Returns (results, regressions).
+    """
+    results = {
+        'meta': {
+            'size': size,
+            'run_at': timezone.now().isoformat(),
+            'postgres': getattr(connection, 'pg_version', None),
+            'row_counts': _row_counts(),
+        },
+        'benchmarks': run_benchmarks(names),
+    }
+    if not names or 'audit_rebuild_state' in names:
+        results['audit_storage'], results['benchmarks']['audit_rebuild_state'] = audit_history_benchmark()
+    with open(output_path, 'w') as handle:
+        json.dump(results, handle, indent=2, default=str)
+
+    regressions = []
+    if baseline:
+        with open(baseline) as handle:
+            regressions = compare(results, json.load(handle), tolerance)
+    return results, regressions
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    List regressions of ``results`` against ``baseline`` (both run_suite JSON).
+
+    p95_ms and max_queries are None when a benchmark had no successful
+    call: a current None against a baseline figure is a regression, a
+    baseline None leaves nothing to compare with.
+    """
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous:
+            continue
+        # Both figures come from the same successful calls, so are None together
+        if current['p95_ms'] is None or previous['p95_ms'] is None:
+            if previous['p95_ms'] is not None:
+                regressions.append(f"{name}: no successful calls (baseline p95 {previous['p95_ms']} ms)")
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']} ms vs baseline {previous['p95_ms']} ms"
+            )
+        if current['max_queries'] > previous['max_queries']:
+            regressions.append(
+                f"{name}: {current['max_queries']} queries vs baseline {previous['max_queries']}"
+            )
+    return regressions
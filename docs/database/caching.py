@@ -0,0 +1,279 @@
+"""
+Service Cache - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Cache: Redis via django-redis (see docs/research/research_caching_strategy_20260128.md)
+
+Tag-based caching for service functions whose results are derived from
+models. Copy into core/caching.py and import it from an AppConfig.ready()
+so the invalidation signal handlers are connected.
+
+Keys
+----
+A cached result is stored under
+
+    fn:<function>:<args hash>:<tag versions hash>
+
+Tags name the data a result depends on:
+
+    <db_table>:<business_id>               any change for the business
+    <db_table>:<business_id>:<YYYY-MM-DD>  changes on one business day
+
+Each tag has a version number kept in the cache. Invalidating a tag
+replaces its version, so every key built from the old version is never
+read again and simply expires. No key scans (delete_pattern) are needed,
+and the scheme works on any Django cache backend.
+
+Invalidation
+------------
+post_save/post_delete on the sales, journal and inventory models bump the
+business tag and, for dated models, the day tag, once the surrounding
+transaction commits. Services that write with bulk_create() or
+QuerySet.update() (no signals) call invalidate() themselves.
+
+Stampedes
+---------
+On a miss only one caller recomputes (a cache.add() lock); concurrent
+callers wait briefly for its result instead of running the same query.
+
+Replica reads
+-------------
+A result computed from the read replica (db_routing.py) is kept for at
+most REPLICA_MAX_LAG_SECONDS: the replica may not have applied the write
+whose invalidation preceded the read, and the tag has already moved on.
+
+Tests
+-----
+Use the local-memory backend, or fakeredis behind the Redis backend:
+
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+        'OPTIONS': {'connection_class': fakeredis.FakeConnection},
+    }}
+
+LAST UPDATED: 2026-10-19
+"""
+
+import functools
+import hashlib
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+
+from db_routing import replica_max_lag, track_replica_reads
+from django_models import (
+    JournalEntry,
+    LaundryJob,
+    RetailInventory,
+    RetailLPGCylinder,
+    RetailLPGExchange,
+    RetailSale,
+    WaterInventory,
+    WaterSale,
+)
+
+
+DEFAULT_TIMEOUT = 300
+
+# Single-flight: how long a recompute may hold the lock, and how long
+# other callers wait for its result before computing it themselves
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+
+# Model -> business date field used for day tags (None: business tag only)
+INVALIDATING_MODELS = {
+    WaterSale: 'sale_date',
+    RetailSale: 'sale_date',
+    RetailLPGExchange: 'exchange_date',
+    LaundryJob: 'received_date',
+    JournalEntry: 'transaction_date',
+    WaterInventory: None,
+    RetailInventory: None,
+    RetailLPGCylinder: None,
+}
+
+_registered = set()
+
+
+def get_cache():
+    return caches[getattr(settings, 'SERVICE_CACHE_ALIAS', 'default')]
+
+
+def _table(model):
+    if isinstance(model, str):
+        return model
+    return model._meta.db_table
+
+
+def tag(model, business, day=None):
+    """Tag for a model's data within one business, optionally one day."""
+    business_id = getattr(business, 'pk', business)
+    if day is None:
+        return f"{_table(model)}:{business_id}"
+    return f"{_table(model)}:{business_id}:{day.isoformat()}"
+
+
+def _tag_versions(cache, tags):
+    """Current version of each tag, creating missing ones."""
+    keys = [f"tag:{name}" for name in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() keeps a version another process created meanwhile
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(tags):
+    cache = get_cache()
+    # A fresh timestamp rather than incr(): a version that was evicted and
+    # re-created can never match keys written under its previous value
+    cache.set_many({f"tag:{name}": time.time_ns() for name in tags}, timeout=None)
+
+
+def invalidate(model, business, days=()):
+    """
+    Invalidate cached results for a model in one business.
+
+    Bumps the business tag and the tag of every given day once the
+    current transaction commits (immediately outside a transaction).
+    """
+    tags = [tag(model, business)] + [tag(model, business, day) for day in set(days)]
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def _key_part(value):
+    if isinstance(value, models.Model):
+        return f"{value._meta.label}:{value.pk}"
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return '{' + ','.join(sorted(map(_key_part, value))) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(map(_key_part, value)) + ']'
+    return repr(value)
+
+
+def _digest(text):
+    return hashlib.md5(text.encode(), usedforsecurity=False).hexdigest()
+
+
+def _count(cache, name, event):
+    key = f"metrics:{name}:{event}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cached(tags, timeout=DEFAULT_TIMEOUT, name=None):
+    """
+    Cache a service function's result under tags.
+
+    ``tags`` is called with the function's arguments and returns the tag
+    strings (see tag()) the result depends on. Arguments must be model
+    instances, dates, plain values or sequences of those.
+
+    The wrapped function gains ``.uncached`` to bypass the cache.
+    """
+    def decorator(func):
+        cache_name = name or f"{func.__module__}.{func.__qualname__}"
+        _registered.add(cache_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            args_key = _digest('|'.join(
+                [_key_part(arg) for arg in args]
+                + [f"{k}={_key_part(v)}" for k, v in sorted(kwargs.items())]
+            ))
+            versions = _tag_versions(cache, tags(*args, **kwargs))
+            key = f"fn:{cache_name}:{args_key}:{_digest(repr(versions))}"
+
+            hit = cache.get(key)
+            if hit is not None:
+                _count(cache, cache_name, 'hits')
+                return hit[0]
+            _count(cache, cache_name, 'misses')
+
+            lock = f"lock:{key}"
+            if not cache.add(lock, 1, timeout=LOCK_TIMEOUT):
+                # Someone else is computing this value: wait for it
+                deadline = time.monotonic() + LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL)
+                    hit = cache.get(key)
+                    if hit is not None:
+                        _count(cache, cache_name, 'waits')
+                        return hit[0]
+                lock = None
+
+            try:
+                with track_replica_reads() as reads:
+                    value = func(*args, **kwargs)
+                ttl = timeout
+                if reads['replica'] and (ttl is None or ttl > replica_max_lag()):
+                    # Invalidation cannot reach a result the replica had not caught up on
+                    ttl = replica_max_lag()
+                # Wrapped so a cached None is distinguishable from a miss
+                cache.set(key, (value,), timeout=ttl)
+            finally:
+                if lock is not None:
+                    cache.delete(lock)
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """
+    Hit-rate metrics per cached function, shared across processes.
+
+    'waits' are misses served by another caller's recompute.
+    """
+    cache = get_cache()
+    stats = {}
+    for cache_name in sorted(_registered):
+        counts = cache.get_many([f"metrics:{cache_name}:{event}" for event in ('hits', 'misses', 'waits')])
+        hits = counts.get(f"metrics:{cache_name}:hits", 0)
+        misses = counts.get(f"metrics:{cache_name}:misses", 0)
+        waits = counts.get(f"metrics:{cache_name}:waits", 0)
+        calls = hits + misses
+        stats[cache_name] = {
+            'hits': hits,
+            'misses': misses,
+            'waits': waits,
+            'hit_rate': round((hits + waits) / calls, 4) if calls else None,
+        }
+    return stats
+
+
+def reset_cache_stats():
+    get_cache().delete_many([
+        f"metrics:{cache_name}:{event}"
+        for cache_name in _registered
+        for event in ('hits', 'misses', 'waits')
+    ])
+
+
+def _invalidate_instance(sender, instance, **kwargs):
+    date_field = INVALIDATING_MODELS[sender]
+    days = [getattr(instance, date_field)] if date_field else []
+    invalidate(sender, instance.business_id, days)
+
+
+for _model in INVALIDATING_MODELS:
+    post_save.connect(_invalidate_instance, sender=_model, dispatch_uid=f'cache_save_{_table(_model)}')
+    post_delete.connect(_invalidate_instance, sender=_model, dispatch_uid=f'cache_delete_{_table(_model)}')
@@ -0,0 +1,213 @@
+"""
+Cashflow Statement - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Per-business and consolidated cashflow statements, broken down by cash,
+M-Pesa and bank. Copy into financial/cashflow.py.
+
+Cash equivalents are the cash, M-Pesa and bank accounts of the chart
+(CHART_OF_ACCOUNTS) plus OTHER_CASH_EQUIVALENTS. Every ledger row on one
+of them is a cash movement: a debit flows in, a credit flows out. The
+row's TransactionType.cashflow_activity classifies it as operating,
+investing or financing, or as a transfer between cash accounts (deposits
+to the bank, transfers between businesses). The bank accounts are shared,
+so a business's bank position is the bank rows posted by that business.
+
+cashflow_statement() reads everything from one aggregate over the ledger
+rows of the cash accounts, grouped by business, account and activity.
+The same pass sums each business's rows before the period for the
+opening balances. It starts after the business's last closed month
+before the period, whose AccountBalance snapshot gives the opening, so
+it does not reach back to the start of the books.
+
+Consolidation adds the businesses up and eliminates transfers: money
+moved between the group's own cash accounts is neither earned nor spent.
+Matched transfer inflows and outflows are removed from the consolidated
+activities. A residual, such as a transfer with one leg still unposted,
+stays in the statement as unmatched_transfers so the cash still
+reconciles. Channel (cash/M-Pesa/bank) movements keep their transfers,
+since a deposit does move money from the till to the bank.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from datetime import date, timedelta
+
+from django.db import connections
+from decimal import Decimal
+
+from db_routing import reporting_alias
+from django_models import Account, AccountBalance, AccountingPeriod, Business
+from ledger_posting import CHART_OF_ACCOUNTS
+
+
+CASH_ROLES = ('cash', 'm_pesa', 'bank')
+# Cash-equivalent accounts outside CHART_OF_ACCOUNTS: account number -> channel
+OTHER_CASH_EQUIVALENTS = {'1171': 'bank'}
+
+ACTIVITIES = ('operating', 'investing', 'financing', 'transfer')
+ZERO = Decimal('0.00')
+
+CASH_MOVEMENTS_SQL = """
+    SELECT l.business_id, l.account_id, tt.cashflow_activity,
+           COALESCE(SUM(CASE WHEN l.is_debit THEN l.amount ELSE -l.amount END)
+                    FILTER (WHERE l.transaction_date < %(date_from)s), 0),
+           COALESCE(SUM(l.amount) FILTER (WHERE l.transaction_date >= %(date_from)s AND l.is_debit), 0),
+           COALESCE(SUM(l.amount) FILTER (WHERE l.transaction_date >= %(date_from)s AND NOT l.is_debit), 0)
+    FROM ledger l
+    JOIN transaction_type tt ON tt.id = l.transaction_type_id
+    JOIN unnest(%(business_ids)s::bigint[], %(scan_from)s::date[]) AS scan(business_id, scan_from)
+      ON scan.business_id = l.business_id
+    WHERE l.account_id = ANY(%(account_ids)s)
+      AND l.transaction_date >= scan.scan_from
+      AND l.transaction_date <= %(date_to)s
+    GROUP BY l.business_id, l.account_id, tt.cashflow_activity
+"""
+
+
+def cash_channels():
+    """{account_number: channel} of every cash-equivalent account."""
+    channels = {
+        number: role
+        for chart in CHART_OF_ACCOUNTS.values()
+        for role, number in chart.items()
+        if role in CASH_ROLES
+    }
+    channels.update(OTHER_CASH_EQUIVALENTS)
+    return channels
+
+
+def _flows():
+    return {'inflow': ZERO, 'outflow': ZERO, 'net': ZERO}
+
+
+def _statement():
+    return {
+        'opening': ZERO,
+        'closing': ZERO,
+        'net_change': ZERO,
+        'activities': {activity: _flows() for activity in ACTIVITIES},
+        'channels': {
+            channel: {'opening': ZERO, **_flows(), 'closing': ZERO} for channel in CASH_ROLES
+        },
+    }
+
+
+def _opening_snapshots(alias, businesses, date_from, account_ids):
+    """
+    Per business, the day after its last closed month before the period
+    and the snapshot balances of that month: ({business_id: scan_from},
+    {(business_id, account_id): balance}).
+    """
+    last_closed = {}
+    for business_id, period_end in AccountingPeriod.objects.using(alias).filter(
+        business__in=businesses, status='closed', period_end__lt=date_from,
+    ).values_list('business_id', 'period_end'):
+        last_closed[business_id] = max(period_end, last_closed.get(business_id, period_end))
+
+    balances = {}
+    if last_closed:
+        for business_id, account_id, balance_date, closing in AccountBalance.objects.using(alias).filter(
+            business_id__in=list(last_closed),
+            balance_date__in=set(last_closed.values()),
+            account_id__in=account_ids,
+        ).values_list('business_id', 'account_id', 'balance_date', 'closing_balance'):
+            if balance_date == last_closed[business_id]:
+                balances[business_id, account_id] = closing
+
+    scan_from = {
+        business.id: last_closed[business.id] + timedelta(days=1) if business.id in last_closed else date.min
+        for business in businesses
+    }
+    return scan_from, balances
+
+
+def cashflow_statement(date_from, date_to, businesses=None):
+    """
+    Cashflow of each business and of the group for a date range.
+
+    ``businesses`` defaults to every active business. Returns
+    {'businesses': {code: statement}, 'consolidated': statement} where a
+    statement holds opening and closing cash, net_change, inflow/outflow
+    per activity and per channel; the consolidated one also has
+    eliminated_transfers and unmatched_transfers.
+    """
+    alias = reporting_alias()
+    if businesses is None:
+        businesses = Business.objects.using(alias).filter(is_active=True)
+    businesses = sorted(businesses, key=lambda business: business.id)
+    channels = cash_channels()
+    accounts = dict(
+        Account.objects.using(alias).filter(account_number__in=list(channels))
+        .values_list('id', 'account_number')
+    )
+    channel_of = {account_id: channels[number] for account_id, number in accounts.items()}
+    scan_from, openings = _opening_snapshots(alias, businesses, date_from, list(accounts))
+
+    statements = {business.id: _statement() for business in businesses}
+    for (business_id, account_id), balance in openings.items():
+        statement = statements[business_id]
+        statement['channels'][channel_of[account_id]]['opening'] += balance
+        statement['opening'] += balance
+
+    with connections[alias].cursor() as cursor:
+        cursor.execute(CASH_MOVEMENTS_SQL, {
+            'business_ids': [business.id for business in businesses],
+            'scan_from': [scan_from[business.id] for business in businesses],
+            'account_ids': list(accounts),
+            'date_from': date_from,
+            'date_to': date_to,
+        })
+        for business_id, account_id, activity, before, inflow, outflow in cursor.fetchall():
+            statement = statements[business_id]
+            channel = statement['channels'][channel_of[account_id]]
+            channel['opening'] += before
+            statement['opening'] += before
+            channel['inflow'] += inflow
+            channel['outflow'] += outflow
+            flows = statement['activities'][activity]
+            flows['inflow'] += inflow
+            flows['outflow'] += outflow
+
+    for statement in statements.values():
+        _close(statement)
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'businesses': {business.code: statements[business.id] for business in businesses},
+        'consolidated': _consolidate(statements.values()),
+    }
+
+
+def _close(statement):
+    """Fill in the net and closing figures from opening, inflows and outflows."""
+    for flows in statement['activities'].values():
+        flows['net'] = flows['inflow'] - flows['outflow']
+    for channel in statement['channels'].values():
+        channel['net'] = channel['inflow'] - channel['outflow']
+        channel['closing'] = channel['opening'] + channel['net']
+    statement['net_change'] = sum((flows['net'] for flows in statement['activities'].values()), ZERO)
+    statement['closing'] = statement['opening'] + statement['net_change']
+
+
+def _consolidate(statements):
+    """Sum business statements and eliminate transfers between the group's cash accounts."""
+    consolidated = _statement()
+    for statement in statements:
+        consolidated['opening'] += statement['opening']
+        for activity, flows in statement['activities'].items():
+            for key in ('inflow', 'outflow'):
+                consolidated['activities'][activity][key] += flows[key]
+        for channel, flows in statement['channels'].items():
+            for key in ('opening', 'inflow', 'outflow'):
+                consolidated['channels'][channel][key] += flows[key]
+
+    transfers = consolidated['activities']['transfer']
+    eliminated = min(transfers['inflow'], transfers['outflow'])
+    transfers['inflow'] -= eliminated
+    transfers['outflow'] -= eliminated
+    _close(consolidated)
+    consolidated['eliminated_transfers'] = eliminated
+    consolidated['unmatched_transfers'] = transfers['net']
+    return consolidated
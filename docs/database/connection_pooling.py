@@ -0,0 +1,123 @@
+"""
+Connection Pooling - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.1+ (psycopg 3)
+
+Pooled connections and server-side prepared statements for the short,
+bursty mobile requests. Copy into core/connection_pooling.py and import
+it from an AppConfig.ready() so configure_connection is connected.
+
+Opening a PostgreSQL connection (TCP + TLS + auth + backend fork) costs
+several milliseconds on the VPS, often more than the queries of a "record
+a sale" request. A pool keeps connections open; because a prepared
+statement lives on its connection, pooling is also what makes statement
+preparation pay off across requests.
+
+    pip install "psycopg[binary,pool]"
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            ...
+            'CONN_MAX_AGE': 0,          # required with 'pool'
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'sslmode': 'require',
+                'connect_timeout': 10,
+                'pool': {'min_size': 4, 'max_size': 16, 'max_idle': 300, 'timeout': 10},
+                'server_side_binding': True,
+                'prepare_threshold': PREPARE_THRESHOLD,
+            },
+        },
+    }
+    DB_PREPARED_MAX = 200
+
+Prepared statements
+-------------------
+psycopg 3 prepares a statement server-side once the same SQL text has run
+prepare_threshold times on a connection; later executions skip parsing and
+planning. Preparation needs server-side parameter binding, hence
+'server_side_binding': True (Django's default client-side cursor never
+prepares). The hot ORM statements of a single-item request have stable SQL
+text, so they are prepared within a few requests of a pooled connection
+starting:
+- sale insert (LaundryJob/RetailLPGExchange INSERT ... RETURNING id, and
+  a one-row WaterSale/RetailSale bulk INSERT)
+- inventory decrement of a single-SKU sale or reversal (UPDATE ... SET
+  quantity = quantity - %s WHERE id = %s)
+- document number allocation (JournalEntry last entry_number per date)
+- dashboard aggregates (fleet_dashboard, gross_margin)
+Multi-SKU sales, batches and their reversals update stock with one CASE
+UPDATE and insert with one multi-row INSERT, whose SQL text depends on
+the number of SKUs or rows; they are prepared only once a shape repeats.
+One-off report SQL never reaches the threshold and stays unprepared.
+prepared_statements() lists what a connection has prepared.
+
+PgBouncer
+---------
+On Django 5.0 (no built-in pool) use PgBouncer in transaction mode (see
+migration_plan.md) with CONN_MAX_AGE = 0, and set
+'DISABLE_SERVER_SIDE_CURSORS': True, because a server-side cursor does
+not survive the pool switching backends between transactions (the
+exports and VAT return stream through one). Prepared statements then need
+PgBouncer 1.21+ with max_prepared_statements set; on older versions set
+'prepare_threshold': None.
+
+Benchmark: load_test.compare_connection_modes().
+
+LAST UPDATED: 2026-10-19
+"""
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+# Executions of the same SQL on a connection before psycopg prepares it
+PREPARE_THRESHOLD = 2
+
+
+@receiver(connection_created, dispatch_uid='configure_connection')
+def configure_connection(sender, connection, **kwargs):
+    """Size the per-connection prepared statement cache (psycopg 3 only)."""
+    if connection.vendor != 'postgresql':
+        return
+    prepared_max = getattr(settings, 'DB_PREPARED_MAX', None)
+    if prepared_max and hasattr(connection.connection, 'prepared_max'):
+        connection.connection.prepared_max = prepared_max
+
+
+def set_statement_preparation(enabled, connection=None):
+    """
+    Switch automatic statement preparation on or off for a connection.
+
+    Returns False when the driver does not support it (psycopg2).
+    """
+    connection = connection or default_connection
+    connection.ensure_connection()
+    if not hasattr(connection.connection, 'prepare_threshold'):
+        return False
+    connection.connection.prepare_threshold = PREPARE_THRESHOLD if enabled else None
+    return True
+
+
+def prepared_statements(connection=None):
+    """Statements prepared on a connection, most used first."""
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT statement, generic_plans + custom_plans AS executions
+            FROM pg_prepared_statements
+            ORDER BY executions DESC
+            """
+        )
+        return [{'statement': sql, 'executions': executions} for sql, executions in cursor.fetchall()]
+
+
+def pool_stats(connection=None):
+    """psycopg pool counters (requests, waits, connections), or None without a pool."""
+    connection = connection or default_connection
+    pool = getattr(connection, 'pool', None)
+    return pool.get_stats() if pool is not None else None
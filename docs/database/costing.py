@@ -0,0 +1,314 @@
+"""
+Inventory Costing - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Cost-of-goods engine driven by inventory movements. Copy into
+financial/costing.py.
+
+Receipts (purchases, water production, opening stock) add
+InventoryCostLayer rows; sales consume them and the resulting cost is
+written onto the sale line (RetailSaleItem, WaterSale, RetailLPGExchange)
+at write time, by the sale services (retail_services, water_services,
+lpg_services). Gross margin reports are then plain sums over the sales
+tables and never replay purchase history.
+
+The costing method is chosen per business (BusinessSettings.costing_method):
+- fifo: one layer per receipt, consumed oldest first
+- weighted_average: one open layer per SKU, re-averaged on every receipt
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from decimal import Decimal, ROUND_HALF_UP
+
+from caching import cached, tag
+from db_routing import reporting
+from django_models import (
+    BusinessSettings,
+    InventoryCostLayer,
+    RetailInventory,
+    RetailLPGExchange,
+    RetailSale,
+    RetailSaleItem,
+    WaterInventory,
+    WaterSale,
+)
+
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def _money(value):
+    """Round a Decimal to shillings and cents."""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_costing_method(business):
+    """Return 'fifo' or 'weighted_average' for a business."""
+    method = BusinessSettings.objects.filter(
+        business=business
+    ).values_list('costing_method', flat=True).first()
+    return method or BusinessSettings._meta.get_field('costing_method').default
+
+
+def _sku_filter(keys):
+    """OR together (sku_type, sku_id) conditions."""
+    return reduce(or_, [Q(sku_type=sku_type, sku_id=sku_id) for sku_type, sku_id in keys])
+
+
+@transaction.atomic
+def receive_stock(business, receipts, received_date, source):
+    """
+    Add cost layers for a batch of receipts.
+
+    ``receipts`` is a list of (sku_type, sku_id, quantity, unit_cost,
+    source_id) tuples. Under weighted_average, receipts are merged into the
+    SKU's open layer; under fifo each receipt becomes its own layer.
+    """
+    receipts = [receipt for receipt in receipts if receipt[2] > 0]
+    if not receipts:
+        return
+
+    if get_costing_method(business) == 'fifo':
+        InventoryCostLayer.objects.bulk_create([
+            InventoryCostLayer(
+                business=business,
+                sku_type=sku_type,
+                sku_id=sku_id,
+                source=source,
+                source_id=source_id,
+                received_date=received_date,
+                quantity_received=quantity,
+                quantity_remaining=quantity,
+                unit_cost=Decimal(unit_cost),
+            )
+            for sku_type, sku_id, quantity, unit_cost, source_id in receipts
+        ])
+        return
+
+    keys = sorted({(sku_type, sku_id) for sku_type, sku_id, _, _, _ in receipts})
+    open_layers = {
+        (layer.sku_type, layer.sku_id): layer
+        for layer in InventoryCostLayer.objects.select_for_update()
+        .filter(_sku_filter(keys), business=business, quantity_remaining__gt=0)
+        .order_by('sku_type', 'sku_id', 'id')
+    }
+
+    new_layers = {}
+    for sku_type, sku_id, quantity, unit_cost, source_id in receipts:
+        key = (sku_type, sku_id)
+        layer = open_layers.get(key) or new_layers.get(key)
+        if layer is None:
+            new_layers[key] = InventoryCostLayer(
+                business=business,
+                sku_type=sku_type,
+                sku_id=sku_id,
+                source=source,
+                source_id=source_id,
+                received_date=received_date,
+                quantity_received=quantity,
+                quantity_remaining=quantity,
+                unit_cost=Decimal(unit_cost),
+            )
+            continue
+        total_quantity = layer.quantity_remaining + quantity
+        layer.unit_cost = (
+            layer.quantity_remaining * layer.unit_cost + quantity * Decimal(unit_cost)
+        ) / total_quantity
+        layer.unit_cost = layer.unit_cost.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+        layer.quantity_remaining = total_quantity
+        layer.quantity_received += quantity
+
+    if open_layers:
+        InventoryCostLayer.objects.bulk_update(
+            open_layers.values(), ['unit_cost', 'quantity_remaining', 'quantity_received']
+        )
+    InventoryCostLayer.objects.bulk_create(new_layers.values())
+
+
+def _fallback_unit_costs(business, keys):
+    """Last known unit cost for SKUs that have run out of cost layers."""
+    retail_ids = [sku_id for sku_type, sku_id in keys if sku_type == 'retail']
+    water_ids = [sku_id for sku_type, sku_id in keys if sku_type == 'water']
+    costs = {}
+    for product_id, buying_price in RetailInventory.objects.filter(
+        business=business, product_id__in=retail_ids
+    ).values_list('product_id', 'buying_price'):
+        costs[('retail', product_id)] = buying_price
+    for size_id, unit_cost in WaterInventory.objects.filter(
+        business=business, product_size_id__in=water_ids, inventory_type='filled'
+    ).values_list('product_size_id', 'unit_cost'):
+        costs[('water', size_id)] = unit_cost
+    return costs
+
+
+@transaction.atomic
+def consume_stock(business, demands):
+    """
+    Consume cost layers for a batch of sale lines.
+
+    ``demands`` is a list of (sku_type, sku_id, quantity). Returns the cost
+    of each demand, in the same order. All affected layers are locked with
+    one SELECT and written back with one UPDATE. Quantities not covered by
+    layers (stock sold before it was received into the engine) are costed
+    at the last known buying price/unit cost.
+    """
+    demands = list(demands)
+    if not demands:
+        return []
+
+    keys = sorted({(sku_type, sku_id) for sku_type, sku_id, _ in demands})
+    layers_by_key = defaultdict(list)
+    for layer in (
+        InventoryCostLayer.objects.select_for_update()
+        .filter(_sku_filter(keys), business=business, quantity_remaining__gt=0)
+        .order_by('sku_type', 'sku_id', 'id')
+    ):
+        layers_by_key[(layer.sku_type, layer.sku_id)].append(layer)
+
+    remaining = {}
+    shortfalls = {}
+    costs = []
+    for index, (sku_type, sku_id, quantity) in enumerate(demands):
+        needed = quantity
+        cost = ZERO
+        for layer in layers_by_key[(sku_type, sku_id)]:
+            available = remaining.get(layer.id, layer.quantity_remaining)
+            if not available:
+                continue
+            taken = min(needed, available)
+            remaining[layer.id] = available - taken
+            cost += taken * layer.unit_cost
+            needed -= taken
+            if not needed:
+                break
+        if needed:
+            shortfalls[index] = needed
+        costs.append(cost)
+
+    if shortfalls:
+        fallback = _fallback_unit_costs(
+            business, {demands[index][:2] for index in shortfalls}
+        )
+        for index, quantity in shortfalls.items():
+            costs[index] += quantity * fallback.get(demands[index][:2], ZERO)
+
+    if remaining:
+        InventoryCostLayer.objects.filter(id__in=remaining).update(
+            quantity_remaining=Case(
+                *[When(id=layer_id, then=Value(quantity)) for layer_id, quantity in remaining.items()],
+                output_field=IntegerField(),
+            )
+        )
+
+    return [_money(cost) for cost in costs]
+
+
+def _unit_cost(cost_amount, quantity):
+    return _money(cost_amount / quantity) if quantity else ZERO
+
+
+def cost_retail_items(business, items):
+    """
+    Attach unit_cost and cost_amount to a batch of retail sale lines.
+
+    Call inside the sale transaction, before the lines are inserted.
+    Returns the cost of each line.
+    """
+    costs = consume_stock(
+        business,
+        [('retail', item.product_id, item.quantity) for item in items],
+    )
+    for item, cost in zip(items, costs):
+        item.cost_amount = cost
+        item.unit_cost = _unit_cost(cost, item.quantity)
+    return costs
+
+
+def cost_water_sales(business, sales):
+    """
+    Attach unit_cost and cost_amount to a batch of water sales.
+
+    Call inside the sale transaction, before the sales are inserted.
+    Returns the cost of each sale.
+    """
+    costs = consume_stock(
+        business,
+        [('water', sale.product_size_id, sale.quantity_sold) for sale in sales],
+    )
+    for sale, cost in zip(sales, costs):
+        sale.cost_amount = cost
+        sale.unit_cost = _unit_cost(cost, sale.quantity_sold)
+    return costs
+
+
+@transaction.atomic
+def load_opening_layers(business, as_of):
+    """
+    Seed opening cost layers from current stock levels.
+
+    Run once per business when the engine is switched on: retail stock at
+    its buying price and filled water at its unit cost.
+    """
+    receipts = [
+        ('retail', product_id, quantity, buying_price, None)
+        for product_id, quantity, buying_price in RetailInventory.objects.filter(
+            business=business, quantity_in_stock__gt=0
+        ).values_list('product_id', 'quantity_in_stock', 'buying_price')
+    ]
+    receipts += [
+        ('water', size_id, quantity, unit_cost, None)
+        for size_id, quantity, unit_cost in WaterInventory.objects.filter(
+            business=business, inventory_type='filled', quantity__gt=0
+        ).values_list('product_size_id', 'quantity', 'unit_cost')
+    ]
+    receive_stock(business, receipts, as_of, 'opening')
+
+
+@cached(lambda business, date_from, date_to: [
+    tag(WaterSale, business), tag(RetailSale, business), tag(RetailLPGExchange, business),
+])
+@reporting()
+def gross_margin(business, date_from, date_to):
+    """
+    Revenue (net of VAT), cost and margin per sales stream for a period.
+
+    Three aggregate queries over net amounts and costs already stored on
+    the sale lines (lines from before the VAT engine count their gross),
+    leaving out reversed sales, cached until a sale in the business
+    changes. Reads from the reporting
+    replica when it is usable.
+    """
+    money = DecimalField(max_digits=15, decimal_places=2)
+    streams = {
+        'water': WaterSale.objects.filter(
+            business=business, sale_date__range=(date_from, date_to)
+        ).exclude(journal_entry__status='reversed').aggregate(
+            revenue=Coalesce(Sum(Coalesce('net_amount', 'total_amount')), Value(ZERO), output_field=money),
+            cost=Coalesce(Sum('cost_amount'), Value(ZERO), output_field=money),
+        ),
+        'retail': RetailSaleItem.objects.filter(
+            sale__business=business, sale__sale_date__range=(date_from, date_to)
+        ).exclude(sale__journal_entry__status='reversed').aggregate(
+            revenue=Coalesce(Sum(Coalesce('net_amount', 'line_total')), Value(ZERO), output_field=money),
+            cost=Coalesce(Sum('cost_amount'), Value(ZERO), output_field=money),
+        ),
+        'lpg': RetailLPGExchange.objects.filter(
+            business=business, exchange_date__range=(date_from, date_to)
+        ).exclude(journal_entry__status='reversed').aggregate(
+            revenue=Coalesce(Sum(Coalesce('net_amount', 'total_amount')), Value(ZERO), output_field=money),
+            cost=Coalesce(Sum('cost_amount'), Value(ZERO), output_field=money),
+        ),
+    }
+    for totals in streams.values():
+        totals['margin'] = totals['revenue'] - totals['cost']
+    return streams
@@ -0,0 +1,235 @@
+"""
+Read-Replica Routing - Multi-Business ERP System
+Database: PostgreSQL 15+ (streaming replica)
+Django: 5.0+
+
+Sends report, BI and export reads to a read replica so they do not
+compete with till writes on the primary. Copy into core/db_routing.py.
+
+    DATABASES = {
+        'default': {...},                  # primary
+        'replica': {..., 'TEST': {'MIRROR': 'default'}},
+    }
+    DATABASE_ROUTERS = ['core.db_routing.ReplicaRouter']
+    MIDDLEWARE = [..., 'core.db_routing.ReplicaPinningMiddleware', ...]
+    REPLICA_DATABASE = 'replica'
+    REPLICA_MAX_LAG_SECONDS = 10
+
+Only code running under reporting() reads from the replica; everything
+else stays on the primary exactly as before. Inside reporting() reads
+still go to the primary when:
+- the current request has written (read-your-writes), or wrote in the
+  last PIN_SECONDS (cookie, so redirect-after-POST pages see the write)
+- a transaction is open on the primary
+- the replica is more than REPLICA_MAX_LAG_SECONDS behind, or down
+  (checked at most every LAG_CHECK_SECONDS per process)
+
+Results read from the replica can be up to REPLICA_MAX_LAG_SECONDS
+old; track_replica_reads() tells a caller (e.g. caching.cached) whether a
+computation used the replica, so it does not keep such a result longer.
+
+In tests, point 'replica' at a second local database with
+TEST = {'MIRROR': 'default'} so both aliases see the same test data.
+load_test.check_replica_routing() runs the routing rules against such a
+setup.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'pin_primary'
+PIN_SECONDS = 10
+LAG_CHECK_SECONDS = 5
+
+# Writes to these bookkeeping tables do not pin reads to the primary
+UNPINNED_TABLES = {'audit_log', 'data_export', 'batch_job_state', 'hash_chain_head', 'hash_chain_anchor'}
+
+_reporting = contextvars.ContextVar('reporting', default=False)
+_pinned = contextvars.ContextVar('pinned_to_primary', default=False)
+# Open track_replica_reads() records, innermost last
+_replica_reads = contextvars.ContextVar('replica_reads', default=())
+
+# Per-process replica health: (checked_at, usable)
+_replica_state = {'checked_at': 0.0, 'usable': False}
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', 'replica')
+
+
+def _replica_configured():
+    return replica_alias() in settings.DATABASES
+
+
+def replica_max_lag():
+    """Seconds of replication lag reporting reads tolerate."""
+    return getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 10)
+
+
+def replica_lag():
+    """Replication lag in seconds (0 when caught up, None if not a replica)."""
+    with connections[replica_alias()].cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return float(lag) if lag is not None else None
+
+
+def replica_usable():
+    """Whether the replica is reachable and within the lag threshold (cached briefly)."""
+    if not _replica_configured():
+        return False
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] < LAG_CHECK_SECONDS:
+        return _replica_state['usable']
+
+    max_lag = replica_max_lag()
+    try:
+        lag = replica_lag()
+        usable = lag is not None and lag <= max_lag
+        if not usable:
+            logger.warning("Replica lag %s s over %s s, reading from primary", lag, max_lag)
+    except DatabaseError:
+        logger.exception("Replica unreachable, reading from primary")
+        usable = False
+    _replica_state.update(checked_at=now, usable=usable)
+    return usable
+
+
+def assume_replica_health(usable=None):
+    """
+    Fix the replica health check to ``usable`` (None: measure it again).
+
+    For tests: a local database standing in for the replica is not in
+    recovery, so the lag check would never find it usable.
+    """
+    _replica_state.update(checked_at=float('inf') if usable is not None else 0.0, usable=bool(usable))
+
+
+@contextmanager
+def reporting():
+    """
+    Mark code as a report/BI/export read that may use the replica.
+
+        @reporting()
+        def profit_and_loss(...):
+
+        with reporting():
+            rows = list(queryset)
+    """
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+@contextmanager
+def track_replica_reads():
+    """
+    Record whether the code in the block read from the replica.
+
+        with track_replica_reads() as reads:
+            report = profit_and_loss(...)
+        if reads['replica']:
+            ...  # report may be up to replica_max_lag() seconds old
+    """
+    reads = {'replica': False}
+    token = _replica_reads.set(_replica_reads.get() + (reads,))
+    try:
+        yield reads
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary():
+    """Send the rest of this request/job's reads to the primary."""
+    _pinned.set(True)
+
+
+def read_alias():
+    """
+    Database alias a reporting read should use right now.
+
+    Use for raw SQL: connections[read_alias()].cursor().
+    """
+    if (
+        _reporting.get()
+        and not _pinned.get()
+        and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        and replica_usable()
+    ):
+        for reads in _replica_reads.get():
+            reads['replica'] = True
+        return replica_alias()
+    return DEFAULT_DB_ALIAS
+
+
+def reporting_alias():
+    """
+    Alias for a reporting read decided once, up front.
+
+    For generators and raw SQL, where the reporting() context would not
+    reliably span the reads: queryset.using(reporting_alias()).
+    """
+    with reporting():
+        return read_alias()
+
+
+class ReplicaRouter:
+    """Primary for writes and ordinary reads; replica for reporting reads."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.db_table not in UNPINNED_TABLES:
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Scope read-your-writes pinning to a request.
+
+    A request that writes is pinned for the rest of the request, and the
+    browser gets a short-lived cookie so the next few requests (e.g. the
+    page after a POST redirect) are pinned too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _pinned.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            if _pinned.get() and PIN_COOKIE not in request.COOKIES:
+                response.set_cookie(PIN_COOKIE, '1', max_age=PIN_SECONDS, httponly=True, samesite='Lax')
+        finally:
+            _pinned.reset(token)
+        return response
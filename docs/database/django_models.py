@@ -290,6 +290,15 @@ class BusinessSettings(models.Model):
         default=10,
         help_text='Alert when stock below this quantity'
     )
+    costing_method = models.CharField(
+        max_length=20,
+        choices=[
+            ('weighted_average', 'Weighted Average'),
+            ('fifo', 'First In, First Out'),
+        ],
+        default='fifo',
+        help_text='Inventory costing method for cost of goods sold'
+    )
     operating_hours_start = models.TimeField(default='08:00')
     operating_hours_end = models.TimeField(default='20:00')
     receipt_footer = models.TextField(
@@ -480,9 +489,9 @@ class Account(models.Model):
         """Get current account balance."""
         return self.current_balance
 
-    def update_balance(self, amount, is_debit):
+    def balance_delta(self, amount, is_debit):
         """
-        Update account balance based on debit/credit.
+        Signed change to current_balance for a debit/credit of amount.
 
         Rules:
         - Asset/Expense accounts: Debit increases, Credit decreases
@@ -493,19 +502,13 @@ class Account(models.Model):
         if self.is_contra_account:
             normal_balance = 'credit' if normal_balance == 'debit' else 'debit'
 
-        if normal_balance == 'debit':
-            # Asset/Expense: Debit increases, Credit decreases
-            if is_debit:
-                self.current_balance += amount
-            else:
-                self.current_balance -= amount
-        else:
-            # Liability/Equity/Revenue: Credit increases, Debit decreases
-            if is_debit:
-                self.current_balance -= amount
-            else:
-                self.current_balance += amount
+        if (normal_balance == 'debit') == bool(is_debit):
+            return amount
+        return -amount
 
+    def update_balance(self, amount, is_debit):
+        """Update account balance based on debit/credit (see balance_delta)."""
+        self.current_balance += self.balance_delta(amount, is_debit)
         self.save(update_fields=['current_balance', 'updated_at'])
 
 
@@ -520,11 +523,26 @@ class TransactionType(models.Model):
     - Withdrawal
     - Transfer
     - Adjustment
+
+    cashflow_activity classifies the type's cash movements in the cashflow
+    statement (cashflow.py).
     """
 
+    CASHFLOW_ACTIVITY_CHOICES = [
+        ('operating', 'Operating'),
+        ('investing', 'Investing'),
+        ('financing', 'Financing'),
+        ('transfer', 'Transfer between cash accounts'),
+    ]
+
     name = models.CharField(max_length=50, unique=True)
     code = models.CharField(max_length=10, unique=True)
     description = models.TextField(blank=True)
+    cashflow_activity = models.CharField(
+        max_length=20,
+        choices=CASHFLOW_ACTIVITY_CHOICES,
+        default='operating'
+    )
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -591,6 +609,14 @@ class JournalEntry(models.Model):
         on_delete=models.PROTECT,
         related_name='journal_entries_created'
     )
+    reversal_of = models.OneToOneField(
+        'self',
+        on_delete=models.PROTECT,
+        related_name='reversal',
+        blank=True,
+        null=True,
+        help_text='Original entry this entry reverses (see reversals.py)'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     posted_at = models.DateTimeField(blank=True, null=True)
@@ -691,6 +717,8 @@ class Ledger(models.Model):
     IMMUTABLE: Ledger entries can never be deleted or modified.
     Only reversal entries can correct errors.
     This provides complete audit trail for 7 years (KRA compliance).
+    Rows are hash-chained per business, so edits and deletions made
+    around delete() are detectable (hash_chain.verify_chains).
     """
 
     id = models.BigAutoField(primary_key=True)
@@ -731,6 +759,16 @@ class Ledger(models.Model):
         help_text='Account balance after this transaction'
     )
     reference_number = models.CharField(max_length=100, blank=True)
+    prev_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text='row_hash of the previous row in this business\'s chain (hash_chain.py)'
+    )
+    row_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text='SHA-256 of prev_hash and this row\'s contents'
+    )
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
@@ -740,10 +778,11 @@ class Ledger(models.Model):
         ordering = ['-transaction_date', '-id']
         indexes = [
             models.Index(fields=['account', 'transaction_date']),
-            models.Index(fields=['business', 'transaction_date']),
+            models.Index(fields=['business', '-transaction_date', '-id']),
             models.Index(fields=['transaction_type']),
             models.Index(fields=['reference_number']),
             models.Index(fields=['-transaction_date', 'account']),
+            models.Index(fields=['account', 'id']),
         ]
 
     def __str__(self):
@@ -762,6 +801,10 @@ class AccountBalance(models.Model):
     Periodic snapshots of account balances for performance optimization.
     Instead of calculating balances from thousands of ledger entries,
     query this table for quick balance lookups.
+
+    period_close.py writes one row per account at the end of each closed
+    month. total_debits/total_credits are the month's activity without
+    the closing entry; closing_balance includes it.
     """
 
     account = models.ForeignKey(
@@ -796,6 +839,71 @@ class AccountBalance(models.Model):
         return f"{self.account.account_number} - {self.balance_date}: {self.closing_balance}"
 
 
+class AccountingPeriod(models.Model):
+    """
+    Monthly accounting period per business.
+
+    Closing a period freezes its AccountBalance snapshots and sales
+    rollups, records the closing entry and stops further posting into the
+    month (see period_close.py). Months without a row are open.
+    """
+
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+    ]
+
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='accounting_periods'
+    )
+    period_start = models.DateField(help_text='First day of the month')
+    period_end = models.DateField(help_text='Last day of the month')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    closing_entry = models.OneToOneField(
+        'JournalEntry',
+        on_delete=models.PROTECT,
+        related_name='closed_period',
+        blank=True,
+        null=True,
+        help_text='Entry moving the month\'s revenue and expenses to retained earnings'
+    )
+    closed_at = models.DateTimeField(blank=True, null=True)
+    closed_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='periods_closed',
+        blank=True,
+        null=True
+    )
+    reopened_at = models.DateTimeField(blank=True, null=True)
+    reopened_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='periods_reopened',
+        blank=True,
+        null=True
+    )
+    reopen_reason = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'accounting_period'
+        verbose_name = 'Accounting Period'
+        verbose_name_plural = 'Accounting Periods'
+        ordering = ['business', '-period_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'period_start'],
+                name='unique_accounting_period'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.business.code} {self.period_start:%Y-%m} ({self.status})"
+
+
 class Reconciliation(models.Model):
     """
     Account reconciliation records.
@@ -1040,6 +1148,41 @@ class WaterSale(models.Model):
         blank=True,
         help_text='M-Pesa transaction reference'
     )
+    unit_cost = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Cost per unit at time of sale (set by the costing engine)'
+    )
+    cost_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Cost of goods sold for this sale'
+    )
+    tax_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT rate applied at time of sale (percent)'
+    )
+    net_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Amount excluding VAT'
+    )
+    tax_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT included in total_amount'
+    )
     sale_date = models.DateField(db_index=True)
     sale_time = models.TimeField(default=timezone.now)
     notes = models.TextField(blank=True)
@@ -1063,7 +1206,7 @@ class WaterSale(models.Model):
         verbose_name_plural = 'Water Sales'
         ordering = ['-sale_date', '-sale_time']
         indexes = [
-            models.Index(fields=['business', 'sale_date']),
+            models.Index(fields=['business', '-sale_date', '-sale_time', '-id']),
             models.Index(fields=['customer']),
             models.Index(fields=['product_size']),
             models.Index(fields=['payment_method']),
@@ -1221,6 +1364,13 @@ class LaundryJob(models.Model):
         decimal_places=2,
         default=Decimal('0.00')
     )
+    tax_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT rate applied to this job (percent)'
+    )
     tax_amount = models.DecimalField(
         max_digits=10,
         decimal_places=2,
@@ -1247,6 +1397,11 @@ class LaundryJob(models.Model):
         on_delete=models.PROTECT,
         related_name='laundry_jobs_received'
     )
+    last_reminder_date = models.DateField(
+        blank=True,
+        null=True,
+        help_text='Date the last overdue pickup reminder was queued'
+    )
     journal_entry = models.OneToOneField(
         JournalEntry,
         on_delete=models.PROTECT,
@@ -1263,11 +1418,17 @@ class LaundryJob(models.Model):
         verbose_name_plural = 'Laundry Jobs'
         ordering = ['-received_date', '-job_number']
         indexes = [
-            models.Index(fields=['business', 'received_date']),
+            models.Index(fields=['business', '-received_date', '-job_number']),
             models.Index(fields=['customer']),
             models.Index(fields=['status']),
             models.Index(fields=['job_number']),
             models.Index(fields=['status', 'received_date']),
+            models.Index(fields=['updated_at']),
+            models.Index(
+                fields=['received_date', 'business'],
+                name='idx_laundry_job_aging',
+                condition=models.Q(status__in=['received', 'washing', 'drying', 'ready'])
+            ),
         ]
 
     def __str__(self):
@@ -1347,6 +1508,42 @@ class LaundryJobItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class LaundryOverdueSummary(models.Model):
+    """
+    Compact overdue/uncollected summary per laundry business.
+
+    Maintained by the scheduled overdue sweeper (laundry_tasks.py),
+    so the owner's dashboard reads one row instead of scanning jobs.
+    """
+
+    business = models.OneToOneField(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='laundry_overdue_summary'
+    )
+    overdue_jobs = models.PositiveIntegerField(default=0)
+    overdue_balance = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        help_text='Sum of balance_due across overdue jobs'
+    )
+    ready_jobs = models.PositiveIntegerField(
+        default=0,
+        help_text='Overdue jobs already washed and waiting for pickup'
+    )
+    oldest_received_date = models.DateField(blank=True, null=True)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'laundry_overdue_summary'
+        verbose_name = 'Laundry Overdue Summary'
+        verbose_name_plural = 'Laundry Overdue Summaries'
+
+    def __str__(self):
+        return f"Overdue for business #{self.business_id}: {self.overdue_jobs} jobs ({self.overdue_balance})"
+
+
 # =============================================================================
 # DOMAIN 6: RETAIL/LPG BUSINESS
 # =============================================================================
@@ -1591,6 +1788,34 @@ class RetailLPGExchange(models.Model):
     capacity_kg = models.DecimalField(max_digits=5, decimal_places=2)
     price_per_kg = models.DecimalField(max_digits=10, decimal_places=2)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Cost of the gas refill sold (set by the costing engine)'
+    )
+    tax_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT rate applied at time of sale (percent)'
+    )
+    net_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Amount excluding VAT'
+    )
+    tax_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT included in total_amount'
+    )
     payment_method = models.CharField(
         max_length=20,
         choices=[
@@ -1623,7 +1848,7 @@ class RetailLPGExchange(models.Model):
         verbose_name_plural = 'Retail LPG Exchanges'
         ordering = ['-exchange_date', '-exchange_time']
         indexes = [
-            models.Index(fields=['business', 'exchange_date']),
+            models.Index(fields=['business', '-exchange_date', '-exchange_time', '-id']),
             models.Index(fields=['customer']),
             models.Index(fields=['full_cylinder']),
         ]
@@ -1638,6 +1863,111 @@ class RetailLPGExchange(models.Model):
         super().save(*args, **kwargs)
 
 
+class RetailLPGFleetSummary(models.Model):
+    """
+    Maintained LPG fleet counts.
+
+    One row per (business, brand, capacity, status) holding the number of
+    cylinders in that state. Updated in the same transaction as every
+    cylinder state change (see lpg_services.py), so questions like
+    "how many 13kg Total cylinders are full?" are a single-row lookup.
+    """
+
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='lpg_fleet_summary'
+    )
+    brand = models.CharField(max_length=50)
+    capacity_kg = models.DecimalField(max_digits=5, decimal_places=2)
+    status = models.CharField(
+        max_length=20,
+        choices=RetailLPGCylinder.CYLINDER_STATUS_CHOICES
+    )
+    cylinder_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'retail_lpg_fleet_summary'
+        verbose_name = 'Retail LPG Fleet Summary'
+        verbose_name_plural = 'Retail LPG Fleet Summaries'
+        unique_together = ['business', 'brand', 'capacity_kg', 'status']
+        ordering = ['brand', 'capacity_kg', 'status']
+
+    def __str__(self):
+        return f"{self.brand} {self.capacity_kg}kg {self.status}: {self.cylinder_count}"
+
+
+class RetailLPGCylinderEvent(models.Model):
+    """
+    Per-cylinder circulation history.
+
+    One row per status change of a cylinder, indexed by (cylinder, id) so a
+    cylinder's history is a single index range scan instead of scanning
+    exchanges by both full_cylinder and empty_cylinder.
+    """
+
+    EVENT_TYPE_CHOICES = [
+        ('registered', 'Registered'),
+        ('issued', 'Issued to Customer'),
+        ('returned', 'Returned by Customer'),
+        ('refilled', 'Refilled'),
+        ('maintenance', 'Sent to Maintenance'),
+        ('adjustment', 'Manual Adjustment'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    cylinder = models.ForeignKey(
+        RetailLPGCylinder,
+        on_delete=models.CASCADE,
+        related_name='events'
+    )
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='lpg_cylinder_events'
+    )
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    from_status = models.CharField(
+        max_length=20,
+        choices=RetailLPGCylinder.CYLINDER_STATUS_CHOICES,
+        blank=True
+    )
+    to_status = models.CharField(
+        max_length=20,
+        choices=RetailLPGCylinder.CYLINDER_STATUS_CHOICES
+    )
+    exchange = models.ForeignKey(
+        RetailLPGExchange,
+        on_delete=models.PROTECT,
+        related_name='cylinder_events',
+        blank=True,
+        null=True
+    )
+    customer = models.ForeignKey(
+        'Customer',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='lpg_cylinder_events'
+    )
+    event_date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'retail_lpg_cylinder_event'
+        verbose_name = 'Retail LPG Cylinder Event'
+        verbose_name_plural = 'Retail LPG Cylinder Events'
+        ordering = ['cylinder', '-id']
+        indexes = [
+            models.Index(fields=['cylinder', '-id']),
+            models.Index(fields=['business', 'event_date']),
+        ]
+
+    def __str__(self):
+        return f"Cylinder #{self.cylinder_id} {self.from_status or '-'} → {self.to_status} on {self.event_date}"
+
+
 class RetailSale(models.Model):
     """
     Retail sales records.
@@ -1716,7 +2046,7 @@ class RetailSale(models.Model):
         verbose_name_plural = 'Retail Sales'
         ordering = ['-sale_date', '-sale_number']
         indexes = [
-            models.Index(fields=['business', 'sale_date']),
+            models.Index(fields=['business', '-sale_date', '-sale_number']),
             models.Index(fields=['customer']),
             models.Index(fields=['payment_method']),
             models.Index(fields=['sale_number']),
@@ -1773,6 +2103,41 @@ class RetailSaleItem(models.Model):
         max_digits=10,
         decimal_places=2
     )
+    unit_cost = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Cost per unit at time of sale (set by the costing engine)'
+    )
+    cost_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Cost of goods sold for this line'
+    )
+    tax_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT rate applied at time of sale (percent)'
+    )
+    net_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Amount excluding VAT'
+    )
+    tax_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='VAT included in line_total'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -1822,6 +2187,11 @@ class Customer(models.Model):
         blank=True,
         help_text='National ID or passport number'
     )
+    kra_pin = models.CharField(
+        max_length=11,
+        blank=True,
+        help_text='KRA PIN (required on VAT returns for business customers)'
+    )
     customer_type = models.CharField(
         max_length=20,
         choices=[
@@ -1857,6 +2227,332 @@ class Customer(models.Model):
         pass
 
 
+class InventoryCostLayer(models.Model):
+    """
+    Inventory cost layers per SKU.
+
+    A SKU is a retail product or a filled water product size within one
+    business. Receipts (purchases, production, opening stock) add layers;
+    sales consume them (see costing.py):
+    - fifo: one layer per receipt, consumed oldest first
+    - weighted_average: a single open layer per SKU, re-averaged on receipt
+    """
+
+    SKU_TYPE_CHOICES = [
+        ('retail', 'Retail Product'),
+        ('water', 'Water Product Size'),
+    ]
+
+    SOURCE_CHOICES = [
+        ('opening', 'Opening Stock'),
+        ('purchase', 'Purchase'),
+        ('production', 'Production'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='cost_layers'
+    )
+    sku_type = models.CharField(max_length=10, choices=SKU_TYPE_CHOICES)
+    sku_id = models.BigIntegerField(
+        help_text='RetailProduct.id or WaterProductSize.id'
+    )
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    source_id = models.BigIntegerField(blank=True, null=True)
+    received_date = models.DateField()
+    quantity_received = models.PositiveIntegerField()
+    quantity_remaining = models.PositiveIntegerField()
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'inventory_cost_layer'
+        verbose_name = 'Inventory Cost Layer'
+        verbose_name_plural = 'Inventory Cost Layers'
+        ordering = ['business', 'sku_type', 'sku_id', 'id']
+        indexes = [
+            models.Index(
+                fields=['business', 'sku_type', 'sku_id', 'id'],
+                name='idx_cost_layer_open',
+                condition=models.Q(quantity_remaining__gt=0)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.sku_type} #{self.sku_id}: {self.quantity_remaining}/{self.quantity_received} @ {self.unit_cost}"
+
+
+class BatchJobState(models.Model):
+    """
+    Incremental state for scheduled batch jobs.
+
+    Each job keeps its own watermarks so a run only processes rows that
+    changed since the previous run.
+    """
+
+    job_name = models.CharField(max_length=100, unique=True)
+    watermark_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text='Timestamp watermark (e.g. updated_at of processed rows)'
+    )
+    watermark_date = models.DateField(
+        blank=True,
+        null=True,
+        help_text='Business date the last run covered'
+    )
+    watermark_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        help_text='Highest primary key processed'
+    )
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    last_run_stats = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'batch_job_state'
+        verbose_name = 'Batch Job State'
+        verbose_name_plural = 'Batch Job States'
+
+    def __str__(self):
+        return f"{self.job_name} (last run {self.last_run_at})"
+
+
+class DataExport(models.Model):
+    """
+    A CSV/XLSX export of ledger, sales or audit data.
+
+    Exports run as background jobs (see exports.py); progress is written
+    back here so the requester can poll it. Every export is also recorded
+    in AuditLog with action 'export'.
+    """
+
+    DATASET_CHOICES = [
+        ('ledger', 'Ledger'),
+        ('water_sales', 'Water Sales'),
+        ('retail_sales', 'Retail Sales'),
+        ('lpg_exchanges', 'LPG Exchanges'),
+        ('laundry_jobs', 'Laundry Jobs'),
+        ('audit_log', 'Audit Log'),
+    ]
+
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel (XLSX)'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='data_exports'
+    )
+    dataset = models.CharField(max_length=20, choices=DATASET_CHOICES)
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    date_from = models.DateField()
+    date_to = models.DateField()
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='queued',
+        db_index=True
+    )
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_written = models.PositiveIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True)
+    error_message = models.TextField(blank=True)
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='data_exports'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'data_export'
+        verbose_name = 'Data Export'
+        verbose_name_plural = 'Data Exports'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['business', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} {self.date_from} to {self.date_to} ({self.status})"
+
+    @property
+    def progress_percent(self):
+        """Share of rows written so far (0-100)."""
+        if not self.rows_total:
+            return 100 if self.status == 'completed' else 0
+        return min(100, self.rows_written * 100 // self.rows_total)
+
+
+class DeferredTask(models.Model):
+    """
+    Outbox row for a side effect deferred until after commit.
+
+    Written in the same transaction as the sale, so the effect cannot be
+    lost if the queue is down at commit time; the idempotency key makes
+    the effect run at most once (see task_queue.py). Tasks that exhaust
+    their retries stay here with status 'dead' for the dead-letter view.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('dead', 'Dead'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    key = models.CharField(max_length=200, unique=True, help_text='Idempotency key')
+    task = models.CharField(max_length=200, help_text='Dotted path of the task function')
+    args = models.JSONField(default=list, blank=True)
+    queue = models.CharField(max_length=50, default='default')
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='deferred_tasks'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='When the task is due to run; a retry waits out its backoff'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'deferred_task'
+        verbose_name = 'Deferred Task'
+        verbose_name_plural = 'Deferred Tasks'
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                name='idx_deferred_task_pending',
+                condition=models.Q(status='pending')
+            ),
+            models.Index(
+                fields=['created_at'],
+                name='idx_deferred_task_dead',
+                condition=models.Q(status='dead')
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task} [{self.key}] ({self.status}, {self.attempts} attempts)"
+
+
+class SalesRollup(models.Model):
+    """
+    Pre-bucketed sales totals per business, sales stream and period.
+
+    Maintained incrementally by analytics.refresh_rollups() at day, week
+    (Monday start) and month grain, so trend charts read a handful of
+    rows instead of aggregating raw sales.
+    """
+
+    GRAIN_CHOICES = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+
+    STREAM_CHOICES = [
+        ('water', 'Water Sales'),
+        ('laundry', 'Laundry Jobs'),
+        ('retail', 'Retail Sales'),
+        ('lpg', 'LPG Exchanges'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='sales_rollups'
+    )
+    grain = models.CharField(max_length=10, choices=GRAIN_CHOICES)
+    period_start = models.DateField()
+    stream = models.CharField(max_length=10, choices=STREAM_CHOICES)
+    transactions = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    tax_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    cost_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'sales_rollup'
+        verbose_name = 'Sales Rollup'
+        verbose_name_plural = 'Sales Rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'grain', 'period_start', 'stream'],
+                name='unique_sales_rollup_period'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.stream} {self.grain} {self.period_start}: {self.revenue}"
+
+
+class ProductSalesRollup(models.Model):
+    """
+    Pre-bucketed quantity and revenue per product and period.
+
+    Feeds the best-selling products charts. product_key identifies the
+    product across streams ('water:<size id>', 'retail:<product id>',
+    'laundry:<service type id>', 'lpg:<capacity>kg'); product_name is
+    copied in so the API needs no joins.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    business = models.ForeignKey(
+        Business,
+        on_delete=models.CASCADE,
+        related_name='product_sales_rollups'
+    )
+    grain = models.CharField(max_length=10, choices=SalesRollup.GRAIN_CHOICES)
+    period_start = models.DateField()
+    product_key = models.CharField(max_length=50)
+    product_name = models.CharField(max_length=200)
+    quantity = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'product_sales_rollup'
+        verbose_name = 'Product Sales Rollup'
+        verbose_name_plural = 'Product Sales Rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'grain', 'period_start', 'product_key'],
+                name='unique_product_rollup_period'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_name} {self.grain} {self.period_start}: {self.quantity}"
+
+
 # =============================================================================
 # AUDIT LOGGING (7-Year Retention - KRA Compliance)
 # =============================================================================
@@ -1867,6 +2563,9 @@ class AuditLog(models.Model):
 
     Tracks CREATE, UPDATE, DELETE operations on critical tables.
     7-year retention required for KRA compliance.
+
+    Record changes store a full snapshot of the record every few rows and
+    only the changed fields in between (audit_history.py).
     """
 
     ACTION_CHOICES = [
@@ -1884,6 +2583,10 @@ class AuditLog(models.Model):
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
     old_data = models.JSONField(blank=True, null=True)
     new_data = models.JSONField(blank=True, null=True)
+    is_snapshot = models.BooleanField(
+        default=False,
+        help_text='new_data is the full record state rather than the changed fields'
+    )
     changed_fields = models.JSONField(
         blank=True,
         null=True,
@@ -1904,7 +2607,13 @@ class AuditLog(models.Model):
     )
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    prev_hash = models.CharField(max_length=64, blank=True)
+    row_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text='SHA-256 of prev_hash and this row\'s contents (hash_chain.py)'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'audit_log'
@@ -1912,16 +2621,71 @@ class AuditLog(models.Model):
         verbose_name_plural = 'Audit Logs'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['table_name', 'record_id']),
-            models.Index(fields=['business', 'created_at']),
-            models.Index(fields=['changed_by', 'created_at']),
-            models.Index(fields=['action', 'created_at']),
+            # Each history filter leads an index ending in the keyset (audit_history.py)
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['table_name', 'record_id', 'created_at', 'id']),
+            models.Index(fields=['table_name', 'created_at', 'id']),
+            models.Index(fields=['business', 'created_at', 'id']),
+            models.Index(fields=['changed_by', 'created_at', 'id']),
+            models.Index(fields=['action', 'created_at', 'id']),
         ]
 
     def __str__(self):
         return f"{self.action} on {self.table_name} #{self.record_id} by {self.changed_by} at {self.created_at}"
 
 
+class HashChainHead(models.Model):
+    """
+    Tip of a tamper-evident hash chain.
+
+    One row per chain ('ledger:<business_id>', 'audit_log'). Writers lock
+    it while they append, which keeps each chain in id order.
+    """
+
+    chain = models.CharField(max_length=50, unique=True)
+    last_hash = models.CharField(max_length=64)
+    length = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'hash_chain_head'
+        verbose_name = 'Hash Chain Head'
+        verbose_name_plural = 'Hash Chain Heads'
+
+    def __str__(self):
+        return f"{self.chain} @ {self.length}: {self.last_hash[:12]}"
+
+
+class HashChainAnchor(models.Model):
+    """
+    Daily copy of each chain's head.
+
+    Kept apart from the chained tables (and logged) so a chain rewritten
+    from some row onwards no longer matches its earlier anchors.
+    """
+
+    chain = models.CharField(max_length=50)
+    anchor_date = models.DateField()
+    last_hash = models.CharField(max_length=64)
+    length = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'hash_chain_anchor'
+        verbose_name = 'Hash Chain Anchor'
+        verbose_name_plural = 'Hash Chain Anchors'
+        ordering = ['chain', '-anchor_date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chain', 'anchor_date'],
+                name='unique_hash_chain_anchor'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.chain} {self.anchor_date}: {self.last_hash[:12]}"
+
+
 # =============================================================================
 # DATABASE TRIGGERS (Implemented via Django Signals)
 # =============================================================================
@@ -1929,6 +2693,11 @@ class AuditLog(models.Model):
 """
 Note: PostgreSQL triggers will be implemented using Django signals.
 
+Only invariants that must hold at commit run inline, inside the service
+transaction (inventory, journal/ledger, customer balance). Secondary
+effects (audit log, aggregates, caches, notifications) run after commit
+as deferred tasks (task_queue.py).
+
 Key signals to implement:
 
 1. JournalEntry post_save:
@@ -1948,7 +2717,7 @@ Key signals to implement:
    - Create journal entry
 
 5. All models post_save and pre_delete:
-   - Create audit log entries
+   - Create audit log entries (deferred: task_queue.AUDITED_MODELS)
 
 Signal handlers will be defined in signals.py file.
 """
@@ -1961,14 +2730,14 @@ Signal handlers will be defined in signals.py file.
 MODEL COUNT SUMMARY:
 - User Management: 3 models
 - Business Configuration: 3 models
-- Financial Core: 8 models
+- Financial Core: 9 models
 - Water Business: 4 models
-- Laundry Business: 5 models
-- Retail Business: 7 models
-- Shared/Cross-Business: 1 model
-- Audit: 1 model
+- Laundry Business: 6 models
+- Retail Business: 9 models
+- Shared/Cross-Business: 7 models
+- Audit: 3 models
 
-TOTAL: 32 models
+TOTAL: 44 models
 
 NEXT STEPS:
 1. Create Django apps for each domain
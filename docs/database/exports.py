@@ -0,0 +1,383 @@
+"""
+Data Exports - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ (DEC-P04)
+
+Streaming CSV/XLSX exports of the ledger, sales and audit log. Copy into
+financial/exports.py.
+
+Rows are never loaded as a whole queryset: every dataset is read with
+values_list(...).iterator(chunk_size=EXPORT_CHUNK_SIZE), which on
+PostgreSQL uses a server-side cursor, and each row is written out as soon
+as it is fetched. Memory use is one chunk whatever the period length.
+
+Two ways to export:
+- stream_csv_response(): CSV straight to the browser through a
+  StreamingHttpResponse (small and medium periods)
+- request_export(): a DataExport row plus a background job that writes
+  CSV or XLSX to settings.EXPORT_ROOT, reporting progress on the row
+  (multi-year periods and all XLSX files, which cannot be streamed)
+
+Every export is recorded in AuditLog with action 'export'.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import csv
+import json
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+import django_rq
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from db_routing import reporting_alias
+from django_models import (
+    AuditLog,
+    DataExport,
+    LaundryJob,
+    Ledger,
+    RetailLPGExchange,
+    RetailSaleItem,
+    WaterSale,
+)
+from hash_chain import append_audit_logs
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Progress is written back to DataExport every this many rows
+PROGRESS_EVERY = 10000
+
+
+def _audit_log_queryset(business, date_from, date_to):
+    # Bound created_at itself rather than created_at__date so the
+    # (business, created_at) index is used
+    start = timezone.make_aware(datetime.combine(date_from, time.min))
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    return AuditLog.objects.filter(
+        business=business, created_at__gte=start, created_at__lt=end
+    ).order_by('created_at', 'id')
+
+
+def _ledger_row(row):
+    transaction_date, entry, number, name, description, is_debit, amount, balance = row
+    return (
+        transaction_date, entry, number, name, description,
+        amount if is_debit else '', '' if is_debit else amount, balance,
+    )
+
+
+def _audit_log_row(row):
+    created_at, email, action, table, record_id, fields, is_snapshot, ip, old, new = row
+    # Record changes store only the changed fields (audit_history.py)
+    if fields is None and not is_snapshot and action == 'update':
+        fields = list(new or {})
+    return (
+        timezone.localtime(created_at).replace(tzinfo=None), email or '',
+        action, table, record_id, ', '.join(fields or []), ip or '',
+        json.dumps(old, cls=DjangoJSONEncoder) if old is not None else '',
+        json.dumps(new, cls=DjangoJSONEncoder) if new is not None else '',
+    )
+
+
+# dataset -> (header, period queryset, values_list fields, row formatter)
+DATASETS = {
+    'ledger': (
+        ['Date', 'Entry Number', 'Account Number', 'Account Name',
+         'Description', 'Debit', 'Credit', 'Balance After'],
+        lambda business, date_from, date_to: Ledger.objects.filter(
+            business=business, transaction_date__range=(date_from, date_to)
+        ).order_by('transaction_date', 'id'),
+        ['transaction_date', 'journal_entry__entry_number',
+         'account__account_number', 'account__name', 'description',
+         'is_debit', 'amount', 'balance_after'],
+        _ledger_row,
+    ),
+    'water_sales': (
+        ['Date', 'Sale ID', 'Customer', 'Product', 'Quantity', 'Unit Price',
+         'Total', 'Net', 'VAT', 'Cost', 'Payment Method', 'M-Pesa Ref'],
+        lambda business, date_from, date_to: WaterSale.objects.filter(
+            business=business, sale_date__range=(date_from, date_to)
+        ).order_by('sale_date', 'id'),
+        ['sale_date', 'id', 'customer__name', 'product_size__name',
+         'quantity_sold', 'unit_price', 'total_amount', 'net_amount',
+         'tax_amount', 'cost_amount', 'payment_method', 'm_pesa_transaction_id'],
+        None,
+    ),
+    'retail_sales': (
+        ['Date', 'Sale Number', 'Customer', 'Product Code', 'Product',
+         'Quantity', 'Unit Price', 'Line Total', 'Net', 'VAT', 'Cost',
+         'Payment Method'],
+        lambda business, date_from, date_to: RetailSaleItem.objects.filter(
+            sale__business=business, sale__sale_date__range=(date_from, date_to)
+        ).order_by('sale__sale_date', 'sale_id', 'id'),
+        ['sale__sale_date', 'sale__sale_number', 'sale__customer__name',
+         'product__product_code', 'product__name', 'quantity', 'unit_price',
+         'line_total', 'net_amount', 'tax_amount', 'cost_amount',
+         'sale__payment_method'],
+        None,
+    ),
+    'lpg_exchanges': (
+        ['Date', 'Exchange ID', 'Customer', 'Full Cylinder', 'Empty Cylinder',
+         'Capacity (kg)', 'Price per kg', 'Total', 'Net', 'VAT', 'Cost',
+         'Payment Method', 'M-Pesa Ref'],
+        lambda business, date_from, date_to: RetailLPGExchange.objects.filter(
+            business=business, exchange_date__range=(date_from, date_to)
+        ).order_by('exchange_date', 'id'),
+        ['exchange_date', 'id', 'customer__name', 'full_cylinder__serial_number',
+         'empty_cylinder__serial_number', 'capacity_kg', 'price_per_kg',
+         'total_amount', 'net_amount', 'tax_amount', 'cost_amount',
+         'payment_method', 'm_pesa_transaction_id'],
+        None,
+    ),
+    'laundry_jobs': (
+        ['Received', 'Job Number', 'Customer', 'Status', 'Subtotal',
+         'Discount', 'VAT', 'Total', 'Paid', 'Balance Due', 'Collected'],
+        lambda business, date_from, date_to: LaundryJob.objects.filter(
+            business=business, received_date__range=(date_from, date_to)
+        ).order_by('received_date', 'id'),
+        ['received_date', 'job_number', 'customer__customer__name', 'status',
+         'subtotal_amount', 'discount_amount', 'tax_amount', 'total_amount',
+         'amount_paid', 'balance_due', 'collected_date'],
+        None,
+    ),
+    'audit_log': (
+        ['Timestamp', 'User', 'Action', 'Table', 'Record ID',
+         'Changed Fields', 'IP Address', 'Old Data', 'New Data'],
+        _audit_log_queryset,
+        ['created_at', 'changed_by__email', 'action', 'table_name', 'record_id',
+         'changed_fields', 'is_snapshot', 'ip_address', 'old_data', 'new_data'],
+        _audit_log_row,
+    ),
+}
+
+
+def export_queryset(business, dataset, date_from, date_to):
+    """
+    The ordered, unevaluated queryset behind a dataset (use .count() for totals).
+
+    Reads from the reporting replica when it is usable.
+    """
+    if dataset not in DATASETS:
+        raise ValidationError(f"Unknown export dataset: {dataset}")
+    return DATASETS[dataset][1](business, date_from, date_to).using(reporting_alias())
+
+
+def iter_export_rows(business, dataset, date_from, date_to):
+    """Yield the header, then every row of a dataset, one chunk in memory at a time."""
+    queryset = export_queryset(business, dataset, date_from, date_to)
+    header, _, fields, formatter = DATASETS[dataset]
+    yield header
+    rows = queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if formatter is None:
+        yield from rows
+    else:
+        for row in rows:
+            yield formatter(row)
+
+
+def _record_export(export, ip_address=None, user_agent=''):
+    """Write the AuditLog 'export' entry for an export."""
+    append_audit_logs([AuditLog(
+        table_name=DataExport._meta.db_table,
+        record_id=export.id,
+        action='export',
+        new_data={
+            'dataset': export.dataset,
+            'file_format': export.file_format,
+            'date_from': export.date_from.isoformat(),
+            'date_to': export.date_to.isoformat(),
+        },
+        is_snapshot=True,
+        changed_by=export.requested_by,
+        business=export.business,
+        ip_address=ip_address,
+        user_agent=user_agent,
+    )])
+
+
+class Echo:
+    """File-like object whose write() hands the line back (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv_response(request, business, dataset, date_from, date_to):
+    """
+    Stream a dataset as CSV directly to the client.
+
+    The export is recorded (DataExport + AuditLog) before the first byte
+    is sent; the DataExport row is marked completed with its row count
+    when the last row has been streamed, or failed if a row raises or the
+    client goes away first.
+    """
+    if dataset not in DATASETS:
+        raise ValidationError(f"Unknown export dataset: {dataset}")
+    export = DataExport.objects.create(
+        business=business,
+        dataset=dataset,
+        file_format='csv',
+        date_from=date_from,
+        date_to=date_to,
+        status='running',
+        requested_by=request.user,
+        started_at=timezone.now(),
+    )
+    _record_export(
+        export,
+        ip_address=request.META.get('REMOTE_ADDR'),
+        user_agent=request.META.get('HTTP_USER_AGENT', ''),
+    )
+
+    def content():
+        writer = csv.writer(Echo())
+        written = -1  # header row
+        # A disconnecting client closes the generator (GeneratorExit at the
+        # yield); the row is marked failed unless the last row went out.
+        outcome = {'status': 'failed', 'error_message': 'Stream closed before the export finished.'}
+        try:
+            for row in iter_export_rows(business, dataset, date_from, date_to):
+                written += 1
+                yield writer.writerow(row)
+            outcome = {'status': 'completed', 'rows_total': written}
+        except Exception as exc:
+            outcome['error_message'] = str(exc)
+            logger.exception("Export %s failed", export.id)
+            raise
+        finally:
+            DataExport.objects.filter(id=export.id).update(
+                rows_written=max(written, 0),
+                completed_at=timezone.now(),
+                **outcome,
+            )
+
+    response = StreamingHttpResponse(content(), content_type='text/csv')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{_file_name(export)}"'
+    )
+    return response
+
+
+def request_export(business, dataset, date_from, date_to, requested_by,
+                   file_format='csv', ip_address=None, user_agent=''):
+    """
+    Queue a background export and return its DataExport row.
+
+    Poll DataExport.status / progress_percent for completion; the file is
+    at DataExport.file_path once status is 'completed'.
+    """
+    if dataset not in DATASETS:
+        raise ValidationError(f"Unknown export dataset: {dataset}")
+    if file_format not in dict(DataExport.FORMAT_CHOICES):
+        raise ValidationError(f"Unknown export format: {file_format}")
+    if date_to < date_from:
+        raise ValidationError("Export end date is before its start date.")
+
+    with transaction.atomic():
+        export = DataExport.objects.create(
+            business=business,
+            dataset=dataset,
+            file_format=file_format,
+            date_from=date_from,
+            date_to=date_to,
+            requested_by=requested_by,
+        )
+        _record_export(export, ip_address=ip_address, user_agent=user_agent)
+        transaction.on_commit(lambda: run_export.delay(export.id))
+    return export
+
+
+def _file_name(export):
+    return (
+        f"{export.business.code}_{export.dataset}_{export.date_from:%Y%m%d}_"
+        f"{export.date_to:%Y%m%d}_{export.id}.{export.file_format}"
+    )
+
+
+def _write_csv(path, rows, progress):
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle)
+        for row in rows:
+            writer.writerow(row)
+            progress()
+
+
+def _write_xlsx(path, rows, progress):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImproperlyConfigured("XLSX exports require the openpyxl package.")
+    # write_only mode streams rows to a temporary file instead of keeping
+    # the whole sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+        progress()
+    workbook.save(path)
+
+
+@django_rq.job('default', timeout=3600)
+def run_export(export_id):
+    """
+    Write a queued export to settings.EXPORT_ROOT.
+
+    Runs in autocommit mode on purpose: each progress update is committed
+    immediately so pollers see it, and the server-side cursor is opened
+    WITH HOLD by Django so it survives those commits.
+    """
+    export = DataExport.objects.select_related('business', 'requested_by').get(id=export_id)
+    if export.status != 'queued':
+        return export.status
+
+    rows_total = export_queryset(
+        export.business, export.dataset, export.date_from, export.date_to
+    ).count()
+    DataExport.objects.filter(id=export.id).update(
+        status='running', rows_total=rows_total, started_at=timezone.now()
+    )
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    path = os.path.join(settings.EXPORT_ROOT, _file_name(export))
+    written = -1  # header row
+
+    def progress():
+        nonlocal written
+        written += 1
+        if written and written % PROGRESS_EVERY == 0:
+            DataExport.objects.filter(id=export.id).update(rows_written=written)
+
+    rows = iter_export_rows(export.business, export.dataset, export.date_from, export.date_to)
+    try:
+        if export.file_format == 'xlsx':
+            _write_xlsx(path, rows, progress)
+        else:
+            _write_csv(path, rows, progress)
+    except Exception as exc:
+        DataExport.objects.filter(id=export.id).update(
+            status='failed', error_message=str(exc), completed_at=timezone.now()
+        )
+        if os.path.exists(path):
+            os.remove(path)
+        logger.exception("Export %s failed", export.id)
+        raise
+
+    DataExport.objects.filter(id=export.id).update(
+        status='completed',
+        rows_written=written,
+        file_path=path,
+        completed_at=timezone.now(),
+    )
+    logger.info("Export %s: %d %s rows written to %s", export.id, written, export.dataset, path)
+    return written
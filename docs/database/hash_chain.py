@@ -0,0 +1,287 @@
+"""
+Hash Chain - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ + RQ-Scheduler (DEC-P04)
+
+Tamper-evident hash chains over Ledger and AuditLog. Copy into
+core/hash_chain.py.
+
+Ledger.delete() refusing is not enough for KRA: bulk deletes and raw SQL
+bypass it. Every Ledger and AuditLog row therefore stores
+
+    row_hash = SHA-256(prev_hash, row contents)
+
+where prev_hash is the row_hash of the row before it in the same chain:
+one chain per business for Ledger ('ledger:<business_id>') and one for
+AuditLog ('audit_log'). Editing a row breaks its own hash, and deleting
+or inserting a row breaks the link of the next one. Changing a row and
+recomputing every hash after it is caught by the daily anchors.
+
+Hashes are computed in Python while a batch is built and go out with the
+same bulk INSERT, so chaining adds no per-row round trip: per batch, one
+SELECT ... FOR UPDATE of the chain heads and one UPDATE. The head lock
+keeps each chain in id order; a business's postings already serialize on
+its cash and revenue account locks, so it costs no extra concurrency.
+
+verify_chains() streams a table in id order, recomputes every hash and
+reports each altered row, broken link, anchor and head mismatch.
+anchor_chains() copies every head into HashChainAnchor once a day and
+logs it, so the digests also exist outside the database.
+
+Rows written before chaining was deployed carry an empty hash; run
+backfill_chains() once, before the first chained row is written. A field
+added to a chained table later is hashed only when set (AUDIT_ADDED_FIELDS),
+so rows already chained keep verifying.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import hashlib
+import json
+import logging
+from collections import Counter, defaultdict
+from datetime import date
+from decimal import Decimal
+
+import django_rq
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils import timezone
+
+from db_routing import reporting_alias
+from django_models import AuditLog, HashChainAnchor, HashChainHead, Ledger
+
+
+logger = logging.getLogger(__name__)
+
+GENESIS_HASH = '0' * 64
+AUDIT_CHAIN = 'audit_log'
+STREAM_CHUNK_SIZE = 5000
+SAMPLES_PER_PROBLEM = 10
+
+# Hashed contents, in order. Timestamps set by the database are left out.
+LEDGER_FIELDS = (
+    'journal_entry_id', 'journal_entry_line_id', 'account_id', 'business_id',
+    'transaction_date', 'transaction_type_id', 'description', 'is_debit',
+    'amount', 'balance_after', 'reference_number',
+)
+AUDIT_FIELDS = (
+    'table_name', 'record_id', 'action', 'old_data', 'new_data', 'changed_fields',
+    'changed_by_id', 'business_id', 'ip_address', 'user_agent',
+)
+# Fields added after rows were chained: hashed only when set, as
+# 'name=value' after the fields above, so rows chained before a field
+# existed (where it holds its default) keep their hashes.
+AUDIT_ADDED_FIELDS = ('is_snapshot',)
+
+# model -> (hashed fields, added fields, chain of a row)
+CHAINED = {
+    Ledger: (LEDGER_FIELDS, (), lambda row: f'ledger:{row.business_id}'),
+    AuditLog: (AUDIT_FIELDS, AUDIT_ADDED_FIELDS, lambda row: AUDIT_CHAIN),
+}
+
+
+def _canonical(value):
+    """Stable text for a field value, the same before insert and after a read."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, Decimal):
+        return f'{value:.2f}'
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return str(value)
+
+
+def row_digest(prev_hash, values):
+    payload = '\x1f'.join(_canonical(value) for value in values)
+    return hashlib.sha256(f'{prev_hash}\x1e{payload}'.encode()).hexdigest()
+
+
+def row_values(row):
+    """The values of a chained row that go into its digest, in order."""
+    fields, added, _ = CHAINED[type(row)]
+    values = [getattr(row, field) for field in fields]
+    for field in added:
+        value = getattr(row, field)
+        if value:
+            values.append(f'{field}={_canonical(value)}')
+    return values
+
+
+def lock_chain_heads(chains):
+    """Lock the heads of the given chains (in name order), creating missing ones."""
+    chains = sorted(chains)
+    heads = {
+        head.chain: head
+        for head in HashChainHead.objects.select_for_update().filter(chain__in=chains).order_by('chain')
+    }
+    if len(heads) < len(chains):
+        HashChainHead.objects.bulk_create(
+            [HashChainHead(chain=chain, last_hash=GENESIS_HASH) for chain in chains if chain not in heads],
+            ignore_conflicts=True,
+        )
+        heads = {
+            head.chain: head
+            for head in HashChainHead.objects.select_for_update().filter(chain__in=chains).order_by('chain')
+        }
+    return heads
+
+
+def chain_rows(rows):
+    """
+    Set prev_hash and row_hash on unsaved Ledger or AuditLog rows.
+
+    Call inside the writing transaction, right before bulk_create(rows);
+    the rows must be inserted in list order. Holds the chain heads until
+    the transaction ends.
+    """
+    if not rows:
+        return rows
+    _, _, chain_of = CHAINED[type(rows[0])]
+    heads = lock_chain_heads({chain_of(row) for row in rows})
+    for row in rows:
+        head = heads[chain_of(row)]
+        row.prev_hash = head.last_hash
+        row.row_hash = row_digest(row.prev_hash, row_values(row))
+        head.last_hash = row.row_hash
+        head.length += 1
+
+    now = timezone.now()
+    for head in heads.values():
+        head.updated_at = now
+    HashChainHead.objects.bulk_update(heads.values(), ['last_hash', 'length', 'updated_at'])
+    return rows
+
+
+@transaction.atomic
+def append_audit_logs(entries):
+    """Chain and insert AuditLog rows; the way every audit entry is written."""
+    return AuditLog.objects.bulk_create(chain_rows(list(entries)))
+
+
+# -----------------------------------------------------------------------------
+# Verification and anchors
+# -----------------------------------------------------------------------------
+
+def verify_chains(model=Ledger, report=None):
+    """
+    Recompute a table's chains and report every discrepancy.
+
+    Streams ``model`` (Ledger or AuditLog) once in id order. Problems:
+    - altered: the row's contents no longer match its row_hash
+    - broken_link: prev_hash is not the previous row's hash (rows deleted
+      or inserted before this one)
+    - anchor_mismatch: the chain at an anchored length differs from the
+      anchor (rewritten from an earlier row onwards)
+    - head_mismatch: the chain ends elsewhere than its head (rows deleted
+      from the end)
+    ``report`` is called with (problem, chain, row_id) for each one.
+    Returns counts and sample rows per problem.
+    """
+    _, _, chain_of = CHAINED[model]
+    problems = Counter()
+    samples = defaultdict(list)
+
+    def flag(problem, chain, row_id):
+        problems[problem] += 1
+        if len(samples[problem]) < SAMPLES_PER_PROBLEM:
+            samples[problem].append((chain, row_id))
+        if report is not None:
+            report(problem, chain, row_id)
+
+    using = reporting_alias()
+    with transaction.atomic(using=using):
+        # Heads and rows from one snapshot, so concurrent appends match up
+        with connections[using].cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        heads = {
+            head.chain: head for head in HashChainHead.objects.using(using).filter(
+                chain__startswith='ledger:' if model is Ledger else AUDIT_CHAIN
+            )
+        }
+        anchors = defaultdict(dict)
+        for anchor in HashChainAnchor.objects.using(using).filter(chain__in=list(heads)):
+            anchors[anchor.chain][anchor.length] = anchor.last_hash
+
+        last_hash = {}
+        length = Counter()
+        rows = (
+            model.objects.using(using).exclude(row_hash='').order_by('id')
+            .iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        for row in rows:
+            chain = chain_of(row)
+            expected_prev = last_hash.get(chain, GENESIS_HASH)
+            if row.prev_hash != expected_prev:
+                flag('broken_link', chain, row.id)
+            if row_digest(row.prev_hash, row_values(row)) != row.row_hash:
+                flag('altered', chain, row.id)
+            # Carry on from the stored hash so each problem is reported once
+            last_hash[chain] = row.row_hash
+            length[chain] += 1
+            anchored = anchors[chain].get(length[chain])
+            if anchored is not None and anchored != row.row_hash:
+                flag('anchor_mismatch', chain, row.id)
+
+        for chain, head in heads.items():
+            if head.length and last_hash.get(chain) != head.last_hash:
+                flag('head_mismatch', chain, None)
+
+    return {
+        'rows': sum(length.values()),
+        'chains': len(length),
+        'problems': dict(problems),
+        'samples': dict(samples),
+    }
+
+
+@django_rq.job('default')
+def anchor_chains(anchor_date=None):
+    """Copy every chain head into HashChainAnchor for the day (idempotent)."""
+    anchor_date = anchor_date or timezone.localdate()
+    anchors = []
+    for head in HashChainHead.objects.order_by('chain'):
+        anchor, _ = HashChainAnchor.objects.get_or_create(
+            chain=head.chain,
+            anchor_date=anchor_date,
+            defaults={'last_hash': head.last_hash, 'length': head.length},
+        )
+        # Logged so the digests also live outside the database
+        logger.info("Hash chain anchor %s %s length=%s hash=%s",
+                    anchor.chain, anchor_date, anchor.length, anchor.last_hash)
+        anchors.append(anchor)
+    return len(anchors)
+
+
+def schedule_chain_anchors(cron_string='55 23 * * *'):
+    """Register the daily anchor job with RQ-Scheduler (call once at deploy)."""
+    scheduler = django_rq.get_scheduler('default')
+    for scheduled in scheduler.get_jobs():
+        if scheduled.func_name.endswith('anchor_chains'):
+            scheduler.cancel(scheduled)
+    return scheduler.cron(cron_string, func=anchor_chains, queue_name='default')
+
+
+def backfill_chains(model, batch_size=STREAM_CHUNK_SIZE):
+    """
+    Chain the rows written before chaining was deployed, in id order.
+
+    One-off, during the deploy window: refuses to run once chained rows
+    exist, since the old rows would have to come first in their chains.
+    """
+    if model.objects.exclude(row_hash='').exists():
+        raise RuntimeError(f"{model._meta.db_table} already has chained rows.")
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(model.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                return
+            chain_rows(batch)
+            model.objects.bulk_update(batch, ['prev_hash', 'row_hash'])
+        last_id = batch[-1].id
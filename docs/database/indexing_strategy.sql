@@ -64,9 +64,10 @@ CREATE INDEX idx_ledger_account_date
 ON ledger(account_id, transaction_date DESC)
 INCLUDE (is_debit, amount, balance_after, description);
 
--- Ledger: Business + Date (business financial reports)
+-- Ledger: Business + Date (business financial reports; keyset list
+-- pages, see pagination.py)
 CREATE INDEX idx_ledger_business_date
-ON ledger(business_id, transaction_date DESC)
+ON ledger(business_id, transaction_date DESC, id DESC)
 INCLUDE (transaction_type_id, is_debit, amount);
 
 -- Ledger: Reference number (M-Pesa reconciliation)
@@ -79,6 +80,16 @@ CREATE INDEX idx_ledger_date_desc
 ON ledger(transaction_date DESC, account_id)
 INCLUDE (business_id, is_debit, amount, description);
 
+-- Ledger: Account + id (balance_after continuity and last balance per
+-- account, integrity.py)
+CREATE INDEX idx_ledger_account_id
+ON ledger(account_id, id)
+INCLUDE (balance_after);
+
+-- Ledger: Journal entry line (line/ledger correspondence, integrity.py)
+CREATE INDEX idx_ledger_line
+ON ledger(journal_entry_line_id);
+
 -- BRIN index for large-scale time-series (optional, when > 1M rows)
 CREATE INDEX idx_ledger_date_brin
 ON ledger USING BRIN(transaction_date);
@@ -108,7 +119,7 @@ INCLUDE (quantity, selling_price);
 
 -- Water Sale: Business + Date (daily sales reports)
 CREATE INDEX idx_water_sale_business_date
-ON water_sale(business_id, sale_date DESC)
+ON water_sale(business_id, sale_date DESC, sale_time DESC, id DESC)
 INCLUDE (total_amount, payment_method);
 
 -- Water Sale: Customer lookup
@@ -139,10 +150,17 @@ ON laundry_job(customer_id, received_date DESC);
 CREATE INDEX idx_laundry_job_number
 ON laundry_job(job_number);
 
--- Laundry Job: Aging query (jobs > 30 days)
+-- Laundry Job: Aging query (jobs > 30 days, used by the overdue sweeper)
+-- NOTE: CURRENT_DATE is not IMMUTABLE and cannot appear in an index
+-- predicate; the 30-day cutoff is applied by the query instead.
 CREATE INDEX idx_laundry_job_aging
-ON laundry_job(received_date)
-WHERE status IN ('received', 'washing', 'ready') AND received_date < CURRENT_DATE - INTERVAL '30 days';
+ON laundry_job(received_date, business_id)
+INCLUDE (status, balance_due, last_reminder_date)
+WHERE status IN ('received', 'washing', 'drying', 'ready');
+
+-- Laundry Job: Changed since last sweep (incremental sweeper runs)
+CREATE INDEX idx_laundry_job_updated
+ON laundry_job(updated_at);
 
 -- =============================================================================
 -- RETAIL BUSINESS INDEXES
@@ -170,7 +188,7 @@ WHERE is_active = TRUE;
 
 -- Retail Sale: Business + Date (daily sales reports)
 CREATE INDEX idx_retail_sale_business_date
-ON retail_sale(business_id, sale_date DESC)
+ON retail_sale(business_id, sale_date DESC, sale_number DESC)
 INCLUDE (total_amount, payment_method);
 
 -- Retail Sale: Sale number lookup
@@ -195,6 +213,11 @@ CREATE INDEX idx_lpg_cylinder_brand_capacity
 ON retail_lpg_cylinder(brand, capacity_kg)
 WHERE status = 'full';
 
+-- LPG Cylinder Event: Per-cylinder history (newest first)
+CREATE INDEX idx_lpg_cylinder_event_cylinder
+ON retail_lpg_cylinder_event(cylinder_id, id DESC)
+INCLUDE (event_type, from_status, to_status, event_date, customer_id);
+
 -- =============================================================================
 -- CUSTOMER INDEXES
 -- =============================================================================
@@ -217,25 +240,38 @@ WHERE is_active = TRUE;
 -- AUDIT LOG INDEXES
 -- =============================================================================
 
--- Audit Log: Table + Record (track specific record changes)
+-- Every audit index ends in (created_at DESC, id DESC): the history API
+-- pages by keyset on (created_at, id) newest first (audit_history.py), so
+-- each filter's pages are index range scans however deep they go.
+
+-- Audit Log: Date (unfiltered history)
+CREATE INDEX idx_audit_log_date
+ON audit_log(created_at DESC, id DESC);
+
+-- Audit Log: Table + Record (record timelines; record rebuilds read the
+-- last rows of a record backwards)
 CREATE INDEX idx_audit_log_table_record
-ON audit_log(table_name, record_id, created_at DESC)
-INCLUDE (action, changed_by);
+ON audit_log(table_name, record_id, created_at DESC, id DESC)
+INCLUDE (action, is_snapshot);
+
+-- Audit Log: Table + Date (every change to one model)
+CREATE INDEX idx_audit_log_table_date
+ON audit_log(table_name, created_at DESC, id DESC);
 
 -- Audit Log: Business + Date (audit reports)
 CREATE INDEX idx_audit_log_business_date
-ON audit_log(business_id, created_at DESC)
+ON audit_log(business_id, created_at DESC, id DESC)
 INCLUDE (table_name, action, changed_by)
 WHERE business_id IS NOT NULL;
 
 -- Audit Log: User + Date (user activity tracking)
 CREATE INDEX idx_audit_log_user_date
-ON audit_log(changed_by, created_at DESC)
-INCLUDE (table_name, action);
+ON audit_log(changed_by, created_at DESC, id DESC)
+INCLUDE (table_name, action, business_id);
 
 -- Audit Log: Action + Date (filter by action type)
 CREATE INDEX idx_audit_log_action_date
-ON audit_log(action, created_at DESC);
+ON audit_log(action, created_at DESC, id DESC);
 
 -- BRIN index for large-scale audit log (after > 1M rows)
 CREATE INDEX idx_audit_log_date_brin
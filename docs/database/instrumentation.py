@@ -0,0 +1,353 @@
+"""
+Query Instrumentation - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Query-count and latency instrumentation with per-endpoint budgets. Copy
+into core/instrumentation.py and add the middleware near the top of
+MIDDLEWARE:
+
+    MIDDLEWARE = [
+        'core.instrumentation.QueryBudgetMiddleware',
+        ...
+    ]
+
+Every request (and every service function decorated with @instrumented)
+records its query count, DB time and total time. Model helpers such as
+__str__ (business.code, product_size.name, customer.customer.name) and
+User.has_business_access() issue queries of their own, so an N+1 shows up
+as a jump in the query count long before it shows up in latency.
+
+Budgets
+-------
+A view or service declares its budget with @query_budget(max_queries,
+max_ms), or settings.QUERY_BUDGETS maps view names to (max_queries,
+max_ms). Exceeding a budget logs a warning; with
+settings.QUERY_BUDGET_STRICT = True (set it in test settings) it raises
+QueryBudgetExceeded, so the offending test fails. The sale services and
+list endpoints declare budgets; a batch service's count does not grow
+with the batch, so a test of any size catches an N+1.
+
+Summary
+-------
+Samples go into shared latency histograms in the cache, in 5-minute
+windows kept for an hour. performance_summary() returns rolling
+p50/p95/p99, average queries and DB time per endpoint for the owner's
+admin page.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import functools
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds (last bucket is open-ended)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, None)
+
+WINDOW_SECONDS = 300
+ROLLING_WINDOWS = 12
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request or service call went over its declared query/time budget."""
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries and their wall time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.total_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    @property
+    def db_ms(self):
+        return self.db_time * 1000
+
+    @property
+    def total_ms(self):
+        return self.total_time * 1000
+
+
+@contextmanager
+def record_queries():
+    """
+    Record queries on every database connection for the enclosed block.
+
+        with record_queries() as recorder:
+            ...
+        recorder.queries, recorder.db_ms, recorder.total_ms
+    """
+    recorder = QueryRecorder()
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield recorder
+    finally:
+        recorder.total_time = time.perf_counter() - start
+
+
+def query_budget(max_queries=None, max_ms=None):
+    """Declare the budget of a view or service function."""
+    def decorator(func):
+        func.query_budget = (max_queries, max_ms)
+        return func
+    return decorator
+
+
+def _budget_problems(recorder, budget):
+    max_queries, max_ms = budget
+    problems = []
+    if max_queries is not None and recorder.queries > max_queries:
+        problems.append(f"{recorder.queries} queries (budget {max_queries})")
+    if max_ms is not None and recorder.total_ms > max_ms:
+        problems.append(f"{recorder.total_ms:.0f} ms (budget {max_ms} ms)")
+    return problems
+
+
+def check_budget(name, recorder, budget):
+    """Warn about (or, in strict mode, raise on) a budget overrun. Returns True if over."""
+    problems = _budget_problems(recorder, budget) if budget else []
+    if not problems:
+        return False
+    message = f"{name} exceeded its budget: " + ', '.join(problems)
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return True
+
+
+@contextmanager
+def assert_max_queries(max_queries, max_ms=None, name='block'):
+    """Test helper: fail if the enclosed block goes over budget."""
+    with record_queries() as recorder:
+        yield recorder
+    problems = _budget_problems(recorder, (max_queries, max_ms))
+    if problems:
+        raise QueryBudgetExceeded(f"{name} exceeded its budget: " + ', '.join(problems))
+
+
+# -----------------------------------------------------------------------------
+# Rolling histograms
+# -----------------------------------------------------------------------------
+
+_registered_windows = set()
+
+
+def _cache():
+    return caches[getattr(settings, 'PERF_CACHE_ALIAS', 'default')]
+
+
+def _bucket(total_ms):
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if bound is None or total_ms <= bound:
+            return index
+
+
+def _incr(cache, key, delta, timeout):
+    if not cache.add(key, delta, timeout=timeout):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.add(key, delta, timeout=timeout)
+
+
+def _register(cache, window, name, timeout):
+    """
+    Add an endpoint to a window's index (once per process per window).
+
+    The index is a counter plus one key per entry. incr() is atomic, so
+    processes registering at the same time each get their own slot; a
+    shared list read and written back would drop one of them.
+    """
+    if (window, name) in _registered_windows:
+        return
+    key = f"perf:{window}:endpoints"
+    if cache.add(key, 1, timeout=timeout):
+        slot = 1
+    else:
+        try:
+            slot = cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.add(key, 1, timeout=timeout)
+            slot = 1
+    cache.set(f"{key}:{slot}", name, timeout=timeout)
+    _registered_windows.add((window, name))
+
+
+def record_sample(name, recorder, over_budget=False):
+    """Add one request/service sample to the current window's histogram."""
+    cache = _cache()
+    window = int(time.time() // WINDOW_SECONDS)
+    timeout = WINDOW_SECONDS * (ROLLING_WINDOWS + 1)
+    prefix = f"perf:{window}:{name}"
+    _register(cache, window, name, timeout)
+    _incr(cache, f"{prefix}:b{_bucket(recorder.total_ms)}", 1, timeout)
+    _incr(cache, f"{prefix}:queries", recorder.queries, timeout)
+    _incr(cache, f"{prefix}:db_ms", int(recorder.db_ms), timeout)
+    if over_budget:
+        _incr(cache, f"{prefix}:over", 1, timeout)
+
+
+def _percentile(buckets, count, fraction):
+    """Upper bound of the histogram bucket holding the given fraction of samples."""
+    target = count * fraction
+    seen = 0
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        seen += buckets[index]
+        if seen >= target:
+            return bound
+    return None
+
+
+def performance_summary():
+    """
+    Rolling per-endpoint summary over the last hour, slowest p95 first.
+
+    Percentiles are histogram bucket upper bounds (None means above the
+    largest bucket).
+    """
+    cache = _cache()
+    current = int(time.time() // WINDOW_SECONDS)
+    windows = range(current - ROLLING_WINDOWS + 1, current + 1)
+
+    # The same endpoint can hold a slot per process; the set drops repeats
+    slot_counts = cache.get_many([f"perf:{window}:endpoints" for window in windows])
+    names = set(cache.get_many([
+        f"{key}:{slot}" for key, count in slot_counts.items() for slot in range(1, count + 1)
+    ]).values())
+
+    fields = [f"b{index}" for index in range(len(LATENCY_BUCKETS_MS))]
+    fields += ['queries', 'db_ms', 'over']
+    values = cache.get_many([
+        f"perf:{window}:{name}:{field}"
+        for window in windows for name in names for field in fields
+    ])
+
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    summary = []
+    for name in names:
+        totals = dict.fromkeys(fields, 0)
+        for window in windows:
+            for field in fields:
+                totals[field] += values.get(f"perf:{window}:{name}:{field}", 0)
+        buckets = [totals[f"b{index}"] for index in range(len(LATENCY_BUCKETS_MS))]
+        count = sum(buckets)
+        if not count:
+            continue
+        summary.append({
+            'endpoint': name,
+            'requests': count,
+            'p50_ms': _percentile(buckets, count, 0.50),
+            'p95_ms': _percentile(buckets, count, 0.95),
+            'p99_ms': _percentile(buckets, count, 0.99),
+            'avg_queries': round(totals['queries'] / count, 1),
+            'avg_db_ms': round(totals['db_ms'] / count, 1),
+            'over_budget': totals['over'],
+            'budget': budgets.get(name),
+        })
+
+    above_largest_bucket = float('inf')
+    summary.sort(
+        key=lambda row: row['p95_ms'] if row['p95_ms'] is not None else above_largest_bucket,
+        reverse=True,
+    )
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# Middleware and service decorator
+# -----------------------------------------------------------------------------
+
+class QueryBudgetMiddleware:
+    """
+    Record query count, DB time and total time for every request.
+
+    Adds a Server-Timing header (visible in the browser dev tools) and
+    checks the view's budget.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else 'unresolved'
+        budget = getattr(request, 'query_budget', None)
+        if budget is None:
+            budget = getattr(settings, 'QUERY_BUDGETS', {}).get(name)
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.db_ms:.1f};desc="{recorder.queries} queries", '
+            f'total;dur={recorder.total_ms:.1f}'
+        )
+        over_budget = False
+        try:
+            over_budget = check_budget(name, recorder, budget)
+        finally:
+            record_sample(name, recorder, over_budget)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Class-based views carry the budget on the view class
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is None and hasattr(view_func, 'view_class'):
+            budget = getattr(view_func.view_class, 'query_budget', None)
+        request.query_budget = budget
+        return None
+
+
+def instrumented(func=None, *, max_queries=None, max_ms=None):
+    """
+    Record a service function's queries and time, checking its budget.
+
+        @instrumented(max_queries=32)
+        def record_lpg_exchange(...):
+    """
+    def decorator(func):
+        name = f"service:{func.__module__}.{func.__qualname__}"
+        budget = (max_queries, max_ms) if max_queries is not None or max_ms is not None else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with record_queries() as recorder:
+                result = func(*args, **kwargs)
+            over_budget = False
+            try:
+                # Read at call time: @query_budget may sit above this decorator
+                over_budget = check_budget(name, recorder, wrapper.query_budget)
+            finally:
+                record_sample(name, recorder, over_budget)
+            return result
+
+        # Without explicit limits, fall back to a @query_budget below this one
+        wrapper.query_budget = budget if budget is not None else getattr(func, 'query_budget', None)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,263 @@
+"""
+Ledger Integrity Checks - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ + RQ-Scheduler (DEC-P04)
+
+Verifies the double-entry invariants that JournalEntry.clean() and the
+posting service assume but nothing re-checks. Copy into
+financial/integrity.py; run verify_ledger() from `manage.py shell` or
+schedule it nightly with schedule_integrity_check().
+
+Checks, each one set-based SQL statement streamed through a server-side
+cursor:
+- entry_totals: header total_debit equals total_credit, and the lines sum
+  to them
+- missing_ledger_row / ledger_mismatch: every line of a posted or
+  reversed entry has a ledger row with the same entry, account, side,
+  amount, business and date
+- duplicate_ledger_rows: no line has more than one ledger row
+- balance_continuity: each ledger row's balance_after is the previous
+  row's (same account, id order) plus its own signed amount
+- current_balance: Account.current_balance equals the balance_after of
+  the account's last ledger row; with continuity this pins it to the
+  ledger sum
+
+Incremental runs start from the last verified Ledger.id (BatchJobState
+'ledger_integrity') and check only entries with new ledger rows, seeding
+continuity from each account's last verified row. Rows newer than
+WATERMARK_OVERLAP are left for the next run, so a transaction that
+committed late cannot be skipped. All checks read one REPEATABLE READ
+snapshot, from the reporting replica when it is usable.
+
+Discrepancies are written as CSV to ``report_file`` and counted (with a
+few samples) in the returned stats and the job state.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import csv
+import logging
+from collections import Counter
+from datetime import timedelta
+
+import django_rq
+from django.db import connections, transaction
+from django.utils import timezone
+
+from db_routing import reporting_alias
+from django_models import BatchJobState, Ledger
+from period_close import SIGNED_AMOUNT
+
+
+logger = logging.getLogger(__name__)
+
+INTEGRITY_JOB_NAME = 'ledger_integrity'
+STREAM_CHUNK_SIZE = 5000
+SAMPLES_PER_CHECK = 10
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+REPORT_HEADER = ['check', 'journal_entry_id', 'ledger_id', 'account_id', 'expected', 'actual']
+
+# Entries with ledger rows in the id range (incremental runs only)
+ENTRY_SCOPE = """
+    AND je.id IN (
+        SELECT journal_entry_id FROM ledger WHERE id > %(after)s AND id <= %(upto)s
+    )
+"""
+
+ENTRY_TOTALS_SQL = """
+    SELECT 'entry_totals', je.id, NULL, NULL,
+           je.total_debit || '/' || je.total_credit,
+           COALESCE(SUM(jl.amount) FILTER (WHERE jl.is_debit), 0)
+               || '/' || COALESCE(SUM(jl.amount) FILTER (WHERE NOT jl.is_debit), 0)
+    FROM journal_entry je
+    LEFT JOIN journal_entry_line jl ON jl.journal_entry_id = je.id
+    WHERE je.status <> 'draft' {scope}
+    GROUP BY je.id
+    HAVING je.total_debit <> je.total_credit
+        OR COALESCE(SUM(jl.amount) FILTER (WHERE jl.is_debit), 0) <> je.total_debit
+        OR COALESCE(SUM(jl.amount) FILTER (WHERE NOT jl.is_debit), 0) <> je.total_credit
+"""
+
+LINE_LEDGER_SQL = """
+    SELECT CASE WHEN l.id IS NULL THEN 'missing_ledger_row' ELSE 'ledger_mismatch' END,
+           jl.journal_entry_id, l.id, jl.account_id,
+           concat_ws('/', jl.journal_entry_id, jl.account_id, jl.is_debit, jl.amount,
+                     je.business_id, je.transaction_date),
+           concat_ws('/', l.journal_entry_id, l.account_id, l.is_debit, l.amount,
+                     l.business_id, l.transaction_date)
+    FROM journal_entry_line jl
+    JOIN journal_entry je ON je.id = jl.journal_entry_id
+    LEFT JOIN ledger l ON l.journal_entry_line_id = jl.id
+    WHERE je.status <> 'draft' {scope}
+      AND (
+          l.id IS NULL
+          OR l.journal_entry_id <> jl.journal_entry_id
+          OR l.account_id <> jl.account_id
+          OR l.is_debit <> jl.is_debit
+          OR l.amount <> jl.amount
+          OR l.business_id <> je.business_id
+          OR l.transaction_date <> je.transaction_date
+      )
+"""
+
+DUPLICATE_LEDGER_SQL = """
+    SELECT 'duplicate_ledger_rows', MIN(l.journal_entry_id), MAX(l.id), MIN(l.account_id),
+           '1', COUNT(*)::text
+    FROM ledger l
+    WHERE l.id <= %(upto)s {scope}
+    GROUP BY l.journal_entry_line_id
+    HAVING COUNT(*) > 1
+"""
+
+DUPLICATE_SCOPE = """
+    AND l.journal_entry_line_id IN (
+        SELECT journal_entry_line_id FROM ledger WHERE id > %(after)s AND id <= %(upto)s
+    )
+"""
+
+CONTINUITY_SQL = f"""
+    WITH touched AS (
+        SELECT DISTINCT account_id FROM ledger WHERE id > %(after)s AND id <= %(upto)s
+    ),
+    seed AS (
+        -- Last verified row of each touched account (none on a full run)
+        SELECT last.id, last.journal_entry_id, last.account_id, last.balance_after,
+               NULL::numeric AS delta
+        FROM touched
+        CROSS JOIN LATERAL (
+            SELECT id, journal_entry_id, account_id, balance_after
+            FROM ledger
+            WHERE account_id = touched.account_id AND id <= %(after)s
+            ORDER BY id DESC
+            LIMIT 1
+        ) last
+    ),
+    checked AS (
+        SELECT * FROM seed
+        UNION ALL
+        SELECT l.id, l.journal_entry_id, l.account_id, l.balance_after, {SIGNED_AMOUNT}
+        FROM ledger l
+        JOIN account a ON a.id = l.account_id
+        JOIN account_type at ON at.id = a.account_type_id
+        WHERE l.id > %(after)s AND l.id <= %(upto)s
+    )
+    SELECT 'balance_continuity', journal_entry_id, id, account_id,
+           (previous + delta)::text, balance_after::text
+    FROM (
+        SELECT checked.*,
+               LAG(balance_after) OVER (PARTITION BY account_id ORDER BY id) AS previous
+        FROM checked
+    ) ordered
+    WHERE delta IS NOT NULL
+      AND previous IS NOT NULL
+      AND previous + delta <> balance_after
+"""
+
+# Not bounded by the watermark: the snapshot holds every committed row and
+# the balances written in the same transactions.
+CURRENT_BALANCE_SQL = """
+    SELECT 'current_balance', last.journal_entry_id, last.id, a.id,
+           last.balance_after::text, a.current_balance::text
+    FROM account a
+    CROSS JOIN LATERAL (
+        SELECT id, journal_entry_id, balance_after
+        FROM ledger
+        WHERE account_id = a.id
+        ORDER BY id DESC
+        LIMIT 1
+    ) last
+    WHERE a.current_balance <> last.balance_after
+"""
+
+
+def _stream(db, sql, params):
+    with db.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+
+def _checks(full):
+    entry_scope = '' if full else ENTRY_SCOPE
+    return [
+        ENTRY_TOTALS_SQL.format(scope=entry_scope),
+        LINE_LEDGER_SQL.format(scope=entry_scope),
+        DUPLICATE_LEDGER_SQL.format(scope='' if full else DUPLICATE_SCOPE),
+        CONTINUITY_SQL,
+        CURRENT_BALANCE_SQL,
+    ]
+
+
+def verify_ledger(full=False, report_file=None):
+    """
+    Check the double-entry invariants and report discrepancies.
+
+    Checks ledger rows added since the last run, or everything when
+    ``full`` (or on the first run). ``report_file`` is a text file object
+    that receives one CSV row per discrepancy. Returns run stats.
+    """
+    state, _ = BatchJobState.objects.get_or_create(job_name=INTEGRITY_JOB_NAME)
+    after = 0 if full or state.watermark_id is None else state.watermark_id
+    # Leave rows from still-open transactions to the next run
+    upto = Ledger.objects.filter(
+        created_at__lte=timezone.now() - WATERMARK_OVERLAP
+    ).order_by('-id').values_list('id', flat=True).first() or after
+    params = {'after': after, 'upto': upto}
+
+    writer = None
+    if report_file is not None:
+        writer = csv.writer(report_file)
+        writer.writerow(REPORT_HEADER)
+
+    counts = Counter()
+    samples = {}
+    using = reporting_alias()
+    with transaction.atomic(using=using):
+        db = connections[using]
+        with db.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        for sql in _checks(after == 0):
+            for row in _stream(db, sql, params):
+                check = row[0]
+                counts[check] += 1
+                if counts[check] <= SAMPLES_PER_CHECK:
+                    samples.setdefault(check, []).append(list(row[1:]))
+                if writer is not None:
+                    writer.writerow(row)
+
+    stats = {
+        'full': after == 0,
+        'from_ledger_id': after,
+        'to_ledger_id': upto,
+        'discrepancies': dict(counts),
+        'samples': samples,
+    }
+    if counts:
+        logger.error("Ledger integrity: %s discrepancies %s", sum(counts.values()), dict(counts))
+
+    BatchJobState.objects.filter(job_name=INTEGRITY_JOB_NAME).update(
+        watermark_id=upto,
+        last_run_at=timezone.now(),
+        last_run_stats=stats,
+    )
+    return stats
+
+
+@django_rq.job('default')
+def verify_ledger_job():
+    """Scheduled incremental run; discrepancies land in the job state and the log."""
+    return verify_ledger()
+
+
+def schedule_integrity_check(cron_string='30 2 * * *'):
+    """Register the nightly integrity check with RQ-Scheduler (call once at deploy)."""
+    scheduler = django_rq.get_scheduler('default')
+    for scheduled in scheduler.get_jobs():
+        if scheduled.func_name.endswith('verify_ledger_job'):
+            scheduler.cancel(scheduled)
+    return scheduler.cron(cron_string, func=verify_ledger_job, queue_name='default')
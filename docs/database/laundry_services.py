@@ -0,0 +1,160 @@
+"""
+Laundry Services - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Service layer for the laundry business (DOMAIN 5 in django_models.py).
+Copy into laundry/services.py alongside the laundry models.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from django_models import LaundryJob, LaundryJobItem, LaundryServiceType
+from instrumentation import instrumented
+from tax import get_tax_rate, tax_exclusive
+
+
+CENT = Decimal('0.01')
+
+
+def _money(value):
+    """Round a Decimal to shillings and cents."""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def price_job_item(service_type, quantity, weight_kg=None, unit_price=None):
+    """
+    Price a single job item from its service type.
+
+    Pricing rules:
+    - per_item: quantity × price
+    - per_kg: weight_kg × price (quantity is the piece count only)
+    - per_bundle: quantity (bundles) × price
+    - flat_rate: price once, whatever the quantity
+
+    Returns (unit_price, line_total).
+    """
+    if unit_price is None:
+        unit_price = service_type.default_price
+    unit_price = _money(unit_price)
+
+    if service_type.pricing_type == 'per_kg':
+        if weight_kg is None or Decimal(weight_kg) <= 0:
+            raise ValidationError(
+                f"Weight is required for per-kg service '{service_type.name}'."
+            )
+        line_total = Decimal(weight_kg) * unit_price
+    elif service_type.pricing_type == 'flat_rate':
+        line_total = unit_price
+    else:
+        # per_item and per_bundle both multiply by quantity
+        line_total = quantity * unit_price
+
+    return unit_price, _money(line_total)
+
+
+# Service types 1, VAT 1, job number and insert 2, audit 1, items 1,
+# savepoint in a caller's transaction 2
+@instrumented(max_queries=8)
+@transaction.atomic
+def create_laundry_job(business, customer, items, received_by,
+                       received_date=None, expected_completion_date=None,
+                       discount_amount=Decimal('0.00'),
+                       amount_paid=Decimal('0.00'), notes=''):
+    """
+    Create a laundry job and all of its items in one transaction.
+
+    Every item is priced in memory, tax is applied once at the job level,
+    the job header is written once with final totals and the items are
+    inserted with a single bulk_create. This replaces one save() per item
+    plus repeated header saves to keep the totals in sync.
+
+    Each entry in ``items`` is a dict with:
+    - service_type_id (required)
+    - item_description (required)
+    - quantity (default 1)
+    - weight_kg (required for per_kg services)
+    - unit_price (optional override of the service default price)
+    - notes (optional)
+    """
+    items = list(items)
+    if not items:
+        raise ValidationError("A laundry job needs at least one item.")
+
+    service_types = LaundryServiceType.objects.in_bulk(
+        {item['service_type_id'] for item in items}
+    )
+
+    job_items = []
+    subtotal = Decimal('0.00')
+    for item in items:
+        service_type = service_types.get(item['service_type_id'])
+        if service_type is None or not service_type.is_active:
+            raise ValidationError(
+                f"Unknown or inactive laundry service: {item['service_type_id']}"
+            )
+        quantity = item.get('quantity', 1)
+        if quantity < 1:
+            raise ValidationError("Item quantity must be at least 1.")
+
+        unit_price, line_total = price_job_item(
+            service_type,
+            quantity,
+            weight_kg=item.get('weight_kg'),
+            unit_price=item.get('unit_price'),
+        )
+        subtotal += line_total
+        job_items.append(LaundryJobItem(
+            service_type=service_type,
+            item_description=item['item_description'],
+            quantity=quantity,
+            unit_price=unit_price,
+            line_total=line_total,
+            notes=item.get('notes', ''),
+        ))
+
+    discount_amount = _money(discount_amount)
+    if discount_amount > subtotal:
+        raise ValidationError("Discount cannot exceed the job subtotal.")
+
+    taxable = subtotal - discount_amount
+    tax_rate = get_tax_rate(business)
+    tax_amount = tax_exclusive(taxable, tax_rate)
+    total_amount = taxable + tax_amount
+    amount_paid = _money(amount_paid)
+
+    balance_due = total_amount - amount_paid
+    if balance_due > 0 and not customer.can_create_job(balance_due):
+        raise ValidationError(
+            f"Job total {total_amount} exceeds the credit limit for "
+            f"{customer.customer_code}."
+        )
+
+    # Single header write: LaundryJob.save() assigns the job number and
+    # derives balance_due from the totals computed above.
+    job = LaundryJob(
+        business=business,
+        customer=customer,
+        received_date=received_date or timezone.localdate(),
+        expected_completion_date=expected_completion_date,
+        subtotal_amount=subtotal,
+        discount_amount=discount_amount,
+        tax_rate=tax_rate,
+        tax_amount=tax_amount,
+        total_amount=total_amount,
+        amount_paid=amount_paid,
+        notes=notes,
+        received_by=received_by,
+    )
+    job.save()
+
+    for job_item in job_items:
+        job_item.job = job
+    LaundryJobItem.objects.bulk_create(job_items)
+
+    return job
@@ -0,0 +1,238 @@
+"""
+Laundry Scheduled Tasks - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ + RQ-Scheduler (DEC-P04)
+
+Overdue/uncollected laundry sweeper. Copy into laundry/tasks.py.
+
+The sweeper runs outside request handlers so the owner's dashboard only
+reads LaundryOverdueSummary. Each run is incremental: it only looks at
+jobs changed since the last run (updated_at watermark) and jobs that
+crossed the overdue cutoff since the last run, then recomputes the
+summary for the affected businesses with one aggregate over the
+idx_laundry_job_aging partial index.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import logging
+from datetime import timedelta
+
+import django_rq
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from decimal import Decimal
+
+from django_models import BatchJobState, LaundryJob, LaundryOverdueSummary
+from task_queue import defer
+
+
+logger = logging.getLogger(__name__)
+
+SWEEP_JOB_NAME = 'laundry_overdue_sweep'
+
+# Must match the predicate of idx_laundry_job_aging
+OPEN_STATUSES = ['received', 'washing', 'drying', 'ready']
+
+OVERDUE_DAYS = 30
+REMINDER_INTERVAL_DAYS = 7
+REMINDER_BATCH_SIZE = 200
+
+# Re-read a short window behind the watermark so rows committed by
+# transactions that started before the previous run are not missed.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def overdue_jobs(cutoff):
+    """Open jobs received before the cutoff date (served by idx_laundry_job_aging)."""
+    return LaundryJob.objects.filter(
+        status__in=OPEN_STATUSES,
+        received_date__lt=cutoff,
+    )
+
+
+def _refresh_summaries(business_ids, cutoff, now):
+    """Recompute LaundryOverdueSummary rows for the given businesses in one pass."""
+    rows = (
+        overdue_jobs(cutoff)
+        .filter(business_id__in=business_ids)
+        .values('business_id')
+        .annotate(
+            jobs=Count('id'),
+            balance=Sum('balance_due'),
+            ready=Count('id', filter=Q(status='ready')),
+            oldest=Min('received_date'),
+        )
+    )
+    by_business = {row['business_id']: row for row in rows}
+
+    summaries = []
+    for business_id in business_ids:
+        row = by_business.get(business_id, {})
+        summaries.append(LaundryOverdueSummary(
+            business_id=business_id,
+            overdue_jobs=row.get('jobs', 0),
+            overdue_balance=row.get('balance') or Decimal('0.00'),
+            ready_jobs=row.get('ready', 0),
+            oldest_received_date=row.get('oldest'),
+            computed_at=now,
+        ))
+
+    LaundryOverdueSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['business'],
+        update_fields=[
+            'overdue_jobs', 'overdue_balance', 'ready_jobs',
+            'oldest_received_date', 'computed_at',
+        ],
+    )
+
+
+@django_rq.job('default')
+def sweep_overdue_laundry():
+    """
+    Refresh overdue summaries and queue pickup reminders.
+
+    Scheduled hourly (see schedule_laundry_sweeper). Safe to run twice:
+    summaries are recomputed, and reminders are de-duplicated through
+    LaundryJob.last_reminder_date.
+    """
+    now = timezone.now()
+    today = timezone.localdate()
+    cutoff = today - timedelta(days=OVERDUE_DAYS)
+    reminder_cutoff = today - timedelta(days=REMINDER_INTERVAL_DAYS)
+
+    with transaction.atomic():
+        state, _ = BatchJobState.objects.select_for_update().get_or_create(
+            job_name=SWEEP_JOB_NAME
+        )
+        open_overdue = overdue_jobs(cutoff)
+
+        if state.watermark_at is None:
+            # First run: full pass over the partial index
+            business_ids = set(
+                open_overdue.values_list('business_id', flat=True).distinct()
+            )
+            reminder_ids = set(
+                open_overdue.filter(last_reminder_date__isnull=True)
+                .values_list('id', flat=True)
+            )
+        else:
+            last_cutoff = state.watermark_date - timedelta(days=OVERDUE_DAYS)
+            last_reminder_cutoff = state.watermark_date - timedelta(days=REMINDER_INTERVAL_DAYS)
+
+            # Jobs whose status or dates changed since the last run
+            changed = LaundryJob.objects.filter(
+                updated_at__gt=state.watermark_at - WATERMARK_OVERLAP
+            )
+            # Jobs that became overdue purely because time passed
+            newly_overdue = open_overdue.filter(received_date__gte=last_cutoff)
+
+            business_ids = set(
+                changed.values_list('business_id', flat=True).distinct()
+            ) | set(
+                newly_overdue.values_list('business_id', flat=True).distinct()
+            )
+
+            not_recently_reminded = (
+                Q(last_reminder_date__isnull=True)
+                | Q(last_reminder_date__lte=reminder_cutoff)
+            )
+            reminder_ids = set(
+                open_overdue
+                .filter(not_recently_reminded)
+                .filter(Q(id__in=changed.values('id')) | Q(received_date__gte=last_cutoff))
+                .values_list('id', flat=True)
+            )
+            # Overdue jobs whose reminder interval elapsed since the last run
+            reminder_ids |= set(
+                open_overdue.filter(
+                    last_reminder_date__gt=last_reminder_cutoff,
+                    last_reminder_date__lte=reminder_cutoff,
+                ).values_list('id', flat=True)
+            )
+
+        if business_ids:
+            _refresh_summaries(sorted(business_ids), cutoff, now)
+
+        reminder_ids = sorted(reminder_ids)
+        if reminder_ids:
+            # Mark first: QuerySet.update() leaves updated_at alone, so the
+            # reminder bookkeeping does not show up as a change next run.
+            LaundryJob.objects.filter(id__in=reminder_ids).update(
+                last_reminder_date=today
+            )
+            _defer_reminders(reminder_ids, today)
+
+        state.watermark_at = now
+        state.watermark_date = today
+        state.last_run_at = now
+        state.last_run_stats = {
+            'businesses_refreshed': len(business_ids),
+            'reminders_queued': len(reminder_ids),
+        }
+        state.save()
+
+    logger.info(
+        "Laundry overdue sweep: %d businesses refreshed, %d reminders queued",
+        len(business_ids), len(reminder_ids),
+    )
+    return state.last_run_stats
+
+
+def _defer_reminders(job_ids, today):
+    """Queue reminder delivery in fixed-size batches once the sweep commits."""
+    for start in range(0, len(job_ids), REMINDER_BATCH_SIZE):
+        batch = job_ids[start:start + REMINDER_BATCH_SIZE]
+        defer(
+            send_overdue_reminders, batch,
+            key=f'overdue_reminders:{today}:{batch[0]}',
+            queue='notifications',
+        )
+
+
+def send_overdue_reminders(job_ids):
+    """
+    Send pickup reminders for a batch of overdue jobs.
+
+    Loads the whole batch in one query. Delivery goes through the
+    callable named by settings.SMS_SENDER (phone_number, message).
+    """
+    send_sms = import_string(settings.SMS_SENDER)
+    jobs = (
+        LaundryJob.objects
+        .filter(id__in=job_ids, status__in=OPEN_STATUSES)
+        .select_related('business', 'customer__customer')
+        .only(
+            'job_number', 'status', 'balance_due', 'received_date',
+            'business__name',
+            'customer__customer__name', 'customer__customer__phone_number',
+        )
+    )
+    for job in jobs:
+        customer = job.customer.customer
+        if job.status == 'ready':
+            state = 'is ready for pickup'
+        else:
+            state = 'is still with us'
+        message = (
+            f"Hello {customer.name}, your laundry {job.job_number} at "
+            f"{job.business.name} {state} since {job.received_date:%d/%m/%Y}."
+        )
+        if job.balance_due > 0:
+            message += f" Balance due: KSh {job.balance_due}."
+        send_sms(customer.phone_number, message)
+
+
+def schedule_laundry_sweeper(cron_string='0 * * * *'):
+    """Register the hourly sweeper with RQ-Scheduler (call once at deploy)."""
+    scheduler = django_rq.get_scheduler('default')
+    for scheduled in scheduler.get_jobs():
+        if scheduled.func_name.endswith('sweep_overdue_laundry'):
+            scheduler.cancel(scheduled)
+    return scheduler.cron(cron_string, func=sweep_overdue_laundry, queue_name='default')
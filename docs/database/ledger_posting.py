@@ -0,0 +1,367 @@
+"""
+Ledger Posting - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Journal posting service for the financial core (DOMAIN 3 in
+django_models.py). Copy into financial/posting.py.
+
+Posting follows the transaction flow in README.md: header, lines,
+validation, ledger rows and account balances, all in one database
+transaction. Entries are posted in batches: one INSERT per table and one
+UPDATE for all touched account balances, however many entries or lines
+the batch holds. Ledger rows are hash-chained in the same INSERT
+(hash_chain.py).
+
+Entries dated in a closed accounting period (period_close.py) are
+rejected, or re-dated to the next open month when
+settings.CLOSED_PERIOD_POSTING = 'redirect'.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, Value, When
+from django.utils import timezone
+from decimal import Decimal
+
+from caching import invalidate
+from django_models import (
+    Account,
+    AccountingPeriod,
+    JournalEntry,
+    JournalEntryLine,
+    Ledger,
+    TransactionType,
+)
+from hash_chain import chain_rows
+from realtime import publish_ledger
+
+
+# Account numbers from seed_data.sql, keyed by business code.
+# Bank and VAT payable accounts are shared across businesses.
+CHART_OF_ACCOUNTS = {
+    'WTR': {
+        'cash': '1110',
+        'm_pesa': '1140',
+        'bank': '1170',
+        'vat_payable': '2130',
+        'inventory': '1210',
+        'revenue': '4100',
+        'cogs': '5110',
+    },
+    'LND': {
+        'cash': '1120',
+        'm_pesa': '1141',
+        'bank': '1170',
+        'vat_payable': '2130',
+        'revenue': '4200',
+        'supplies': '5210',
+    },
+    'RTL': {
+        'cash': '1130',
+        'm_pesa': '1142',
+        'bank': '1170',
+        'vat_payable': '2130',
+        'inventory': '1220',
+        'cylinders': '1230',
+        'revenue': '4300',
+        'lpg_revenue': '4310',
+        'cogs': '5120',
+    },
+}
+
+
+def get_accounts(business, *roles):
+    """
+    Resolve account roles (cash, m_pesa, revenue, ...) for a business.
+
+    Returns {role: Account} using a single query.
+    """
+    chart = CHART_OF_ACCOUNTS.get(business.code, {})
+    missing = [role for role in roles if role not in chart]
+    if missing:
+        raise ValidationError(
+            f"No account mapped for {', '.join(missing)} in business {business.code}."
+        )
+    numbers = {role: chart[role] for role in roles}
+    accounts = Account.objects.select_related('account_type').in_bulk(
+        set(numbers.values()), field_name='account_number'
+    )
+    return {role: accounts[number] for role, number in numbers.items()}
+
+
+def lock_posting_dates(transaction_dates):
+    """
+    Take the transaction-scoped advisory lock of each posting date.
+
+    Every posting holds the locks of its dates until it commits; period
+    close takes a whole month's locks to wait out in-flight postings.
+    """
+    with connection.cursor() as cursor:
+        for date_str in sorted({d.strftime('%Y%m%d') for d in transaction_dates}):
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f'JE-{date_str}'])
+
+
+def _allocate_entry_numbers(transaction_dates):
+    """
+    Allocate JE-YYYYMMDD-XXXX numbers for a batch of entries.
+
+    Takes the advisory lock of each date so concurrent posters cannot hand
+    out the same number, then reads the last number once per date instead
+    of once per entry.
+    """
+    lock_posting_dates(transaction_dates)
+    next_seq = {}
+    for date_str in sorted({d.strftime('%Y%m%d') for d in transaction_dates}):
+        last_number = JournalEntry.objects.filter(
+            entry_number__startswith=f'JE-{date_str}'
+        ).order_by('-entry_number').values_list('entry_number', flat=True).first()
+        next_seq[date_str] = int(last_number.split('-')[-1]) + 1 if last_number else 1
+
+    numbers = []
+    for transaction_date in transaction_dates:
+        date_str = transaction_date.strftime('%Y%m%d')
+        numbers.append(f'JE-{date_str}-{next_seq[date_str]:04d}')
+        next_seq[date_str] += 1
+    return numbers
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _closed_periods(entries):
+    """
+    (business_id, period_start) of the closed periods a batch falls in.
+
+    Periods are only closed once they have ended, so a batch dated in the
+    current month or later - every sale - needs no query.
+    """
+    current_month = timezone.localdate().replace(day=1)
+    back_dated = [spec for spec in entries if spec['transaction_date'] < current_month]
+    if not back_dated:
+        return set()
+    return set(AccountingPeriod.objects.filter(
+        business_id__in={spec['business'].id for spec in back_dated},
+        period_start__gte=min(spec['transaction_date'] for spec in back_dated).replace(day=1),
+        status='closed',
+    ).values_list('business_id', 'period_start'))
+
+
+def _apply_period_locks(entries):
+    """
+    Reject entries dated in a closed period, or re-date them.
+
+    With CLOSED_PERIOD_POSTING = 'redirect' an entry moves to the first
+    day of the next open month and its description keeps the original
+    date. Returns the (possibly re-dated) specs.
+    """
+    closed = _closed_periods(entries)
+    if not closed:
+        return entries
+    redirect = getattr(settings, 'CLOSED_PERIOD_POSTING', 'reject') == 'redirect'
+    applied = []
+    for spec in entries:
+        business_id = spec['business'].id
+        month = spec['transaction_date'].replace(day=1)
+        if (business_id, month) in closed:
+            if not redirect:
+                raise ValidationError(
+                    f"Accounting period {month:%Y-%m} is closed for {spec['business'].code}."
+                )
+            while (business_id, month) in closed:
+                month = _next_month(month)
+            spec = dict(
+                spec,
+                transaction_date=month,
+                description=f"{spec['description']} (dated {spec['transaction_date']})",
+            )
+        applied.append(spec)
+    return applied
+
+
+def _validate_entry(spec):
+    """Check one entry spec balances and only uses its own or shared accounts."""
+    total_debit = Decimal('0.00')
+    total_credit = Decimal('0.00')
+    for account, is_debit, amount, _ in spec['lines']:
+        if amount <= 0:
+            raise ValidationError("Journal entry line amounts must be positive.")
+        if account.business_id not in (None, spec['business'].id):
+            raise ValidationError(
+                f"Account {account.account_number} does not belong to "
+                f"business {spec['business'].code}."
+            )
+        if is_debit:
+            total_debit += amount
+        else:
+            total_credit += amount
+
+    if not spec['lines'] or total_debit != total_credit:
+        raise ValidationError(
+            f"Journal entry must balance. "
+            f"Debits: {total_debit}, Credits: {total_credit}"
+        )
+    return total_debit, total_credit
+
+
+@transaction.atomic
+def post_journal_entries(entries):
+    """
+    Post a batch of balanced journal entries.
+
+    Each entry spec is a dict with business, transaction_type,
+    transaction_date, description, created_by, optional reference_number
+    and reversal_of, and ``lines`` as (account, is_debit, amount,
+    description) tuples.
+
+    Writes one INSERT each for headers, lines and ledger rows, and one
+    UPDATE for every touched account balance. Accounts are locked in id
+    order, so concurrent batches cannot deadlock on each other.
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+
+    entries = _apply_period_locks(entries)
+    totals = [_validate_entry(spec) for spec in entries]
+    numbers = _allocate_entry_numbers([spec['transaction_date'] for spec in entries])
+    # A close that held the date locks has committed by now; recheck
+    if _closed_periods(entries):
+        raise ValidationError("An accounting period was closed during posting; retry.")
+    now = timezone.now()
+
+    headers = JournalEntry.objects.bulk_create([
+        JournalEntry(
+            entry_number=number,
+            business=spec['business'],
+            transaction_type=spec['transaction_type'],
+            transaction_date=spec['transaction_date'],
+            description=spec['description'],
+            reference_number=spec.get('reference_number', ''),
+            status='posted',
+            total_debit=total_debit,
+            total_credit=total_credit,
+            created_by=spec['created_by'],
+            reversal_of=spec.get('reversal_of'),
+            posted_at=now,
+        )
+        for spec, number, (total_debit, total_credit) in zip(entries, numbers, totals)
+    ])
+    # bulk_create() sends no post_save, so invalidate cached reports here
+    days_by_business = defaultdict(set)
+    for header in headers:
+        days_by_business[header.business_id].add(header.transaction_date)
+    for business_id, days in days_by_business.items():
+        invalidate(JournalEntry, business_id, days)
+
+    lines = JournalEntryLine.objects.bulk_create([
+        JournalEntryLine(
+            journal_entry=header,
+            account=account,
+            description=line_description[:200],
+            is_debit=is_debit,
+            amount=amount,
+        )
+        for header, spec in zip(headers, entries)
+        for account, is_debit, amount, line_description in spec['lines']
+    ])
+
+    account_ids = sorted({line.account_id for line in lines})
+    accounts = {
+        account.id: account
+        for account in Account.objects.select_for_update()
+        .select_related('account_type')
+        .filter(id__in=account_ids)
+        .order_by('id')
+    }
+    balances = {account_id: accounts[account_id].current_balance for account_id in account_ids}
+
+    headers_by_id = {header.id: header for header in headers}
+    ledger_rows = []
+    for line in lines:
+        header = headers_by_id[line.journal_entry_id]
+        account = accounts[line.account_id]
+        balances[account.id] += account.balance_delta(line.amount, line.is_debit)
+        ledger_rows.append(Ledger(
+            journal_entry=header,
+            journal_entry_line=line,
+            account=account,
+            business=header.business,
+            transaction_date=header.transaction_date,
+            transaction_type=header.transaction_type,
+            description=line.description,
+            is_debit=line.is_debit,
+            amount=line.amount,
+            balance_after=balances[account.id],
+            reference_number=header.reference_number,
+        ))
+    Ledger.objects.bulk_create(chain_rows(ledger_rows))
+    publish_ledger(ledger_rows)
+
+    _set_account_balances(balances, now)
+    return headers
+
+
+def _set_account_balances(balances, now=None):
+    """Write {account_id: balance} in a single UPDATE."""
+    if not balances:
+        return
+    Account.objects.filter(id__in=balances).update(
+        current_balance=Case(
+            *[When(id=account_id, then=Value(balance)) for account_id, balance in balances.items()],
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ),
+        updated_at=now or timezone.now(),
+    )
+
+
+def post_journal_entry(business, transaction_type_code, transaction_date,
+                       description, lines, created_by, reference_number=''):
+    """
+    Post a single balanced journal entry and return it.
+
+    ``lines`` is a list of (account, is_debit, amount, description) tuples.
+    """
+    transaction_type = TransactionType.objects.get(code=transaction_type_code)
+    return post_journal_entries([{
+        'business': business,
+        'transaction_type': transaction_type,
+        'transaction_date': transaction_date,
+        'description': description,
+        'reference_number': reference_number,
+        'created_by': created_by,
+        'lines': lines,
+    }])[0]
+
+
+def sale_lines(accounts, payment_method, revenue_role, amount, description,
+               tax_amount=Decimal('0.00')):
+    """
+    Build the standard lines for a sale.
+
+    Dr payment account (gross), Cr revenue (net of VAT) and, when VAT is
+    charged, Cr VAT payable. ``accounts`` must include 'vat_payable' when
+    tax_amount is non-zero.
+    """
+    lines = [
+        (accounts[payment_method], True, amount, description),
+        (accounts[revenue_role], False, amount - tax_amount, description),
+    ]
+    if tax_amount:
+        lines.append((accounts['vat_payable'], False, tax_amount, f"VAT: {description}"))
+    return lines
+
+
+def cogs_lines(accounts, amount, description):
+    """Build the Dr cost of goods sold / Cr inventory lines for a sale."""
+    return [
+        (accounts['cogs'], True, amount, f"COGS: {description}"),
+        (accounts['inventory'], False, amount, f"COGS: {description}"),
+    ]
@@ -0,0 +1,456 @@
+"""
+Load Test Harness - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Scripted load test of the sale-recording and dashboard paths. Copy into
+core/load_test.py and run from `manage.py shell` against a database
+filled by synthetic_data.generate_history():
+
+    from load_test import run_load_test
+    report = run_load_test(duration=60, workers=4)
+
+Each worker thread has its own database connection and runs a weighted
+mix of operations until the duration is up. Every call is timed and its
+queries counted (instrumentation.record_queries). The report gives
+throughput and exact p50/p95/p99 latency per operation.
+
+Rejections (no full cylinder left, not enough stock, ...) are counted
+separately from errors: they are the services refusing bad input under
+contention, not failures. Errors are counted per exception type and the
+first traceback of each is logged, so a broken path stands out.
+
+compare_connection_modes() runs the short mobile-request mix once per
+connection mode (reconnect per call, persistent, persistent with prepared
+statements) to measure connection pooling and statement preparation.
+
+check_exchange_race() is the concurrency check of record_lpg_exchange():
+many threads exchange the same full cylinder at once, and exactly one
+may succeed. check_replica_routing() checks the read-replica routing
+rules (db_routing.py) against a second local database.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import contextvars
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from decimal import Decimal
+
+from connection_pooling import pool_stats, set_statement_preparation
+from costing import gross_margin
+from db_routing import assume_replica_health, pin_to_primary, replica_alias, reporting, track_replica_reads
+from django_models import (
+    Business,
+    LaundryCustomer,
+    LaundryOverdueSummary,
+    LaundryServiceType,
+    RetailInventory,
+    RetailLPGCylinder,
+    RetailLPGExchange,
+    WaterProductSize,
+)
+from instrumentation import record_queries
+from laundry_services import create_laundry_job
+from lpg_services import fleet_dashboard, record_lpg_exchange
+from retail_services import record_retail_sale
+from water_services import record_production_runs, record_water_sales
+
+
+logger = logging.getLogger(__name__)
+
+# Operation -> relative weight
+DEFAULT_MIX = {
+    'water_sale': 20,
+    'retail_sale': 20,
+    'laundry_job': 15,
+    'lpg_exchange': 10,
+    'water_production': 5,
+    'gross_margin': 10,
+    'gross_margin_uncached': 5,
+    'fleet_dashboard': 10,
+    'overdue_summary': 5,
+}
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """
+    Per-operation statistics from (operation, outcome, ms, queries) samples.
+
+    An error outcome is 'error:<exception type>'; errors are counted in
+    total and per type. Shared with the benchmark suite so both report
+    the same numbers.
+    """
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample[0]].append(sample)
+
+    report = {}
+    for operation, rows in sorted(by_operation.items()):
+        latencies = sorted(ms for _, outcome, ms, _ in rows if outcome == 'ok')
+        queries = [count for _, outcome, _, count in rows if outcome == 'ok']
+        outcomes = defaultdict(int)
+        error_types = defaultdict(int)
+        for _, outcome, _, _ in rows:
+            kind, _, error_type = outcome.partition(':')
+            outcomes[kind] += 1
+            if kind == 'error':
+                error_types[error_type] += 1
+        report[operation] = {
+            'calls': len(rows),
+            'ok': outcomes['ok'],
+            'rejected': outcomes['rejected'],
+            'errors': outcomes['error'],
+            'error_types': dict(error_types),
+            'throughput_per_s': round(outcomes['ok'] / elapsed, 2) if elapsed else None,
+            'p50_ms': _round(_percentile(latencies, 0.50)),
+            'p95_ms': _round(_percentile(latencies, 0.95)),
+            'p99_ms': _round(_percentile(latencies, 0.99)),
+            'mean_ms': _round(statistics.fmean(latencies)) if latencies else None,
+            'mean_queries': _round(statistics.fmean(queries)) if queries else None,
+            'max_queries': max(queries) if queries else None,
+        }
+    return report
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+class ReferenceContext:
+    """Reference rows the operations draw from, loaded once per run."""
+
+    def __init__(self):
+        businesses = {business.code: business for business in Business.objects.filter(code__in=['WTR', 'LND', 'RTL'])}
+        self.water = businesses['WTR']
+        self.laundry = businesses['LND']
+        self.retail = businesses['RTL']
+        self.user = get_user_model().objects.filter(is_superuser=True).order_by('id').first()
+        self.laundry_customers = list(LaundryCustomer.objects.select_related('customer')[:500])
+        self.service_types = list(LaundryServiceType.objects.filter(is_active=True))
+        self.water_size_ids = list(WaterProductSize.objects.filter(is_active=True).values_list('id', flat=True))
+        self.retail_product_ids = list(
+            RetailInventory.objects.filter(
+                business=self.retail, product__is_lpg=False, quantity_in_stock__gt=0
+            ).values_list('product_id', flat=True)
+        )
+        self.full_cylinder_ids = list(
+            RetailLPGCylinder.objects.filter(business=self.retail, status='full').values_list('id', flat=True)
+        )
+        self.cylinder_lock = threading.Lock()
+        self.today = timezone.localdate()
+        self.month_start = self.today.replace(day=1)
+
+
+def _laundry_job(ctx, rng):
+    items = []
+    for _ in range(rng.randint(1, 4)):
+        service_type = rng.choice(ctx.service_types)
+        item = {'service_type_id': service_type.id, 'item_description': 'Load test', 'quantity': rng.randint(1, 5)}
+        if service_type.pricing_type == 'per_kg':
+            item['weight_kg'] = Decimal('4.5')
+        items.append(item)
+    create_laundry_job(
+        ctx.laundry, rng.choice(ctx.laundry_customers), items, ctx.user,
+        amount_paid=Decimal('0.00'),
+    )
+
+
+def _lpg_exchange(ctx, rng):
+    with ctx.cylinder_lock:
+        if not ctx.full_cylinder_ids:
+            raise ValidationError("No full cylinders left in the load-test pool.")
+        cylinder_id = ctx.full_cylinder_ids.pop(rng.randrange(len(ctx.full_cylinder_ids)))
+    record_lpg_exchange(
+        ctx.retail, cylinder_id, Decimal('200.00'), rng.choice(['cash', 'm_pesa']), ctx.user,
+    )
+
+
+def _water_sale(ctx, rng):
+    record_water_sales(
+        ctx.water,
+        [{
+            'product_size_id': rng.choice(ctx.water_size_ids),
+            'quantity_sold': rng.randint(1, 3),
+            'payment_method': rng.choice(['cash', 'm_pesa']),
+        }],
+        ctx.today,
+        ctx.user,
+    )
+
+
+def _retail_sale(ctx, rng):
+    product_ids = rng.sample(ctx.retail_product_ids, min(len(ctx.retail_product_ids), rng.randint(1, 3)))
+    record_retail_sale(
+        ctx.retail,
+        [{'product_id': product_id, 'quantity': rng.randint(1, 2)} for product_id in product_ids],
+        rng.choice(['cash', 'm_pesa']),
+        ctx.user,
+    )
+
+
+def _water_production(ctx, rng):
+    record_production_runs(
+        ctx.water,
+        [{'product_size_id': rng.choice(ctx.water_size_ids), 'quantity_produced': 10, 'production_cost': Decimal('15.00')}],
+        ctx.today,
+        ctx.user,
+    )
+
+
+def _gross_margin(ctx, rng):
+    gross_margin(ctx.retail, ctx.month_start, ctx.today)
+
+
+def _gross_margin_uncached(ctx, rng):
+    gross_margin.uncached(ctx.retail, ctx.month_start, ctx.today)
+
+
+def _fleet_dashboard(ctx, rng):
+    fleet_dashboard(ctx.retail)
+
+
+def _overdue_summary(ctx, rng):
+    LaundryOverdueSummary.objects.filter(business=ctx.laundry).first()
+
+
+OPERATIONS = {
+    'water_sale': _water_sale,
+    'retail_sale': _retail_sale,
+    'laundry_job': _laundry_job,
+    'lpg_exchange': _lpg_exchange,
+    'water_production': _water_production,
+    'gross_margin': _gross_margin,
+    'gross_margin_uncached': _gross_margin_uncached,
+    'fleet_dashboard': _fleet_dashboard,
+    'overdue_summary': _overdue_summary,
+}
+
+
+def _worker(ctx, mix, deadline, seed, reconnect=False, prepared=None):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    logged = set()
+    if prepared is not None:
+        set_statement_preparation(prepared)
+    try:
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            outcome = 'ok'
+            with record_queries() as recorder:
+                try:
+                    OPERATIONS[name](ctx, rng)
+                except ValidationError:
+                    outcome = 'rejected'
+                except Exception as exc:
+                    outcome = f'error:{type(exc).__name__}'
+                    # One traceback per operation and error type per worker
+                    if (name, outcome) not in logged:
+                        logged.add((name, outcome))
+                        logger.exception("Load-test operation %s failed", name)
+            samples.append((name, outcome, recorder.total_ms, recorder.queries))
+            if reconnect:
+                # As at the end of a request: the next call pays for a new
+                # connection (or a pool checkout)
+                connection.close()
+    finally:
+        connection.close()
+    return samples
+
+
+def run_load_test(duration=60, workers=4, mix=None, seed=1, reconnect=False, prepared=None):
+    """
+    Run the operation mix on ``workers`` threads for ``duration`` seconds.
+
+    ``reconnect`` closes the connection after every call, like a request
+    with CONN_MAX_AGE = 0. ``prepared`` switches statement preparation on
+    or off (None leaves the connection settings alone).
+
+    Returns {'elapsed_s', 'workers', 'operations': summarize(...)}.
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown load-test operations: {sorted(unknown)}")
+
+    ctx = ReferenceContext()
+
+    start = time.monotonic()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_worker, ctx, mix, deadline, seed + index, reconnect, prepared)
+            for index in range(workers)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.monotonic() - start
+
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'workers': workers,
+        'operations': summarize(samples, elapsed),
+    }
+
+
+# Hot short-request paths compared by compare_connection_modes()
+SHORT_REQUEST_MIX = {
+    'water_sale': 25,
+    'retail_sale': 25,
+    'lpg_exchange': 15,
+    'laundry_job': 20,
+    'fleet_dashboard': 10,
+    'overdue_summary': 5,
+}
+
+CONNECTION_MODES = {
+    'reconnect': {'reconnect': True, 'prepared': None},
+    'persistent_unprepared': {'reconnect': False, 'prepared': False},
+    'persistent_prepared': {'reconnect': False, 'prepared': True},
+}
+
+
+def compare_connection_modes(duration=30, workers=8, mix=None, seed=1):
+    """
+    Latency of the short mobile-request paths under each connection mode.
+
+    'reconnect' is the per-request connection baseline; with 'pool'
+    configured the reconnect is a pool checkout instead (keeping the
+    connection's prepared statements), so run it once with and once
+    without the pool to see the pooling gain. The persistent modes
+    isolate the effect of prepared statements.
+
+    Returns {mode: run_load_test(...) report} plus 'pool_stats'.
+    """
+    mix = mix or SHORT_REQUEST_MIX
+    results = {}
+    for mode, options in CONNECTION_MODES.items():
+        results[mode] = run_load_test(duration, workers, mix, seed, **options)
+    results['pool_stats'] = pool_stats()
+    return results
+
+
+
+# -----------------------------------------------------------------------------
+# Concurrency checks
+# -----------------------------------------------------------------------------
+
+def _exchange_attempt(ctx, cylinder_id, barrier):
+    try:
+        barrier.wait()
+        record_lpg_exchange(ctx.retail, cylinder_id, Decimal('200.00'), 'cash', ctx.user)
+        return 'ok'
+    except ValidationError:
+        return 'rejected'
+    finally:
+        connection.close()
+
+
+def check_exchange_race(threads=8):
+    """
+    Race ``threads`` exchanges of the same full cylinder; exactly one may win.
+
+    Each thread has its own connection and all start together on a
+    barrier. Raises AssertionError unless one exchange is recorded and
+    every other attempt is rejected with ValidationError (any other
+    exception propagates). Needs LPG stock for the cylinder's size, and
+    leaves the winning exchange in the database.
+    """
+    ctx = ReferenceContext()
+    if not ctx.full_cylinder_ids:
+        raise ValueError("No full cylinder to race on.")
+    cylinder_id = ctx.full_cylinder_ids[0]
+    recorded_before = RetailLPGExchange.objects.filter(full_cylinder_id=cylinder_id).count()
+
+    barrier = threading.Barrier(threads)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(_exchange_attempt, ctx, cylinder_id, barrier) for _ in range(threads)]
+        outcomes = [future.result() for future in futures]
+
+    issued = outcomes.count('ok')
+    recorded = RetailLPGExchange.objects.filter(full_cylinder_id=cylinder_id).count() - recorded_before
+    if issued != 1 or recorded != 1:
+        raise AssertionError(
+            f"Cylinder #{cylinder_id} was issued {issued} times "
+            f"({recorded} exchanges recorded) by {threads} threads."
+        )
+    return {'threads': threads, 'cylinder_id': cylinder_id, 'issued': issued, 'rejected': outcomes.count('rejected')}
+
+
+def _read_aliases(replica, read):
+    """Aliases that ran a query while ``read`` ran."""
+    with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, \
+            CaptureQueriesContext(connections[replica]) as secondary:
+        read()
+    return {alias for alias, captured in ((DEFAULT_DB_ALIAS, primary), (replica, secondary)) if len(captured)}
+
+
+def _pinned_read(replica, read):
+    pin_to_primary()
+    return _read_aliases(replica, read)
+
+
+def check_replica_routing():
+    """
+    Check the read-replica routing rules against a second local database.
+
+    Point the replica alias at another local database holding the schema
+    (the primary's own database under a second alias will do). A local
+    database is not in recovery, so the check declares the replica
+    healthy itself. Raises AssertionError on the first rule that fails.
+    """
+    replica = replica_alias()
+    if replica not in settings.DATABASES:
+        raise ValueError(f"No '{replica}' database configured.")
+
+    def read():
+        Business.objects.exists()
+
+    def reporting_read():
+        with reporting():
+            Business.objects.exists()
+
+    def expect(rule, aliases, expected):
+        if aliases != {expected}:
+            raise AssertionError(f"{rule}: read from {sorted(aliases)}, expected {expected}.")
+
+    try:
+        assume_replica_health(True)
+        expect("Ordinary read", _read_aliases(replica, read), DEFAULT_DB_ALIAS)
+        with track_replica_reads() as reads:
+            expect("Reporting read", _read_aliases(replica, reporting_read), replica)
+        if not reads['replica']:
+            raise AssertionError("Replica read was not tracked, so its result would be cached too long.")
+        with transaction.atomic():
+            expect("Reporting read in a transaction", _read_aliases(replica, reporting_read), DEFAULT_DB_ALIAS)
+        # Pinning lasts for the request; a copied context keeps it out of this one
+        expect(
+            "Reporting read after a write",
+            contextvars.copy_context().run(_pinned_read, replica, reporting_read),
+            DEFAULT_DB_ALIAS,
+        )
+        assume_replica_health(False)
+        expect("Reporting read with the replica lagging", _read_aliases(replica, reporting_read), DEFAULT_DB_ALIAS)
+    finally:
+        assume_replica_health(None)
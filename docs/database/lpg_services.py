@@ -0,0 +1,398 @@
+"""
+LPG Services - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Cylinder circulation tracking for the retail/LPG business (DOMAIN 6 in
+django_models.py). Copy into retail/lpg_services.py.
+
+Fleet counts live in RetailLPGFleetSummary and are adjusted by deltas in
+the same transaction as every cylinder status change, so dashboards read
+a handful of rows instead of running GROUP BY over the whole fleet.
+Every change is also written to RetailLPGCylinderEvent, which gives each
+cylinder an indexed history.
+
+record_lpg_exchange() is the only supported way to record an exchange:
+it locks both cylinders, flips their states with one UPDATE, reduces
+LPG stock, posts the sale journal and updates the fleet summary in a
+single transaction.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from django_models import (
+    RetailInventory,
+    RetailLPGCylinder,
+    RetailLPGCylinderEvent,
+    RetailLPGExchange,
+    RetailLPGFleetSummary,
+)
+from caching import invalidate
+from costing import consume_stock
+from instrumentation import instrumented
+from ledger_posting import cogs_lines, get_accounts, post_journal_entry, sale_lines
+from pagination import KeysetPaginator
+from tax import get_tax_rate, split_inclusive
+
+
+VALID_STATUSES = {choice for choice, _ in RetailLPGCylinder.CYLINDER_STATUS_CHOICES}
+
+SHOP_LOCATION = 'Shop'
+
+
+def _fleet_key(brand, capacity_kg, status):
+    """Normalise a (brand, capacity, status) key so 13 and 13.00 match."""
+    return (brand, Decimal(capacity_kg).quantize(Decimal('0.01')), status)
+
+
+def _apply_fleet_deltas(business_id, deltas):
+    """
+    Apply count deltas to RetailLPGFleetSummary in one UPDATE.
+
+    Missing rows are created first with a zero count, then every touched
+    row is incremented by its own delta through a CASE expression.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    RetailLPGFleetSummary.objects.bulk_create(
+        [
+            RetailLPGFleetSummary(
+                business_id=business_id,
+                brand=brand,
+                capacity_kg=capacity_kg,
+                status=status,
+                cylinder_count=0,
+            )
+            for brand, capacity_kg, status in sorted(deltas)
+        ],
+        ignore_conflicts=True,
+    )
+
+    conditions = {
+        key: Q(brand=key[0], capacity_kg=key[1], status=key[2])
+        for key in deltas
+    }
+    RetailLPGFleetSummary.objects.filter(
+        reduce(or_, conditions.values()),
+        business_id=business_id,
+    ).update(
+        cylinder_count=F('cylinder_count') + Case(
+            *[When(condition, then=Value(deltas[key])) for key, condition in conditions.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def record_cylinder_transitions(business, transitions, event_date,
+                                exchange=None, customer=None):
+    """
+    Record cylinder status changes in the fleet summary and event history.
+
+    Must run inside the caller's transaction, after the cylinder rows have
+    been locked. ``transitions`` is a list of
+    (cylinder, from_status, to_status, event_type) tuples; ``from_status``
+    is None for newly registered cylinders.
+    """
+    deltas = defaultdict(int)
+    events = []
+    for cylinder, from_status, to_status, event_type in transitions:
+        if to_status not in VALID_STATUSES:
+            raise ValidationError(f"Invalid cylinder status: {to_status}")
+        if from_status == to_status:
+            continue
+        if from_status:
+            deltas[_fleet_key(cylinder.brand, cylinder.capacity_kg, from_status)] -= 1
+        deltas[_fleet_key(cylinder.brand, cylinder.capacity_kg, to_status)] += 1
+        events.append(RetailLPGCylinderEvent(
+            cylinder=cylinder,
+            business=business,
+            event_type=event_type,
+            from_status=from_status or '',
+            to_status=to_status,
+            exchange=exchange,
+            customer=customer,
+            event_date=event_date,
+        ))
+
+    _apply_fleet_deltas(business.id, deltas)
+    RetailLPGCylinderEvent.objects.bulk_create(events)
+    # Cylinder rows are written with bulk_create()/update(), which send no signals
+    invalidate(RetailLPGCylinder, business)
+    return events
+
+
+@transaction.atomic
+def register_cylinders(business, cylinders, event_date=None):
+    """Bulk-create new cylinders and add them to the fleet summary."""
+    for cylinder in cylinders:
+        cylinder.business = business
+    created = RetailLPGCylinder.objects.bulk_create(cylinders)
+    record_cylinder_transitions(
+        business,
+        [(cylinder, None, cylinder.status, 'registered') for cylinder in created],
+        event_date or timezone.localdate(),
+    )
+    return created
+
+
+@transaction.atomic
+def change_cylinder_status(cylinder_id, to_status, event_type,
+                           event_date=None, location=None):
+    """
+    Move a single cylinder to a new status outside of an exchange.
+
+    Used for refills (empty → full), maintenance and manual adjustments.
+    """
+    cylinder = RetailLPGCylinder.objects.select_for_update().get(id=cylinder_id)
+    from_status = cylinder.status
+    if from_status == to_status:
+        return cylinder
+
+    updates = {'status': to_status, 'updated_at': timezone.now()}
+    if location is not None:
+        updates['current_location'] = location
+    RetailLPGCylinder.objects.filter(id=cylinder.id).update(**updates)
+
+    record_cylinder_transitions(
+        cylinder.business,
+        [(cylinder, from_status, to_status, event_type)],
+        event_date or timezone.localdate(),
+    )
+    cylinder.status = to_status
+    return cylinder
+
+
+def lpg_product_code(brand, capacity_kg):
+    """
+    Product code of the LPG refill stocked for a cylinder type.
+
+    Convention: LPG-<BRAND>-<CAPACITY>KG, e.g. LPG-TOTAL-13KG.
+    """
+    capacity = Decimal(capacity_kg).normalize()
+    return f"LPG-{brand.upper().replace(' ', '')}-{capacity:f}KG"
+
+
+# Cylinders 1, stock 2, costing 5, VAT 1, accounts 2, posting 13 (its
+# savepoint and a business's first chain head included), exchange and
+# audit 2, cylinders, fleet and events 4, savepoint in a caller's
+# transaction 2
+@instrumented(max_queries=32)
+@transaction.atomic
+def record_lpg_exchange(business, full_cylinder_id, price_per_kg, payment_method,
+                        recorded_by, empty_cylinder_id=None, customer=None,
+                        m_pesa_transaction_id='', exchange_date=None, notes=''):
+    """
+    Record a full ↔ empty cylinder exchange atomically.
+
+    Steps, all in one transaction:
+    1. Lock both cylinders (ordered by id to avoid deadlocks) and check the
+       full cylinder is still on the shelf. A second clerk trying to issue
+       the same cylinder blocks on the lock and then fails this check.
+    2. Reduce LPG refill stock with a conditional UPDATE and take the
+       refill's cost from the costing engine.
+    3. Post the sale journal entry (Dr cash/M-Pesa/bank, Cr LPG revenue
+       and VAT payable; Dr cost of goods sold, Cr inventory).
+    4. Insert the exchange row with its cost and VAT breakdown attached.
+    5. Flip both cylinder states with a single UPDATE.
+    6. Update the fleet summary and cylinder history.
+
+    ``empty_cylinder_id`` is None when the customer returns a cylinder that
+    is not part of this business's fleet.
+    """
+    exchange_date = exchange_date or timezone.localdate()
+    cylinder_ids = sorted(filter(None, [full_cylinder_id, empty_cylinder_id]))
+    if len(cylinder_ids) != len(set(cylinder_ids)):
+        raise ValidationError("Full and empty cylinder must be different.")
+
+    cylinders = {
+        cylinder.id: cylinder
+        for cylinder in RetailLPGCylinder.objects.select_for_update()
+        .filter(id__in=cylinder_ids, business=business)
+        .order_by('id')
+    }
+
+    full_cylinder = cylinders.get(full_cylinder_id)
+    if full_cylinder is None:
+        raise ValidationError(f"Cylinder #{full_cylinder_id} not found in {business.code}.")
+    if full_cylinder.status != 'full':
+        raise ValidationError(
+            f"Cylinder {full_cylinder.serial_number} is not available "
+            f"(status: {full_cylinder.status})."
+        )
+
+    empty_cylinder = None
+    if empty_cylinder_id is not None:
+        empty_cylinder = cylinders.get(empty_cylinder_id)
+        if empty_cylinder is None:
+            raise ValidationError(f"Cylinder #{empty_cylinder_id} not found in {business.code}.")
+        if empty_cylinder.status != 'customer':
+            raise ValidationError(
+                f"Cylinder {empty_cylinder.serial_number} is not out with a customer "
+                f"(status: {empty_cylinder.status})."
+            )
+
+    total_amount = (full_cylinder.capacity_kg * Decimal(price_per_kg)).quantize(
+        Decimal('0.01'), rounding=ROUND_HALF_UP
+    )
+    # Reduce LPG refill stock; the conditional UPDATE refuses to go below zero
+    product_code = lpg_product_code(full_cylinder.brand, full_cylinder.capacity_kg)
+    lpg_stock = RetailInventory.objects.filter(
+        business=business, product__product_code=product_code
+    ).values_list('id', 'product_id').first()
+    stock_updated = lpg_stock and RetailInventory.objects.filter(
+        id=lpg_stock[0], quantity_in_stock__gte=1
+    ).update(
+        quantity_in_stock=F('quantity_in_stock') - 1,
+        last_updated=timezone.now(),
+    )
+    if not stock_updated:
+        raise ValidationError(
+            f"No LPG stock left for {full_cylinder.brand} {full_cylinder.capacity_kg}kg."
+        )
+    invalidate(RetailInventory, business)
+    [cost_amount] = consume_stock(business, [('retail', lpg_stock[1], 1)])
+
+    description = (
+        f"LPG exchange {full_cylinder.brand} {full_cylinder.capacity_kg}kg "
+        f"({full_cylinder.serial_number})"
+    )
+    tax_rate = get_tax_rate(business)
+    net_amount, tax_amount = split_inclusive(total_amount, tax_rate)
+    accounts = get_accounts(
+        business, payment_method, 'lpg_revenue', 'vat_payable', 'cogs', 'inventory'
+    )
+    lines = sale_lines(
+        accounts, payment_method, 'lpg_revenue', total_amount, description, tax_amount
+    )
+    if cost_amount:
+        lines += cogs_lines(accounts, cost_amount, description)
+    journal_entry = post_journal_entry(
+        business,
+        'SALE',
+        exchange_date,
+        description,
+        lines,
+        recorded_by,
+        reference_number=m_pesa_transaction_id,
+    )
+
+    exchange = RetailLPGExchange.objects.create(
+        business=business,
+        customer=customer,
+        full_cylinder=full_cylinder,
+        empty_cylinder=empty_cylinder,
+        capacity_kg=full_cylinder.capacity_kg,
+        price_per_kg=price_per_kg,
+        total_amount=total_amount,
+        cost_amount=cost_amount,
+        tax_rate=tax_rate,
+        net_amount=net_amount,
+        tax_amount=tax_amount,
+        payment_method=payment_method,
+        m_pesa_transaction_id=m_pesa_transaction_id,
+        exchange_date=exchange_date,
+        notes=notes,
+        recorded_by=recorded_by,
+        journal_entry=journal_entry,
+    )
+
+    customer_location = customer.name if customer else 'Walk-in customer'
+    RetailLPGCylinder.objects.filter(id__in=cylinder_ids).update(
+        status=Case(
+            When(id=full_cylinder.id, then=Value('customer')),
+            default=Value('empty'),
+            output_field=CharField(),
+        ),
+        current_location=Case(
+            When(id=full_cylinder.id, then=Value(customer_location[:200])),
+            default=Value(SHOP_LOCATION),
+            output_field=CharField(),
+        ),
+        last_exchange_date=exchange_date,
+        updated_at=timezone.now(),
+    )
+
+    transitions = [(full_cylinder, 'full', 'customer', 'issued')]
+    if empty_cylinder is not None:
+        transitions.append((empty_cylinder, 'customer', 'empty', 'returned'))
+    record_cylinder_transitions(
+        business, transitions, exchange_date, exchange=exchange, customer=customer
+    )
+    return exchange
+
+
+def fleet_counts(business, brand=None, capacity_kg=None, status=None):
+    """
+    Return fleet summary rows for a business, optionally filtered.
+
+    Example: fleet_counts(retail, brand='Total', capacity_kg=13, status='full')
+    """
+    rows = RetailLPGFleetSummary.objects.filter(business=business)
+    if brand is not None:
+        rows = rows.filter(brand=brand)
+    if capacity_kg is not None:
+        rows = rows.filter(capacity_kg=capacity_kg)
+    if status is not None:
+        rows = rows.filter(status=status)
+    return list(rows.values('brand', 'capacity_kg', 'status', 'cylinder_count'))
+
+
+def fleet_dashboard(business):
+    """Return the fleet as {brand: {capacity_kg: {status: count}}} for the dashboard."""
+    dashboard = defaultdict(lambda: defaultdict(dict))
+    for row in fleet_counts(business):
+        if row['cylinder_count']:
+            dashboard[row['brand']][str(row['capacity_kg'])][row['status']] = row['cylinder_count']
+    return {brand: dict(capacities) for brand, capacities in dashboard.items()}
+
+
+CYLINDER_HISTORY = KeysetPaginator(RetailLPGCylinderEvent, prefixes=[('cylinder',)])
+
+
+def cylinder_history(cylinder_id, cursor=None, limit=50):
+    """
+    Return a page of a cylinder's events, newest first, and the cursor of
+    the next page (None on the last).
+
+    Every page is an index range scan on (cylinder_id, id DESC).
+    """
+    events = RetailLPGCylinderEvent.objects.filter(cylinder_id=cylinder_id)
+    return CYLINDER_HISTORY.page(events.select_related('customer', 'exchange'), cursor, limit)
+
+
+@transaction.atomic
+def rebuild_fleet_summary(business):
+    """
+    Recompute a business's fleet summary from the cylinder table.
+
+    Used for the initial backfill and as a repair tool; normal operation
+    keeps the summary current through record_cylinder_transitions().
+    """
+    # Lock the fleet so no exchange changes a status mid-rebuild
+    list(
+        RetailLPGCylinder.objects.select_for_update()
+        .filter(business=business).values_list('id', flat=True)
+    )
+    rows = (
+        RetailLPGCylinder.objects.filter(business=business)
+        .values('brand', 'capacity_kg', 'status')
+        .annotate(cylinder_count=Count('id'))
+    )
+    RetailLPGFleetSummary.objects.filter(business=business).delete()
+    RetailLPGFleetSummary.objects.bulk_create([
+        RetailLPGFleetSummary(business=business, **row) for row in rows
+    ])
@@ -0,0 +1,283 @@
+"""
+Keyset Pagination - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Cursor pagination for every list API. Copy into core/pagination.py.
+
+OFFSET pagination reads and throws away every row before the page, so
+page 1000 of the ledger costs a thousand pages. A keyset page instead
+starts where the previous one ended:
+
+    WHERE transaction_date <= d AND (transaction_date < d OR id < i)
+    ORDER BY transaction_date DESC, id DESC LIMIT n
+
+which an index on (business_id, transaction_date DESC, id DESC) answers
+with one range scan of n rows, however deep the page.
+
+KeysetPaginator derives the keyset from the model's Meta.ordering,
+adding the primary key when the ordering is not unique, and hands out
+opaque cursors holding the last row's keyset values. When it is built
+it checks that, for each equality filter prefix the list uses (e.g.
+business), an index holds the prefix followed by the keyset columns in
+the same directions (or all reversed), and raises ImproperlyConfigured
+otherwise - so a list cannot silently fall back to a sort.
+
+page_response() is the JSON response every list view returns;
+business_list_view() serves the ledger and sales lists.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+
+from django_models import (
+    LaundryJob,
+    Ledger,
+    RetailLPGExchange,
+    RetailSale,
+    WaterSale,
+)
+from instrumentation import query_budget
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _parse_ordering(model, names):
+    """[(field, descending)] for ordering names like '-sale_date'."""
+    return [
+        (model._meta.get_field(name.lstrip('-')), name.startswith('-'))
+        for name in names
+    ]
+
+
+def _model_indexes(model):
+    """Column lists, as [(field name, descending)], of the model's full indexes."""
+    opts = model._meta
+    indexes = [[(opts.pk.name, False)]]
+    for field in opts.concrete_fields:
+        if field.db_index or field.unique:
+            indexes.append([(field.name, False)])
+    for index in opts.indexes:
+        if index.condition is None and index.fields:
+            indexes.append([(field.name, descending) for field, descending in _parse_ordering(model, index.fields)])
+    for constraint in opts.constraints:
+        if getattr(constraint, 'fields', None) and getattr(constraint, 'condition', None) is None:
+            indexes.append([(name, False) for name in constraint.fields])
+    for fields in opts.unique_together:
+        indexes.append([(name, False) for name in fields])
+    return indexes
+
+
+def _serves(index, prefix, keyset):
+    """True if ``index`` is ``prefix`` (any order) then ``keyset``, directions matching or all reversed."""
+    head, tail = index[:len(prefix)], index[len(prefix):len(prefix) + len(keyset)]
+    if {name for name, _ in head} != set(prefix) or len(tail) != len(keyset):
+        return False
+    if [name for name, _ in tail] != [field.name for field, _ in keyset]:
+        return False
+    flips = {descending != index_descending for (_, index_descending), (_, descending) in zip(tail, keyset)}
+    return len(flips) == 1
+
+
+class KeysetPaginator:
+    """
+    Keyset pages of one model in its Meta.ordering (or ``ordering``).
+
+    ``prefixes`` lists the equality filters the list is used with, each a
+    tuple of field names; ordering fields in a prefix are constant within
+    a page and dropped from the keyset.
+    """
+
+    def __init__(self, model, prefixes=((),), ordering=None):
+        self.model = model
+        prefixes = [tuple(model._meta.get_field(name).name for name in prefix) for prefix in prefixes]
+        constant = set.intersection(*[set(prefix) for prefix in prefixes])
+        keyset = [
+            (field, descending)
+            for field, descending in _parse_ordering(model, ordering or model._meta.ordering)
+            if field.name not in constant
+        ]
+        if not keyset or not (keyset[-1][0].primary_key or keyset[-1][0].unique):
+            keyset.append((model._meta.pk, keyset[-1][1] if keyset else False))
+        for field, _ in keyset:
+            if field.null:
+                raise ImproperlyConfigured(
+                    f"{model.__name__}.{field.name} is nullable and cannot be a keyset column."
+                )
+        indexes = _model_indexes(model)
+        for prefix in prefixes:
+            if not any(_serves(index, prefix, keyset) for index in indexes):
+                columns = [f"{'-' if descending else ''}{field.name}" for field, descending in keyset]
+                raise ImproperlyConfigured(
+                    f"No index on {model._meta.db_table} serves {list(prefix) + columns}."
+                )
+        self.keyset = keyset
+        self.order_by = [f"{'-' if descending else ''}{field.name}" for field, descending in keyset]
+
+    def encode_cursor(self, row):
+        """Cursor for the position after ``row`` (a model instance or a values() dict)."""
+        if isinstance(row, dict):
+            values = [row[field.name] for field, _ in self.keyset]
+        else:
+            values = [getattr(row, field.attname) for field, _ in self.keyset]
+        return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Keyset values from a cursor; ValidationError if it is not one of ours."""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(self.keyset):
+                raise ValueError
+            return [field.to_python(value) for (field, _), value in zip(self.keyset, values)]
+        except (ValueError, TypeError, UnicodeError, ValidationError):
+            raise ValidationError("Invalid page cursor.")
+
+    def after(self, queryset, cursor):
+        """Rows of ``queryset`` after the cursor's position, in keyset order."""
+        values = self.decode_cursor(cursor)
+        position = Q()
+        for index, (field, descending) in enumerate(self.keyset):
+            step = Q(**{f'{field.attname}__{"lt" if descending else "gt"}': values[index]})
+            for (earlier, _), value in zip(self.keyset[:index], values):
+                step &= Q(**{earlier.attname: value})
+            position |= step
+        # The bound on the first column is what turns the OR into an index range
+        first, descending = self.keyset[0]
+        bound = {f'{first.attname}__{"lte" if descending else "gte"}': values[0]}
+        return queryset.filter(**bound).filter(position)
+
+    def page(self, queryset, cursor=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+        """
+        One page of ``queryset`` (already filtered by a prefix) after ``cursor``.
+
+        Returns (rows, next cursor or None). Rows are model instances, or
+        values() dicts of ``fields`` plus the keyset columns.
+        """
+        queryset = queryset.order_by(*self.order_by)
+        if cursor:
+            queryset = self.after(queryset, cursor)
+        if fields is not None:
+            queryset = queryset.values(*dict.fromkeys([*fields, *(field.name for field, _ in self.keyset)]))
+        rows = list(queryset[:limit + 1])
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, self.encode_cursor(rows[-1])
+
+    def iterate(self, queryset, page_size=MAX_PAGE_SIZE, fields=None):
+        """Yield every row of ``queryset``, one keyset page per query."""
+        cursor = None
+        while True:
+            rows, cursor = self.page(queryset, cursor, page_size, fields)
+            yield from rows
+            if cursor is None:
+                return
+
+
+# -----------------------------------------------------------------------------
+# List responses
+# -----------------------------------------------------------------------------
+
+def page_limit(request):
+    """``limit`` from the query string, between 1 and MAX_PAGE_SIZE."""
+    return max(1, min(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+
+
+def _stream_page(rows, next_cursor, serialize):
+    yield '{"results": ['
+    for index, row in enumerate(rows):
+        yield (',' if index else '') + json.dumps(serialize(row), cls=DjangoJSONEncoder)
+    yield '], "next": ' + json.dumps(next_cursor) + '}'
+
+
+def page_response(request, paginator, queryset, fields=None, serialize=dict):
+    """
+    Stream a page as {"results": [...], "next": cursor} for a list view.
+
+    Reads ``cursor`` and ``limit`` from the query string; a bad cursor or
+    limit is a 400.
+    """
+    try:
+        rows, next_cursor = paginator.page(queryset, request.GET.get('cursor'), page_limit(request), fields)
+    except (ValueError, ValidationError) as error:
+        return JsonResponse({'error': getattr(error, 'message', str(error))}, status=400)
+    return StreamingHttpResponse(_stream_page(rows, next_cursor, serialize), content_type='application/json')
+
+
+# dataset -> (paginator, date field, values fields)
+LIST_DATASETS = {
+    'ledger': (
+        KeysetPaginator(Ledger, prefixes=[('business',)]),
+        'transaction_date',
+        ['id', 'transaction_date', 'journal_entry_id', 'account_id', 'description',
+         'is_debit', 'amount', 'balance_after', 'reference_number'],
+    ),
+    'water_sales': (
+        KeysetPaginator(WaterSale, prefixes=[('business',)]),
+        'sale_date',
+        ['id', 'sale_date', 'sale_time', 'customer_id', 'product_size_id', 'quantity_sold',
+         'unit_price', 'total_amount', 'payment_method'],
+    ),
+    'retail_sales': (
+        KeysetPaginator(RetailSale, prefixes=[('business',)]),
+        'sale_date',
+        ['id', 'sale_number', 'sale_date', 'sale_time', 'customer_id', 'total_amount',
+         'payment_method'],
+    ),
+    'lpg_exchanges': (
+        KeysetPaginator(RetailLPGExchange, prefixes=[('business',)]),
+        'exchange_date',
+        ['id', 'exchange_date', 'exchange_time', 'customer_id', 'full_cylinder_id',
+         'empty_cylinder_id', 'capacity_kg', 'total_amount', 'payment_method'],
+    ),
+    'laundry_jobs': (
+        KeysetPaginator(LaundryJob, prefixes=[('business',)]),
+        'received_date',
+        ['id', 'job_number', 'received_date', 'customer_id', 'status', 'total_amount',
+         'amount_paid', 'balance_due'],
+    ),
+}
+
+
+@query_budget(max_queries=4)  # session, user, business access, page
+def business_list_view(request, dataset):
+    """
+    GET one business's ledger or sales, newest first, a keyset page at a time.
+
+    Query string: business (required), optional date_from/date_to,
+    cursor and limit.
+    """
+    if not request.user.is_authenticated:
+        return HttpResponse(status=401)
+    if dataset not in LIST_DATASETS:
+        return JsonResponse({'error': f"Unknown list: {dataset}"}, status=404)
+    paginator, date_field, fields = LIST_DATASETS[dataset]
+    try:
+        business_id = int(request.GET['business'])
+        date_from, date_to = (
+            parse_date(request.GET[name]) if request.GET.get(name) else False
+            for name in ('date_from', 'date_to')
+        )
+        if date_from is None or date_to is None:
+            raise ValueError
+    except (KeyError, ValueError):
+        return JsonResponse({'error': "business and valid dates are required."}, status=400)
+    if not request.user.has_business_access(business_id):
+        return HttpResponseForbidden()
+
+    rows = paginator.model.objects.filter(business_id=business_id)
+    if date_from:
+        rows = rows.filter(**{f'{date_field}__gte': date_from})
+    if date_to:
+        rows = rows.filter(**{f'{date_field}__lte': date_to})
+    return page_response(request, paginator, rows, fields)
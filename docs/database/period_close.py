@@ -0,0 +1,384 @@
+"""
+Period Close - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Month-end close per business. Copy into financial/period_close.py.
+
+Without a close, a back-dated entry can change every report since the
+start of the books. close_period() freezes a month:
+1. Waits out in-flight postings into the month (the posting date locks)
+   and locks its AccountingPeriod row.
+2. Rebuilds the month's sales rollups one last time.
+3. Posts the closing entry (transaction type CLS), dated the last day of
+   the month: every revenue and expense balance moved to retained
+   earnings.
+4. Writes one AccountBalance row per account, dated the last day of the
+   month, from one aggregate over the month's ledger rows plus the
+   previous month's snapshot (the first close scans the history once).
+5. Marks the period closed. post_journal_entries() then rejects, or
+   redirects, entries dated in it and rebuild_rollups() skips it.
+
+Reports over closed months read the snapshots: profit_and_loss() takes
+whole closed months from AccountBalance and only the open days of the
+range from Ledger. Closing entries are left out of both sides, so the
+P&L shows trading, not the sweep to retained earnings.
+
+reopen_period() reopens one month for corrections: it reverses the
+closing entry and marks the month open, keeping the snapshots. Closing
+it again recomputes that month only; later closed months have their
+opening and closing balances shifted by the difference in one UPDATE,
+without reading their ledger rows again.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from decimal import Decimal
+
+from analytics import month_start, rebuild_rollups
+from db_routing import reporting_alias
+from django_models import (
+    Account,
+    AccountBalance,
+    AccountingPeriod,
+    TransactionType,
+)
+from ledger_posting import lock_posting_dates, post_journal_entries
+from reversals import reverse_journal_entries
+
+
+CLOSING_TYPE_CODE = 'CLS'
+RETAINED_EARNINGS = '3300'
+ZERO = Decimal('0.00')
+
+# Ledger amount signed by the account's normal balance (see Account.balance_delta)
+SIGNED_AMOUNT = """
+    CASE WHEN ((at.normal_balance = 'debit') <> a.is_contra_account) = l.is_debit
+         THEN l.amount ELSE -l.amount END
+"""
+
+MONTH_BALANCES_SQL = f"""
+    SELECT l.account_id,
+           COALESCE(SUM({SIGNED_AMOUNT}) FILTER (WHERE l.transaction_date < %(start)s), 0),
+           COALESCE(SUM(l.amount) FILTER (
+               WHERE l.transaction_date >= %(start)s AND l.is_debit AND tt.code <> %(closing)s
+           ), 0),
+           COALESCE(SUM(l.amount) FILTER (
+               WHERE l.transaction_date >= %(start)s AND NOT l.is_debit AND tt.code <> %(closing)s
+           ), 0),
+           COALESCE(SUM({SIGNED_AMOUNT}) FILTER (WHERE l.transaction_date >= %(start)s), 0)
+    FROM ledger l
+    JOIN account a ON a.id = l.account_id
+    JOIN account_type at ON at.id = a.account_type_id
+    JOIN transaction_type tt ON tt.id = l.transaction_type_id
+    WHERE l.business_id = %(business)s
+      AND l.transaction_date BETWEEN %(scan_from)s AND %(end)s
+    GROUP BY l.account_id
+"""
+
+
+def month_end(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def _days(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+@transaction.atomic
+def close_period(business, month, closed_by):
+    """
+    Close the month containing ``month`` for a business.
+
+    Closes a reopened month again the same way. Months close in order:
+    once a business has closed a month, the month before the one being
+    closed must be closed too, and a month closing for the first time
+    must have no closed month after it. Returns the AccountingPeriod.
+    """
+    start, end = month_start(month), month_end(month)
+    if end >= timezone.localdate():
+        raise ValidationError(f"{start:%Y-%m} has not ended yet.")
+
+    lock_posting_dates(_days(start, end))
+    AccountingPeriod.objects.get_or_create(
+        business=business, period_start=start, defaults={'period_end': end}
+    )
+    period = AccountingPeriod.objects.select_for_update().get(business=business, period_start=start)
+    if period.status == 'closed':
+        raise ValidationError(f"{start:%Y-%m} is already closed for {business.code}.")
+
+    previous_start = month_start(start - timedelta(days=1))
+    closed_before = set(
+        AccountingPeriod.objects.filter(
+            business=business, period_start__lt=start, status='closed'
+        ).values_list('period_start', flat=True)
+    )
+    if closed_before and previous_start not in closed_before:
+        raise ValidationError(f"Close {previous_start:%Y-%m} before {start:%Y-%m} for {business.code}.")
+    # A later close has already swept this month's revenue and expenses;
+    # only a reopened month (its snapshots kept) may close behind it
+    first_close = period.reopened_at is None and not AccountBalance.objects.filter(
+        business=business, balance_date=end
+    ).exists()
+    later_closed = AccountingPeriod.objects.filter(
+        business=business, period_start__gt=start, status='closed'
+    ).order_by('period_start').values_list('period_start', flat=True).first()
+    if first_close and later_closed is not None:
+        raise ValidationError(
+            f"{later_closed:%Y-%m} is already closed for {business.code}; "
+            f"reopen it before closing {start:%Y-%m}."
+        )
+
+    rebuild_rollups(business.id, _days(start, end))
+    balances = _month_balances(business, start, end, carry_forward=bool(closed_before))
+    closing_entry = _post_closing_entry(business, end, balances, closed_by)
+    _write_snapshots(business, end, balances)
+
+    period.status = 'closed'
+    period.closing_entry = closing_entry
+    period.closed_at = timezone.now()
+    period.closed_by = closed_by
+    period.save(update_fields=['status', 'closing_entry', 'closed_at', 'closed_by', 'updated_at'])
+    return period
+
+
+def _month_balances(business, start, end, carry_forward):
+    """
+    {account_id: [opening, debits, credits, closing]} for one month.
+
+    With ``carry_forward`` the opening balances come from the previous
+    month's snapshot and only the month's ledger rows are read.
+    """
+    balances = {}
+    if carry_forward:
+        for account_id, closing in AccountBalance.objects.filter(
+            business=business, balance_date=start - timedelta(days=1)
+        ).values_list('account_id', 'closing_balance'):
+            balances[account_id] = [closing, ZERO, ZERO, closing]
+
+    with connection.cursor() as cursor:
+        cursor.execute(MONTH_BALANCES_SQL, {
+            'business': business.id,
+            'start': start,
+            'end': end,
+            'scan_from': start if carry_forward else date.min,
+            'closing': CLOSING_TYPE_CODE,
+        })
+        for account_id, before, debits, credits, movement in cursor.fetchall():
+            row = balances.setdefault(account_id, [ZERO, ZERO, ZERO, ZERO])
+            row[0] += before
+            row[1], row[2] = debits, credits
+            row[3] = row[0] + movement
+    return balances
+
+
+def _post_closing_entry(business, end, balances, closed_by):
+    """Move revenue and expense balances to retained earnings; updates ``balances``."""
+    accounts = Account.objects.select_related('account_type').in_bulk(list(balances))
+    retained = Account.objects.select_related('account_type').get(account_number=RETAINED_EARNINGS)
+
+    lines = []
+    for account_id in sorted(balances):
+        account = accounts[account_id]
+        balance = balances[account_id][3]
+        if account.account_type.type not in ('revenue', 'expense') or not balance:
+            continue
+        # Post on the side that reduces the balance to zero
+        reducing_side_is_debit = account.balance_delta(1, True) < 0
+        is_debit = reducing_side_is_debit if balance > 0 else not reducing_side_is_debit
+        lines.append((account, is_debit, abs(balance), f"Close {end:%Y-%m}"))
+    if not lines:
+        return None
+
+    net = sum((amount if is_debit else -amount for _, is_debit, amount, _ in lines), ZERO)
+    if net:
+        lines.append((retained, net < 0, abs(net), f"Close {end:%Y-%m}: retained earnings"))
+
+    [entry] = post_journal_entries([{
+        'business': business,
+        'transaction_type': TransactionType.objects.get(code=CLOSING_TYPE_CODE),
+        'transaction_date': end,
+        'description': f"Period close {end:%Y-%m}",
+        'created_by': closed_by,
+        'lines': lines,
+    }])
+    for account, is_debit, amount, _ in lines:
+        row = balances.setdefault(account.id, [ZERO, ZERO, ZERO, ZERO])
+        row[3] += account.balance_delta(amount, is_debit)
+    return entry
+
+
+def _write_snapshots(business, end, balances):
+    """Replace the month-end snapshot and carry any change into later months."""
+    snapshots = AccountBalance.objects.filter(business=business, balance_date=end)
+    previous = dict(snapshots.values_list('account_id', 'closing_balance'))
+    snapshots.delete()
+    AccountBalance.objects.bulk_create([
+        AccountBalance(
+            account_id=account_id,
+            business=business,
+            balance_date=end,
+            opening_balance=opening,
+            closing_balance=closing,
+            total_debits=debits,
+            total_credits=credits,
+        )
+        for account_id, (opening, debits, credits, closing) in sorted(balances.items())
+    ])
+    if not previous:
+        return
+
+    # Re-close: later snapshots were built on the old closing balances
+    deltas = {
+        account_id: (balances[account_id][3] if account_id in balances else ZERO) - previous.get(account_id, ZERO)
+        for account_id in set(balances) | set(previous)
+    }
+    deltas = {account_id: delta for account_id, delta in deltas.items() if delta}
+    later_dates = list(
+        AccountBalance.objects.filter(business=business, balance_date__gt=end)
+        .values_list('balance_date', flat=True).distinct()
+    )
+    if not deltas or not later_dates:
+        return
+
+    AccountBalance.objects.bulk_create(
+        [
+            AccountBalance(
+                account_id=account_id, business=business, balance_date=balance_date,
+                opening_balance=ZERO, closing_balance=ZERO, total_debits=ZERO, total_credits=ZERO,
+            )
+            for balance_date in later_dates
+            for account_id in sorted(deltas)
+        ],
+        ignore_conflicts=True,
+    )
+    shift = Case(
+        *[When(account_id=account_id, then=Value(delta)) for account_id, delta in deltas.items()],
+        default=Value(ZERO),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+    AccountBalance.objects.filter(
+        business=business, balance_date__gt=end, account_id__in=list(deltas)
+    ).update(
+        opening_balance=F('opening_balance') + shift,
+        closing_balance=F('closing_balance') + shift,
+    )
+
+
+@transaction.atomic
+def reopen_period(business, month, reopened_by, reason):
+    """
+    Reopen a closed month so corrections can be posted into it.
+
+    Reverses the closing entry; the snapshots stay until the month is
+    closed again with close_period().
+    """
+    if not reason:
+        raise ValidationError("A reason is required to reopen a period.")
+    start = month_start(month)
+    period = AccountingPeriod.objects.select_for_update().filter(
+        business=business, period_start=start, status='closed'
+    ).first()
+    if period is None:
+        raise ValidationError(f"{start:%Y-%m} is not closed for {business.code}.")
+
+    closing_entry_id = period.closing_entry_id
+    period.status = 'open'
+    period.closing_entry = None
+    period.reopened_at = timezone.now()
+    period.reopened_by = reopened_by
+    period.reopen_reason = reason
+    period.save(update_fields=[
+        'status', 'closing_entry', 'reopened_at', 'reopened_by', 'reopen_reason', 'updated_at',
+    ])
+    if closing_entry_id is not None:
+        reverse_journal_entries(
+            [closing_entry_id], reopened_by, f"Reopen {start:%Y-%m}: {reason}",
+            reversal_date=period.period_end,
+        )
+    return period
+
+
+# -----------------------------------------------------------------------------
+# Reports
+# -----------------------------------------------------------------------------
+
+def closing_balances(business, month):
+    """Frozen closing balances of a closed month: {account_number: balance}."""
+    return dict(
+        AccountBalance.objects.using(reporting_alias()).filter(
+            business=business, balance_date=month_end(month)
+        ).values_list('account__account_number', 'closing_balance')
+    )
+
+
+def profit_and_loss(business, date_from, date_to):
+    """
+    Revenue and expense totals per account for a date range.
+
+    Whole closed months inside the range come from AccountBalance; the
+    ledger is read only for the rest, in one aggregate query. A range of
+    closed months does not touch Ledger at all.
+    """
+    alias = reporting_alias()
+    closed = sorted(
+        AccountingPeriod.objects.using(alias).filter(
+            business=business, status='closed',
+            period_start__gte=date_from, period_end__lte=date_to,
+        ).values_list('period_start', 'period_end')
+    )
+
+    totals = defaultdict(lambda: ZERO)
+    if closed:
+        for row in AccountBalance.objects.using(alias).filter(
+            business=business,
+            balance_date__in=[end for _, end in closed],
+            account__account_type__type__in=('revenue', 'expense'),
+        ).values(
+            'account__account_number', 'account__name', 'account__account_type__type'
+        ).annotate(net=Sum(F('total_debits') - F('total_credits'))):
+            key = (row['account__account_number'], row['account__name'], row['account__account_type__type'])
+            totals[key] += row['net']
+
+    open_ranges = []
+    cursor_date = date_from
+    for start, end in closed:
+        if cursor_date < start:
+            open_ranges.append((cursor_date, start - timedelta(days=1)))
+        cursor_date = end + timedelta(days=1)
+    if cursor_date <= date_to:
+        open_ranges.append((cursor_date, date_to))
+
+    if open_ranges:
+        date_filter = ' OR '.join(['l.transaction_date BETWEEN %s AND %s'] * len(open_ranges))
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT a.account_number, a.name, at.type,
+                       SUM(CASE WHEN l.is_debit THEN l.amount ELSE -l.amount END)
+                FROM ledger l
+                JOIN account a ON a.id = l.account_id
+                JOIN account_type at ON at.id = a.account_type_id
+                JOIN transaction_type tt ON tt.id = l.transaction_type_id
+                WHERE l.business_id = %s
+                  AND ({date_filter})
+                  AND at.type IN ('revenue', 'expense')
+                  AND tt.code <> %s
+                GROUP BY a.account_number, a.name, at.type
+                """,
+                [business.id, *[day for bounds in open_ranges for day in bounds], CLOSING_TYPE_CODE],
+            )
+            for number, name, account_type, net in cursor.fetchall():
+                totals[(number, name, account_type)] += net
+
+    rows = [(*key, net) for key, net in sorted(totals.items())]
+    revenue = -sum((row[3] for row in rows if row[2] == 'revenue'), ZERO)
+    expenses = sum((row[3] for row in rows if row[2] == 'expense'), ZERO)
+    return {'accounts': rows, 'revenue': revenue, 'expenses': expenses, 'net_profit': revenue - expenses}
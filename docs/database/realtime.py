@@ -0,0 +1,439 @@
+"""
+Realtime Event Bus - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+ (ASGI)
+Broker: Redis 6.2+ (the django-rq Redis)
+
+Server-sent events pushing compact deltas to phones instead of having
+them poll the dashboard and balances. Copy into core/realtime.py, import
+it from an AppConfig.ready() (it connects post_save handlers) and route:
+
+    path('api/v1/events/', realtime.event_stream)
+
+    REALTIME_REDIS_URL = 'redis://localhost:6379/1'
+
+What is pushed
+--------------
+One Redis stream per business (events:<business_id>, capped at
+STREAM_MAXLEN entries). Entries are published after commit:
+- ledger posting: {"bal": {"<account_id>": "<balance_after>"}}, one entry
+  per business per posting batch with the latest balance per account
+- new sale/exchange/job: {"sales": [["lpg", <id>, "<total>"]]}
+- laundry job saved: {"jobs": {"<job_id>": "<status>"}}
+
+Fan-out and coalescing
+----------------------
+Each process runs one reader per business (BusinessHub) however many
+clients are connected, and hands entries to the subscribers' in-memory
+queues. A subscriber merges everything arriving within COALESCE_SECONDS
+into one SSE message: later balances and statuses overwrite earlier ones,
+sales are appended. A subscriber that falls QUEUE_SIZE entries behind is
+caught up from Redis instead of buffering without bound.
+
+Resume
+------
+The SSE id is the client's position in each business stream
+("<business_id>=<entry id>,..."). Browsers send it back as Last-Event-ID
+on reconnect and the stream replays what was missed (up to the stream
+cap) before going live.
+
+Load test: simulate_clients(500) (run with asyncio.run).
+
+LAST UPDATED: 2026-10-19
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import aclosing
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.http import HttpResponse, StreamingHttpResponse
+
+from django_models import Business, LaundryJob, RetailLPGExchange, RetailSale, WaterSale
+
+
+logger = logging.getLogger(__name__)
+
+STREAM_MAXLEN = 10000
+COALESCE_SECONDS = 0.25
+KEEPALIVE_SECONDS = 20
+READ_BLOCK_MS = 5000
+READ_COUNT = 500
+QUEUE_SIZE = 1000
+RETRY_MS = 3000
+
+# Models whose new rows are pushed as sales: model -> stream name
+SALE_MODELS = {
+    WaterSale: 'water',
+    RetailSale: 'retail',
+    RetailLPGExchange: 'lpg',
+    LaundryJob: 'laundry',
+}
+
+
+def _stream_key(business_id):
+    return f'events:{business_id}'
+
+
+def _redis_url():
+    return getattr(settings, 'REALTIME_REDIS_URL', 'redis://localhost:6379/1')
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), cls=DjangoJSONEncoder)
+
+
+# -----------------------------------------------------------------------------
+# Publishing (sync, request/worker side)
+# -----------------------------------------------------------------------------
+
+_client = None
+
+
+def _sync_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(_redis_url())
+    return _client
+
+
+def _xadd(business_id, delta):
+    try:
+        _sync_client().xadd(
+            _stream_key(business_id),
+            {'d': _dumps(delta)},
+            maxlen=STREAM_MAXLEN,
+            approximate=True,
+        )
+    except redis.RedisError:
+        # A missed push only delays the phone's next refresh; never fail the sale
+        logger.exception("Could not publish realtime event for business %s", business_id)
+
+
+def publish(business_id, delta):
+    """Push a delta to the business's clients once the transaction commits."""
+    transaction.on_commit(lambda: _xadd(business_id, delta))
+
+
+def publish_ledger(ledger_rows):
+    """Push the latest balance_after per account, one entry per business."""
+    balances = defaultdict(dict)
+    for row in ledger_rows:
+        balances[row.business_id][str(row.account_id)] = row.balance_after
+    for business_id, accounts in balances.items():
+        publish(business_id, {'bal': accounts})
+
+
+def _publish_saved(sender, instance, created, **kwargs):
+    delta = {}
+    if created:
+        delta['sales'] = [[SALE_MODELS[sender], instance.id, instance.total_amount]]
+    if sender is LaundryJob:
+        delta['jobs'] = {str(instance.id): instance.status}
+    if delta:
+        publish(instance.business_id, delta)
+
+
+for _model in SALE_MODELS:
+    post_save.connect(_publish_saved, sender=_model, dispatch_uid=f'realtime_{_model._meta.db_table}')
+
+
+# -----------------------------------------------------------------------------
+# Fan-out (async, ASGI side)
+# -----------------------------------------------------------------------------
+
+def _entry_key(entry_id):
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    milliseconds, sequence = entry_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def merge_delta(into, delta):
+    """Coalesce one delta into another: latest balances/statuses win, sales append."""
+    for key in ('bal', 'jobs'):
+        if key in delta:
+            into.setdefault(key, {}).update(delta[key])
+    if 'sales' in delta:
+        into.setdefault('sales', []).extend(delta['sales'])
+    return into
+
+
+class Subscriber:
+    """One connected client: a bounded queue of (business_id, entry_id, fields)."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class BusinessHub:
+    """The single Redis reader for one business in this process."""
+
+    def __init__(self, client, business_id):
+        self.client = client
+        self.business_id = business_id
+        self.subscribers = set()
+        self.task = None
+
+    def add(self, subscriber):
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def discard(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _run(self):
+        key = _stream_key(self.business_id)
+        latest = await self.client.xrevrange(key, count=1)
+        last_id = latest[0][0] if latest else '0-0'
+        while self.subscribers:
+            try:
+                result = await self.client.xread({key: last_id}, count=READ_COUNT, block=READ_BLOCK_MS)
+            except redis.RedisError:
+                logger.exception("Realtime reader for business %s failed, retrying", self.business_id)
+                await asyncio.sleep(1)
+                continue
+            for _, entries in result or []:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    for subscriber in list(self.subscribers):
+                        subscriber.offer((self.business_id, entry_id, fields))
+
+
+class EventHub:
+    """Per-process registry of business hubs sharing one Redis client."""
+
+    def __init__(self, url=None):
+        self.client = aioredis.Redis.from_url(url or _redis_url())
+        self.hubs = {}
+
+    def _hub(self, business_id):
+        if business_id not in self.hubs:
+            self.hubs[business_id] = BusinessHub(self.client, business_id)
+        return self.hubs[business_id]
+
+    async def _backlog(self, positions):
+        """Entries after each business's resume position, oldest first."""
+        backlog = []
+        for business_id, position in positions.items():
+            entries = await self.client.xrange(_stream_key(business_id), min=f'({position}', count=STREAM_MAXLEN)
+            backlog.extend((business_id, entry_id, fields) for entry_id, fields in entries)
+        return backlog
+
+    async def messages(self, business_ids, last_event_id=None):
+        """
+        Yield (event id, {business_id: delta}) messages for a client.
+
+        Registers with the live hubs before replaying the backlog, so no
+        entry falls between the two; duplicates are dropped by position.
+        """
+        positions = parse_event_id(last_event_id, business_ids)
+        subscriber = Subscriber()
+        for business_id in business_ids:
+            self._hub(business_id).add(subscriber)
+        try:
+            pending = await self._backlog(positions)
+            while True:
+                if subscriber.overflowed:
+                    subscriber.overflowed = False
+                    subscriber.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+                    pending.extend(await self._backlog(positions))
+                if not pending:
+                    pending.append(await subscriber.queue.get())
+                    # Coalesce whatever else arrives within the window
+                    deadline = asyncio.get_running_loop().time() + COALESCE_SECONDS
+                    while True:
+                        remaining = deadline - asyncio.get_running_loop().time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            pending.append(await asyncio.wait_for(subscriber.queue.get(), remaining))
+                        except asyncio.TimeoutError:
+                            break
+
+                deltas = {}
+                for business_id, entry_id, fields in pending:
+                    entry_key = _entry_key(entry_id)
+                    if business_id in positions and entry_key <= _entry_key(positions[business_id]):
+                        continue
+                    positions[business_id] = f'{entry_key[0]}-{entry_key[1]}'
+                    merge_delta(deltas.setdefault(str(business_id), {}), json.loads(fields[b'd']))
+                pending = []
+                if deltas:
+                    yield format_event_id(positions), deltas
+        finally:
+            for business_id in business_ids:
+                self._hub(business_id).discard(subscriber)
+
+
+def parse_event_id(last_event_id, business_ids):
+    """'<business_id>=<entry id>,...' -> {business_id: entry id} for the given businesses."""
+    positions = {}
+    for part in (last_event_id or '').split(','):
+        business_id, _, entry_id = part.partition('=')
+        try:
+            business_id = int(business_id)
+            _entry_key(entry_id)
+        except ValueError:
+            continue
+        if business_id in business_ids:
+            positions[business_id] = entry_id
+    return positions
+
+
+def format_event_id(positions):
+    return ','.join(f'{business_id}={entry_id}' for business_id, entry_id in sorted(positions.items()))
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = EventHub()
+    return _hub
+
+
+async def _with_timeouts(messages, timeout):
+    """
+    Yield from an async iterator, or None whenever ``timeout`` seconds pass
+    without a message.
+
+    asyncio.wait_for() would cancel the pending __anext__() on timeout,
+    which closes the underlying generator; waiting on the task does not.
+    """
+    iterator = messages.__aiter__()
+    next_message = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_message}, timeout=timeout)
+            if not done:
+                yield None
+                continue
+            yield next_message.result()
+            next_message = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        next_message.cancel()
+        try:
+            await next_message
+        except (asyncio.CancelledError, StopAsyncIteration):
+            pass
+        await iterator.aclose()
+
+
+async def _sse(business_ids, last_event_id):
+    yield f'retry: {RETRY_MS}\n\n'
+    async with aclosing(_with_timeouts(get_hub().messages(business_ids, last_event_id), KEEPALIVE_SECONDS)) as messages:
+        async for message in messages:
+            if message is None:
+                # Comment line keeps proxies and mobile networks from closing the stream
+                yield ': keepalive\n\n'
+                continue
+            event_id, deltas = message
+            yield f'id: {event_id}\ndata: {_dumps(deltas)}\n\n'
+
+
+async def event_stream(request):
+    """SSE endpoint streaming deltas for every business the user can see."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    businesses = Business.objects.filter(is_active=True)
+    if not (user.is_owner or user.is_superuser):
+        businesses = businesses.filter(users=user)
+    business_ids = [business_id async for business_id in businesses.values_list('id', flat=True)]
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(_sse(business_ids, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
+
+
+# -----------------------------------------------------------------------------
+# Load test
+# -----------------------------------------------------------------------------
+
+async def simulate_clients(clients=500, businesses=(1, 2, 3), duration=30, events_per_second=50, seed=1):
+    """
+    Connect ``clients`` simulated subscribers in this process and publish
+    a steady event load to the business streams.
+
+    Each client subscribes to one business (owners to all). Returns
+    delivery latency percentiles (publish to client, including the
+    coalescing window), messages delivered and entries coalesced per
+    message, in load_test.summarize() form.
+    """
+    from load_test import summarize
+
+    rng = random.Random(seed)
+    hub = EventHub()
+    publisher = aioredis.Redis.from_url(_redis_url())
+    samples = []
+    counts = {'messages': 0, 'entries': 0}
+    stop = asyncio.Event()
+
+    async def client(business_ids):
+        async with aclosing(_with_timeouts(hub.messages(business_ids), 1)) as messages:
+            async for message in messages:
+                if stop.is_set():
+                    break
+                if message is None:
+                    continue
+                received = time.time()
+                counts['messages'] += 1
+                for delta in message[1].values():
+                    sales = delta.get('sales', [])
+                    counts['entries'] += len(sales)
+                    for _, _, published in sales:
+                        samples.append(('sse_delivery', 'ok', (received - float(published)) * 1000, 0))
+
+    async def publish_load():
+        interval = 1 / events_per_second
+        sequence = 0
+        while not stop.is_set():
+            sequence += 1
+            business_id = rng.choice(businesses)
+            # The publish time rides in the sale total so clients can time delivery
+            delta = {'sales': [['load_test', sequence, repr(time.time())]]}
+            await publisher.xadd(
+                _stream_key(business_id), {'d': _dumps(delta)},
+                maxlen=STREAM_MAXLEN, approximate=True,
+            )
+            await asyncio.sleep(interval)
+
+    tasks = [
+        asyncio.create_task(client(list(businesses) if index % 20 == 0 else [rng.choice(businesses)]))
+        for index in range(clients)
+    ]
+    await asyncio.sleep(0.5)  # let every client register before publishing
+    publisher_task = asyncio.create_task(publish_load())
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(publisher_task, *tasks)
+    await publisher.aclose()
+    await hub.client.aclose()
+
+    report = summarize(samples, duration)
+    report['clients'] = clients
+    report['messages'] = counts['messages']
+    report['entries_per_message'] = round(counts['entries'] / counts['messages'], 2) if counts['messages'] else None
+    return report
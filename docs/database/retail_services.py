@@ -0,0 +1,295 @@
+"""
+Retail Services - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Stock receipts and sales for the retail shop (DOMAIN 6 in
+django_models.py). Copy into retail/services.py. LPG exchanges are
+recorded by lpg_services.record_lpg_exchange().
+
+Receipts add stock and a cost layer (costing.receive_stock); sales take
+stock and consume the layers (costing.consume_stock), so the cost on each
+RetailSaleItem is what the goods actually cost, not the last buying
+price.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from caching import invalidate
+from costing import cost_retail_items, receive_stock
+from django_models import RetailInventory, RetailSale, RetailSaleItem, TransactionType
+from instrumentation import instrumented
+from ledger_posting import cogs_lines, get_accounts, post_journal_entries, sale_lines
+from task_queue import audit_created
+from tax import apply_retail_sale_tax, get_tax_rate
+
+
+ZERO = Decimal('0.00')
+
+
+def _money(value):
+    """Round a Decimal to shillings and cents."""
+    return Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _lock_stock(business, product_ids):
+    """
+    Lock the inventory rows of the given products, in product_id order.
+
+    Returns {product_id: row}; products the business does not stock are
+    missing from it.
+    """
+    rows = (
+        RetailInventory.objects.select_for_update(of=('self',))
+        .select_related('product')
+        .filter(business=business, product_id__in=product_ids)
+        .order_by('product_id')
+    )
+    return {row.product_id: row for row in rows}
+
+
+def _unknown_products(stock, product_ids):
+    missing = sorted(set(product_ids) - set(stock))
+    if missing:
+        raise ValidationError(f"Products not stocked by this business: {missing}")
+
+
+# Stock 2, cost layers 6, savepoint in a caller's transaction 2 - for any
+# number of receipts
+@instrumented(max_queries=10)
+@transaction.atomic
+def receive_retail_stock(business, receipts, received_date):
+    """
+    Receive a delivery of retail stock.
+
+    Each receipt is a dict with product_id, quantity and unit_cost. Stock
+    and the last buying price are updated with a single UPDATE, and every
+    receipt becomes a cost layer for the costing engine.
+    """
+    receipts = list(receipts)
+    if not receipts:
+        return
+    for receipt in receipts:
+        if receipt['quantity'] < 1:
+            raise ValidationError("Quantity received must be at least 1.")
+        if receipt['unit_cost'] < 0:
+            raise ValidationError("Unit cost cannot be negative.")
+
+    stock = _lock_stock(business, {receipt['product_id'] for receipt in receipts})
+    _unknown_products(stock, [receipt['product_id'] for receipt in receipts])
+
+    new_quantity = {}
+    buying_price = {}
+    for receipt in receipts:
+        row = stock[receipt['product_id']]
+        new_quantity[row.id] = new_quantity.get(row.id, row.quantity_in_stock) + receipt['quantity']
+        buying_price[row.id] = _money(receipt['unit_cost'])
+
+    RetailInventory.objects.filter(id__in=new_quantity).update(
+        quantity_in_stock=Case(
+            *[When(id=row_id, then=Value(quantity)) for row_id, quantity in new_quantity.items()],
+            output_field=IntegerField(),
+        ),
+        buying_price=Case(
+            *[When(id=row_id, then=Value(price)) for row_id, price in buying_price.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        last_updated=timezone.now(),
+    )
+    invalidate(RetailInventory, business)
+
+    receive_stock(
+        business,
+        [
+            ('retail', receipt['product_id'], receipt['quantity'], receipt['unit_cost'], None)
+            for receipt in receipts
+        ],
+        received_date,
+        'purchase',
+    )
+
+
+def _allocate_sale_numbers(sale_date, count):
+    """
+    Allocate RS-YYYYMMDD-XXXX numbers for a batch of sales.
+
+    The day's advisory lock keeps concurrent batches from handing out the
+    same number; the last number is read once per batch.
+    """
+    prefix = f"RS-{sale_date.strftime('%Y%m%d')}"
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [prefix])
+    last_number = RetailSale.objects.filter(
+        sale_number__startswith=prefix
+    ).order_by('-sale_number').values_list('sale_number', flat=True).first()
+    first = int(last_number.split('-')[-1]) + 1 if last_number else 1
+    return [f'{prefix}-{sequence:04d}' for sequence in range(first, first + count)]
+
+
+# Stock 2, VAT 1, sale numbers 2, costing 5, accounts 2, posting 13 (its
+# savepoint and a business's first chain head included), inserts 2,
+# audit 1, savepoint in a caller's transaction 2 - for any number of sales
+@instrumented(max_queries=30)
+@transaction.atomic
+def record_retail_sales(business, sales, sale_date, recorded_by):
+    """
+    Record a batch of retail sales (e.g. a till's offline queue) atomically.
+
+    Each sale is a dict with payment_method, ``items`` and optional
+    discount_amount, customer, m_pesa_transaction_id, sale_time and notes. Each item is a
+    dict with product_id, quantity and optional unit_price (default: the
+    product's selling price).
+
+    Stock rows are locked in product order and reduced with a single
+    UPDATE, every line takes its cost from the costing engine's layers
+    and its VAT from the tax engine (after its share of the discount),
+    the journal entries are posted in one batch, and headers and lines
+    are inserted with one bulk_create each.
+    """
+    sales = list(sales)
+    if not sales:
+        return []
+
+    quantities = defaultdict(int)
+    for sale in sales:
+        if not sale['items']:
+            raise ValidationError("A retail sale needs at least one item.")
+        for item in sale['items']:
+            if item['quantity'] < 1:
+                raise ValidationError("Item quantity must be at least 1.")
+            quantities[item['product_id']] += item['quantity']
+
+    stock = _lock_stock(business, list(quantities))
+    _unknown_products(stock, list(quantities))
+    for product_id, quantity in quantities.items():
+        row = stock[product_id]
+        if row.quantity_in_stock < quantity:
+            raise ValidationError(
+                f"Not enough {row.product.name} in stock: "
+                f"{row.quantity_in_stock} available, {quantity} needed."
+            )
+
+    if len(quantities) == 1:
+        # The common single-product sale: fixed SQL text, so it gets prepared
+        [(product_id, quantity)] = quantities.items()
+        RetailInventory.objects.filter(id=stock[product_id].id).update(
+            quantity_in_stock=F('quantity_in_stock') - quantity, last_updated=timezone.now(),
+        )
+    else:
+        RetailInventory.objects.filter(id__in=[row.id for row in stock.values()]).update(
+            quantity_in_stock=Case(
+                *[
+                    When(id=stock[product_id].id, then=Value(stock[product_id].quantity_in_stock - quantity))
+                    for product_id, quantity in quantities.items()
+                ],
+                output_field=IntegerField(),
+            ),
+            last_updated=timezone.now(),
+        )
+    invalidate(RetailInventory, business)
+
+    tax_rate = get_tax_rate(business)
+    headers, sale_items = [], []
+    for sale, sale_number in zip(sales, _allocate_sale_numbers(sale_date, len(sales))):
+        items = []
+        for item in sale['items']:
+            unit_price = item.get('unit_price')
+            if unit_price is None:
+                unit_price = stock[item['product_id']].selling_price
+            items.append(RetailSaleItem(
+                product=stock[item['product_id']].product,
+                quantity=item['quantity'],
+                unit_price=unit_price,
+                line_total=_money(item['quantity'] * Decimal(unit_price)),
+            ))
+        subtotal = sum((item.line_total for item in items), ZERO)
+        discount_amount = _money(sale.get('discount_amount', ZERO))
+        if not ZERO <= discount_amount <= subtotal:
+            raise ValidationError("Discount must be between zero and the sale subtotal.")
+        header = RetailSale(
+            business=business,
+            customer=sale.get('customer'),
+            sale_number=sale_number,
+            subtotal_amount=subtotal,
+            discount_amount=discount_amount,
+            total_amount=subtotal - discount_amount,
+            payment_method=sale['payment_method'],
+            m_pesa_transaction_id=sale.get('m_pesa_transaction_id', ''),
+            sale_date=sale_date,
+            notes=sale.get('notes', ''),
+            recorded_by=recorded_by,
+        )
+        if sale.get('sale_time'):
+            header.sale_time = sale['sale_time']
+        apply_retail_sale_tax(header, items, tax_rate)
+        headers.append(header)
+        sale_items.append(items)
+    cost_retail_items(business, [item for items in sale_items for item in items])
+
+    accounts = get_accounts(
+        business, *sorted({header.payment_method for header in headers}),
+        'revenue', 'vat_payable', 'cogs', 'inventory',
+    )
+    sale_type = TransactionType.objects.get(code='SALE')
+    entries = []
+    for header, items in zip(headers, sale_items):
+        description = f"Retail sale {header.sale_number}"
+        lines = sale_lines(
+            accounts, header.payment_method, 'revenue', header.total_amount, description, header.tax_amount
+        )
+        cost = sum((item.cost_amount for item in items), ZERO)
+        if cost:
+            lines += cogs_lines(accounts, cost, description)
+        entries.append({
+            'business': business,
+            'transaction_type': sale_type,
+            'transaction_date': sale_date,
+            'description': description,
+            'reference_number': header.m_pesa_transaction_id,
+            'created_by': recorded_by,
+            'lines': lines,
+        })
+    for header, journal_entry in zip(headers, post_journal_entries(entries)):
+        header.journal_entry = journal_entry
+
+    RetailSale.objects.bulk_create(headers)
+    for header, items in zip(headers, sale_items):
+        for item in items:
+            item.sale = header
+    RetailSaleItem.objects.bulk_create([item for items in sale_items for item in items])
+    # bulk_create() sends no post_save: audit the batch in one task, then
+    # send it for the cache and realtime handlers
+    audit_created(RetailSale, headers)
+    for header in headers:
+        post_save.send(
+            sender=RetailSale, instance=header, created=True, update_fields=None, raw=False,
+            using=header._state.db, audited=True,
+        )
+    return headers
+
+
+def record_retail_sale(business, items, payment_method, recorded_by, sale_date=None,
+                       discount_amount=ZERO, customer=None, m_pesa_transaction_id='', notes=''):
+    """Record a single retail sale (see record_retail_sales)."""
+    return record_retail_sales(
+        business,
+        [{
+            'items': items,
+            'payment_method': payment_method,
+            'discount_amount': discount_amount,
+            'customer': customer,
+            'm_pesa_transaction_id': m_pesa_transaction_id,
+            'notes': notes,
+        }],
+        sale_date or timezone.localdate(),
+        recorded_by,
+    )[0]
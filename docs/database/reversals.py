@@ -0,0 +1,357 @@
+"""
+Journal Entry Reversal - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Reverses posted journal entries, one at a time or a whole day of them,
+together with the sale, stock and cylinder effects of the documents they
+belong to. Copy into core/reversals.py.
+
+Posted entries are never edited or deleted (Ledger.delete refuses). A
+reversal posts a mirror entry - every line with debit and credit swapped
+- linked to the original through reversal_of, and marks the original
+'reversed'. For a batch of entries this is the same number of statements
+as for one:
+- originals locked with one SELECT ... FOR UPDATE, lines loaded with one
+- mirrors posted through post_journal_entries() (one INSERT each for
+  headers, lines and ledger rows, one aggregated balance UPDATE)
+- originals marked 'reversed' with one UPDATE
+- stock restored with one CASE UPDATE per business and table
+
+Locks are taken in the order the sale services take them: cylinders,
+then stock and cost layers, then the posting's date and account locks.
+
+Document effects, in the same transaction:
+- water and retail sales: stock returned to inventory and a cost layer
+  added back at the cost the sale consumed
+- LPG exchanges: refill stock returned, the issued cylinder back on the
+  shelf as 'full' and the returned cylinder back with the customer
+- laundry jobs: cancelled
+- every document: an audit row by the reverser, naming the reversing
+  entry (update() and the entry status change send no post_save)
+
+Reversed sales drop out of gross_margin(), the sales rollups and the VAT
+return, so the return keeps matching VAT payable (2130) in the ledger.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, CharField, F, IntegerField, Value, When
+from django.utils import timezone
+
+from django_models import (
+    Business,
+    JournalEntry,
+    JournalEntryLine,
+    LaundryJob,
+    RetailInventory,
+    RetailLPGCylinder,
+    RetailLPGExchange,
+    RetailSale,
+    RetailSaleItem,
+    WaterInventory,
+    WaterSale,
+)
+from analytics import rebuild_rollups
+from caching import invalidate
+from costing import receive_stock
+from ledger_posting import post_journal_entries
+from lpg_services import SHOP_LOCATION, lpg_product_code, record_cylinder_transitions
+from audit_history import write_audit_entries
+from task_queue import AUDITED_MODELS, audit_data, defer
+
+
+@transaction.atomic
+def reverse_journal_entries(entry_ids, reversed_by, reason, reversal_date=None):
+    """
+    Reverse a batch of posted journal entries and their documents.
+
+    Each mirror entry is dated ``reversal_date``, or the original's date
+    when None so the day nets to zero. Raises ValidationError, reversing
+    nothing, if any entry is missing, not posted, or itself a reversal.
+    Returns the mirror entries in the order of the originals' ids.
+    """
+    entry_ids = sorted(set(entry_ids))
+    if not entry_ids:
+        return []
+    originals = list(
+        JournalEntry.objects.select_for_update(of=('self',))
+        .select_related('business', 'transaction_type')
+        .filter(id__in=entry_ids)
+        .order_by('id')
+    )
+    missing = set(entry_ids) - {entry.id for entry in originals}
+    if missing:
+        raise ValidationError(f"Journal entries not found: {sorted(missing)}")
+    for entry in originals:
+        if entry.status != 'posted':
+            raise ValidationError(
+                f"Journal entry {entry.entry_number} cannot be reversed (status: {entry.status})."
+            )
+        if entry.reversal_of_id is not None:
+            raise ValidationError(
+                f"Journal entry {entry.entry_number} is itself a reversal."
+            )
+
+    lines = defaultdict(list)
+    for line in JournalEntryLine.objects.filter(
+        journal_entry_id__in=entry_ids
+    ).select_related('account').order_by('journal_entry_id', 'id'):
+        lines[line.journal_entry_id].append(
+            (line.account, not line.is_debit, line.amount, line.description)
+        )
+
+    # Document effects first: they lock cylinders and stock before the
+    # posting takes its date and account locks, the order the sale
+    # services use, so a reversal cannot deadlock with a concurrent sale.
+    _reverse_documents(entry_ids, reversal_date or timezone.localdate())
+
+    reversals = post_journal_entries([
+        {
+            'business': entry.business,
+            'transaction_type': entry.transaction_type,
+            'transaction_date': reversal_date or entry.transaction_date,
+            'description': f"Reversal of {entry.entry_number}: {reason}"[:500],
+            'reference_number': entry.entry_number,
+            'created_by': reversed_by,
+            'reversal_of': entry,
+            'lines': lines[entry.id],
+        }
+        for entry in originals
+    ])
+    JournalEntry.objects.filter(id__in=entry_ids).update(
+        status='reversed', updated_at=timezone.now()
+    )
+    invalidate_days = defaultdict(set)
+    for entry in originals:
+        invalidate_days[entry.business_id].add(entry.transaction_date)
+    for business_id, days in invalidate_days.items():
+        invalidate(JournalEntry, business_id, days)
+
+    _audit_reversed_documents(
+        {entry.id: reversal.id for entry, reversal in zip(originals, reversals)}, reversed_by
+    )
+    return reversals
+
+
+def reverse_documents(documents, reversed_by, reason, reversal_date=None):
+    """Reverse sales (WaterSale, RetailSale, RetailLPGExchange, LaundryJob) by their entries."""
+    entry_ids = [document.journal_entry_id for document in documents]
+    if None in entry_ids:
+        raise ValidationError("Only documents with a posted journal entry can be reversed.")
+    return reverse_journal_entries(entry_ids, reversed_by, reason, reversal_date)
+
+
+def reverse_day(business, day, reversed_by, reason, transaction_type='SALE'):
+    """Reverse every posted entry of one type in a business on one day."""
+    entry_ids = list(
+        JournalEntry.objects.filter(
+            business=business,
+            transaction_date=day,
+            transaction_type__code=transaction_type,
+            status='posted',
+            reversal_of__isnull=True,
+        ).values_list('id', flat=True)
+    )
+    return reverse_journal_entries(entry_ids, reversed_by, reason)
+
+
+# -----------------------------------------------------------------------------
+# Document effects
+# -----------------------------------------------------------------------------
+
+def _restock(queryset, key_field, quantity_field, quantities):
+    """Add per-key quantities back to stock rows in one UPDATE."""
+    if len(quantities) == 1:
+        # Fixed SQL text for the common single-SKU reversal
+        [(key, quantity)] = quantities.items()
+        queryset.filter(**{key_field: key}).update(**{
+            quantity_field: F(quantity_field) + quantity, 'last_updated': timezone.now(),
+        })
+        return
+    queryset.filter(**{f'{key_field}__in': list(quantities)}).update(**{
+        quantity_field: F(quantity_field) + Case(
+            *[When(**{key_field: key}, then=Value(quantity)) for key, quantity in quantities.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        'last_updated': timezone.now(),
+    })
+
+
+def _reverse_documents(entry_ids, event_date):
+    # business_id -> {(sku_type, sku_id): quantity}, receipts, sale days per model
+    returned = defaultdict(lambda: defaultdict(int))
+    receipts = defaultdict(list)
+    touched = defaultdict(lambda: defaultdict(set))
+
+    for sale in WaterSale.objects.filter(journal_entry_id__in=entry_ids).only(
+        'id', 'business', 'product_size', 'quantity_sold', 'unit_cost', 'sale_date'
+    ):
+        returned[sale.business_id][('water', sale.product_size_id)] += sale.quantity_sold
+        if sale.unit_cost is not None:
+            receipts[sale.business_id].append(
+                ('water', sale.product_size_id, sale.quantity_sold, sale.unit_cost, sale.id)
+            )
+        touched[sale.business_id][WaterSale].add(sale.sale_date)
+
+    for item in RetailSaleItem.objects.filter(sale__journal_entry_id__in=entry_ids).values(
+        'sale_id', 'sale__business_id', 'sale__sale_date', 'product_id', 'quantity', 'unit_cost'
+    ):
+        business_id = item['sale__business_id']
+        returned[business_id][('retail', item['product_id'])] += item['quantity']
+        if item['unit_cost'] is not None:
+            receipts[business_id].append(
+                ('retail', item['product_id'], item['quantity'], item['unit_cost'], item['sale_id'])
+            )
+        touched[business_id][RetailSale].add(item['sale__sale_date'])
+
+    exchanges = list(
+        RetailLPGExchange.objects.filter(journal_entry_id__in=entry_ids)
+        .select_related('customer')
+        .order_by('id')
+    )
+    if exchanges:
+        _reverse_exchanges(exchanges, returned, receipts, touched, event_date)
+
+    for job in LaundryJob.objects.filter(journal_entry_id__in=entry_ids).values(
+        'business_id', 'received_date'
+    ):
+        touched[job['business_id']][LaundryJob].add(job['received_date'])
+    LaundryJob.objects.filter(journal_entry_id__in=entry_ids).update(
+        status='cancelled', updated_at=timezone.now()
+    )
+
+    business_ids = set(returned) | set(touched)
+    businesses = Business.objects.in_bulk(business_ids)
+    for business_id in sorted(business_ids):
+        quantities = returned[business_id]
+        water = {sku_id: qty for (sku_type, sku_id), qty in quantities.items() if sku_type == 'water'}
+        retail = {sku_id: qty for (sku_type, sku_id), qty in quantities.items() if sku_type == 'retail'}
+        if water:
+            _restock(
+                WaterInventory.objects.filter(business_id=business_id, inventory_type='filled'),
+                'product_size_id', 'quantity', water,
+            )
+            invalidate(WaterInventory, business_id)
+        if retail:
+            _restock(
+                RetailInventory.objects.filter(business_id=business_id),
+                'product_id', 'quantity_in_stock', retail,
+            )
+            invalidate(RetailInventory, business_id)
+        receive_stock(businesses[business_id], receipts[business_id], event_date, 'adjustment')
+
+        sale_days = set()
+        for model, days in touched[business_id].items():
+            invalidate(model, business_id, days)
+            sale_days |= days
+        if sale_days:
+            # Rollups are derived data: rebuild after commit, off the request
+            defer(refresh_rollup_days, business_id, sorted(sale_days), business_id=business_id)
+
+
+def _reverse_exchanges(exchanges, returned, receipts, touched, event_date):
+    """Put refills and cylinders back where they were before each exchange."""
+    cylinder_ids = sorted(
+        {exchange.full_cylinder_id for exchange in exchanges}
+        | {exchange.empty_cylinder_id for exchange in exchanges if exchange.empty_cylinder_id}
+    )
+    # Locked in id order, like record_lpg_exchange
+    cylinders = {
+        cylinder.id: cylinder
+        for cylinder in RetailLPGCylinder.objects.select_for_update()
+        .filter(id__in=cylinder_ids)
+        .order_by('id')
+    }
+    product_codes = {
+        exchange.id: lpg_product_code(
+            cylinders[exchange.full_cylinder_id].brand, cylinders[exchange.full_cylinder_id].capacity_kg
+        )
+        for exchange in exchanges
+    }
+    refill_ids = {
+        (row['business_id'], row['product__product_code']): row['product_id']
+        for row in RetailInventory.objects.filter(
+            business_id__in={exchange.business_id for exchange in exchanges},
+            product__product_code__in=set(product_codes.values()),
+        ).values('business_id', 'product_id', 'product__product_code')
+    }
+
+    locations = {}
+    transitions = defaultdict(list)
+    for exchange in exchanges:
+        full = cylinders[exchange.full_cylinder_id]
+        empty = cylinders.get(exchange.empty_cylinder_id)
+        # A cylinder that has moved on since the exchange cannot be put back
+        if full.status != 'customer' or (empty is not None and empty.status != 'empty'):
+            raise ValidationError(
+                f"Cylinders of LPG exchange #{exchange.id} have changed state since; "
+                f"adjust them manually before reversing."
+            )
+        locations[full.id] = ('full', SHOP_LOCATION)
+        transitions[exchange.business_id].append((full, 'customer', 'full', 'adjustment'))
+        if empty is not None:
+            customer_location = exchange.customer.name if exchange.customer else 'Walk-in customer'
+            locations[empty.id] = ('customer', customer_location[:200])
+            transitions[exchange.business_id].append((empty, 'empty', 'customer', 'adjustment'))
+
+        product_id = refill_ids.get((exchange.business_id, product_codes[exchange.id]))
+        if product_id is not None:
+            returned[exchange.business_id][('retail', product_id)] += 1
+            if exchange.cost_amount is not None:
+                receipts[exchange.business_id].append(
+                    ('retail', product_id, 1, exchange.cost_amount, exchange.id)
+                )
+        touched[exchange.business_id][RetailLPGExchange].add(exchange.exchange_date)
+
+    RetailLPGCylinder.objects.filter(id__in=list(locations)).update(
+        status=Case(
+            *[When(id=cylinder_id, then=Value(status)) for cylinder_id, (status, _) in locations.items()],
+            output_field=CharField(),
+        ),
+        current_location=Case(
+            *[When(id=cylinder_id, then=Value(location)) for cylinder_id, (_, location) in locations.items()],
+            output_field=CharField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    businesses = Business.objects.in_bulk(list(transitions))
+    for business_id, business_transitions in transitions.items():
+        record_cylinder_transitions(businesses[business_id], business_transitions, event_date)
+
+
+def _audit_reversed_documents(reversal_of, reversed_by):
+    """
+    Write the audit rows of the documents behind reversed entries.
+
+    Their changes go through update() (laundry jobs) or only through the
+    journal entry (sales), so no post_save audits them. Each gets an
+    update row by the reverser, carrying the reversing entry's id, with
+    one deferred write per business.
+    """
+    entries = defaultdict(list)
+    for model in AUDITED_MODELS:
+        for document in model.objects.filter(journal_entry_id__in=list(reversal_of)):
+            data = audit_data(document)
+            data['reversal_entry_id'] = reversal_of[document.journal_entry_id]
+            entries[document.business_id].append({
+                'table_name': model._meta.db_table,
+                'record_id': document.pk,
+                'action': 'update',
+                'data': data,
+                'changed_by_id': reversed_by.id,
+                'business_id': document.business_id,
+            })
+    for business_id in sorted(entries):
+        defer(write_audit_entries, entries[business_id], business_id=business_id)
+
+
+def refresh_rollup_days(business_id, days):
+    """Deferred task: rebuild the sales rollups for the days a reversal touched."""
+    rebuild_rollups(business_id, [date.fromisoformat(day) for day in days])
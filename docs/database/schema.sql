@@ -127,6 +127,7 @@ CREATE TABLE business_settings (
     signature_threshold MONEY DEFAULT 10000.00,
     allow_negative_stock BOOLEAN DEFAULT FALSE,
     low_stock_threshold INTEGER DEFAULT 10,
+    costing_method VARCHAR(20) DEFAULT 'fifo' CHECK (costing_method IN ('weighted_average', 'fifo')),
     operating_hours_start TIME DEFAULT '08:00',
     operating_hours_end TIME DEFAULT '20:00',
     receipt_footer TEXT,
@@ -196,6 +197,7 @@ CREATE TABLE transaction_type (
     name VARCHAR(50) UNIQUE NOT NULL,
     code VARCHAR(10) UNIQUE NOT NULL,
     description TEXT,
+    cashflow_activity VARCHAR(20) NOT NULL DEFAULT 'operating' CHECK (cashflow_activity IN ('operating', 'investing', 'financing', 'transfer')),
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT NOW()
 );
@@ -213,6 +215,7 @@ CREATE TABLE journal_entry (
     total_debit MONEY DEFAULT 0.00,
     total_credit MONEY DEFAULT 0.00,
     created_by BIGINT NOT NULL REFERENCES user(id) ON DELETE PROTECT,
+    reversal_of_id BIGINT UNIQUE REFERENCES journal_entry(id) ON DELETE PROTECT,  -- entry this one reverses
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW(),
     posted_at TIMESTAMP
@@ -251,14 +254,18 @@ CREATE TABLE ledger (
     amount MONEY NOT NULL,
     balance_after MONEY NOT NULL,
     reference_number VARCHAR(100),
+    prev_hash VARCHAR(64) NOT NULL DEFAULT '',  -- hash chain, see hash_chain.py
+    row_hash VARCHAR(64) NOT NULL DEFAULT '',
     created_at TIMESTAMP DEFAULT NOW()
 );
 
 CREATE INDEX idx_ledger_account_date ON ledger(account_id, transaction_date DESC);
-CREATE INDEX idx_ledger_business_date ON ledger(business_id, transaction_date DESC);
+CREATE INDEX idx_ledger_business_date ON ledger(business_id, transaction_date DESC, id DESC);  -- list keyset, see pagination.py
 CREATE INDEX idx_ledger_type ON ledger(transaction_type_id);
 CREATE INDEX idx_ledger_reference ON ledger(reference_number);
 CREATE INDEX idx_ledger_date_desc ON ledger(transaction_date DESC, account_id);
+CREATE INDEX idx_ledger_account_id ON ledger(account_id, id);
+CREATE INDEX idx_ledger_line ON ledger(journal_entry_line_id);
 
 -- Account Balance table (snapshots for performance)
 CREATE TABLE account_balance (
@@ -277,6 +284,23 @@ CREATE TABLE account_balance (
 CREATE INDEX idx_account_balance_account_date ON account_balance(account_id, balance_date);
 CREATE INDEX idx_account_balance_business_date ON account_balance(business_id, balance_date);
 
+-- Accounting Period table (month-end close, see period_close.py)
+CREATE TABLE accounting_period (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    period_end DATE NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'closed')),
+    closing_entry_id BIGINT UNIQUE REFERENCES journal_entry(id) ON DELETE PROTECT,
+    closed_at TIMESTAMP,
+    closed_by BIGINT REFERENCES user(id) ON DELETE PROTECT,
+    reopened_at TIMESTAMP,
+    reopened_by BIGINT REFERENCES user(id) ON DELETE PROTECT,
+    reopen_reason TEXT,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT unique_accounting_period UNIQUE (business_id, period_start)
+);
+
 -- Reconciliation table
 CREATE TABLE reconciliation (
     id BIGSERIAL PRIMARY KEY,
@@ -354,6 +378,11 @@ CREATE TABLE water_sale (
     total_amount MONEY NOT NULL,
     payment_method payment_method_enum NOT NULL,
     m_pesa_transaction_id VARCHAR(100),
+    unit_cost MONEY,  -- Set by the costing engine at write time
+    cost_amount MONEY,
+    tax_rate NUMERIC(5, 2),  -- VAT rate at time of sale
+    net_amount MONEY,
+    tax_amount MONEY,
     sale_date DATE NOT NULL,
     sale_time TIME DEFAULT NOW(),
     notes TEXT,
@@ -362,7 +391,7 @@ CREATE TABLE water_sale (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
-CREATE INDEX idx_water_sale_business_date ON water_sale(business_id, sale_date);
+CREATE INDEX idx_water_sale_business_date ON water_sale(business_id, sale_date DESC, sale_time DESC, id DESC);
 CREATE INDEX idx_water_sale_customer ON water_sale(customer_id);
 CREATE INDEX idx_water_sale_size ON water_sale(product_size_id);
 CREATE INDEX idx_water_sale_payment ON water_sale(payment_method);
@@ -411,22 +440,25 @@ CREATE TABLE laundry_job (
     collected_date DATE,
     subtotal_amount MONEY DEFAULT 0.00,
     discount_amount MONEY DEFAULT 0.00,
+    tax_rate NUMERIC(5, 2),  -- VAT rate applied to this job
     tax_amount MONEY DEFAULT 0.00,
     total_amount MONEY DEFAULT 0.00,
     amount_paid MONEY DEFAULT 0.00,
     balance_due MONEY DEFAULT 0.00,
     notes TEXT,
     received_by BIGINT NOT NULL REFERENCES user(id) ON DELETE PROTECT,
+    last_reminder_date DATE,  -- Last overdue pickup reminder queued
     journal_entry_id BIGINT UNIQUE REFERENCES journal_entry(id) ON DELETE PROTECT,
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
-CREATE INDEX idx_laundry_job_business_date ON laundry_job(business_id, received_date);
+CREATE INDEX idx_laundry_job_business_date ON laundry_job(business_id, received_date DESC, job_number DESC);
 CREATE INDEX idx_laundry_job_customer ON laundry_job(customer_id);
 CREATE INDEX idx_laundry_job_status ON laundry_job(status);
 CREATE INDEX idx_laundry_job_number ON laundry_job(job_number);
 CREATE INDEX idx_laundry_job_status_date ON laundry_job(status, received_date);
+CREATE INDEX idx_laundry_job_updated ON laundry_job(updated_at);
 
 -- Laundry Job Item table
 CREATE TABLE laundry_job_item (
@@ -441,6 +473,17 @@ CREATE TABLE laundry_job_item (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Laundry Overdue Summary table (maintained by the overdue sweeper)
+CREATE TABLE laundry_overdue_summary (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT UNIQUE NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    overdue_jobs INTEGER DEFAULT 0,
+    overdue_balance MONEY DEFAULT 0.00,
+    ready_jobs INTEGER DEFAULT 0,
+    oldest_received_date DATE,
+    computed_at TIMESTAMP NOT NULL
+);
+
 -- =============================================================================
 -- TABLES: RETAIL/LPG BUSINESS
 -- =============================================================================
@@ -520,6 +563,10 @@ CREATE TABLE retail_lpg_exchange (
     capacity_kg NUMERIC(5, 2) NOT NULL,
     price_per_kg MONEY NOT NULL,
     total_amount MONEY NOT NULL,
+    cost_amount MONEY,  -- Cost of the gas refill sold
+    tax_rate NUMERIC(5, 2),  -- VAT rate at time of sale
+    net_amount MONEY,
+    tax_amount MONEY,
     payment_method payment_method_enum NOT NULL,
     m_pesa_transaction_id VARCHAR(100),
     exchange_date DATE NOT NULL,
@@ -530,10 +577,39 @@ CREATE TABLE retail_lpg_exchange (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
-CREATE INDEX idx_lpg_exchange_business_date ON retail_lpg_exchange(business_id, exchange_date);
+CREATE INDEX idx_lpg_exchange_business_date ON retail_lpg_exchange(business_id, exchange_date DESC, exchange_time DESC, id DESC);
 CREATE INDEX idx_lpg_exchange_customer ON retail_lpg_exchange(customer_id);
 CREATE INDEX idx_lpg_exchange_cylinder ON retail_lpg_exchange(full_cylinder_id);
 
+-- Retail LPG Fleet Summary table (maintained counts per brand/capacity/status)
+CREATE TABLE retail_lpg_fleet_summary (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    brand VARCHAR(50) NOT NULL,
+    capacity_kg NUMERIC(5, 2) NOT NULL,
+    status cylinder_status_enum NOT NULL,
+    cylinder_count INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE(business_id, brand, capacity_kg, status)
+);
+
+-- Retail LPG Cylinder Event table (per-cylinder circulation history)
+CREATE TABLE retail_lpg_cylinder_event (
+    id BIGSERIAL PRIMARY KEY,
+    cylinder_id BIGINT NOT NULL REFERENCES retail_lpg_cylinder(id) ON DELETE CASCADE,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    event_type VARCHAR(20) NOT NULL,
+    from_status cylinder_status_enum,
+    to_status cylinder_status_enum NOT NULL,
+    exchange_id BIGINT REFERENCES retail_lpg_exchange(id) ON DELETE PROTECT,
+    customer_id BIGINT REFERENCES customer(id) ON DELETE SET NULL,
+    event_date DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX idx_lpg_cylinder_event_cylinder ON retail_lpg_cylinder_event(cylinder_id, id DESC);
+CREATE INDEX idx_lpg_cylinder_event_business_date ON retail_lpg_cylinder_event(business_id, event_date);
+
 -- Retail Sale table
 CREATE TABLE retail_sale (
     id BIGSERIAL PRIMARY KEY,
@@ -554,7 +630,7 @@ CREATE TABLE retail_sale (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
-CREATE INDEX idx_retail_sale_business_date ON retail_sale(business_id, sale_date);
+CREATE INDEX idx_retail_sale_business_date ON retail_sale(business_id, sale_date DESC, sale_number DESC);
 CREATE INDEX idx_retail_sale_customer ON retail_sale(customer_id);
 CREATE INDEX idx_retail_sale_payment ON retail_sale(payment_method);
 CREATE INDEX idx_retail_sale_number ON retail_sale(sale_number);
@@ -567,6 +643,11 @@ CREATE TABLE retail_sale_item (
     quantity INTEGER NOT NULL CHECK (quantity > 0),
     unit_price MONEY NOT NULL,
     line_total MONEY NOT NULL,
+    unit_cost MONEY,  -- Set by the costing engine at write time
+    cost_amount MONEY,
+    tax_rate NUMERIC(5, 2),  -- VAT rate at time of sale
+    net_amount MONEY,
+    tax_amount MONEY,
     created_at TIMESTAMP DEFAULT NOW()
 );
 
@@ -574,6 +655,24 @@ CREATE TABLE retail_sale_item (
 -- TABLES: SHARED/CROSS-BUSINESS
 -- =============================================================================
 
+-- Inventory Cost Layer table (FIFO / weighted-average cost of goods sold)
+CREATE TABLE inventory_cost_layer (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    sku_type VARCHAR(10) NOT NULL CHECK (sku_type IN ('retail', 'water')),
+    sku_id BIGINT NOT NULL,  -- retail_product.id or water_product_size.id
+    source VARCHAR(20) NOT NULL CHECK (source IN ('opening', 'purchase', 'production', 'adjustment')),
+    source_id BIGINT,
+    received_date DATE NOT NULL,
+    quantity_received INTEGER NOT NULL CHECK (quantity_received >= 0),
+    quantity_remaining INTEGER NOT NULL CHECK (quantity_remaining >= 0),
+    unit_cost NUMERIC(12, 4) NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX idx_cost_layer_open ON inventory_cost_layer(business_id, sku_type, sku_id, id)
+WHERE quantity_remaining > 0;
+
 -- Customer table (shared across all businesses)
 CREATE TABLE customer (
     id BIGSERIAL PRIMARY KEY,
@@ -583,6 +682,7 @@ CREATE TABLE customer (
     email VARCHAR(254),
     address TEXT,
     id_number VARCHAR(50),
+    kra_pin VARCHAR(11),  -- KRA PIN for VAT returns
     customer_type customer_type_enum DEFAULT 'individual',
     notes TEXT,
     is_active BOOLEAN DEFAULT TRUE,
@@ -594,6 +694,89 @@ CREATE INDEX idx_customer_phone ON customer(phone_number);
 CREATE INDEX idx_customer_name ON customer(name);
 CREATE INDEX idx_customer_type ON customer(customer_type);
 
+-- Batch Job State table (watermarks for incremental scheduled jobs)
+CREATE TABLE batch_job_state (
+    id BIGSERIAL PRIMARY KEY,
+    job_name VARCHAR(100) UNIQUE NOT NULL,
+    watermark_at TIMESTAMP,
+    watermark_date DATE,
+    watermark_id BIGINT,
+    last_run_at TIMESTAMP,
+    last_run_stats JSONB DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Data Export table (background CSV/XLSX exports and their progress)
+CREATE TABLE data_export (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    dataset VARCHAR(20) NOT NULL CHECK (dataset IN ('ledger', 'water_sales', 'retail_sales', 'lpg_exchanges', 'laundry_jobs', 'audit_log')),
+    file_format VARCHAR(10) NOT NULL DEFAULT 'csv' CHECK (file_format IN ('csv', 'xlsx')),
+    date_from DATE NOT NULL,
+    date_to DATE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+    rows_total INTEGER DEFAULT 0 CHECK (rows_total >= 0),
+    rows_written INTEGER DEFAULT 0 CHECK (rows_written >= 0),
+    file_path VARCHAR(500),
+    error_message TEXT,
+    requested_by BIGINT REFERENCES user(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    completed_at TIMESTAMP,
+    CONSTRAINT check_export_dates CHECK (date_to >= date_from)
+);
+
+CREATE INDEX idx_data_export_business ON data_export(business_id, created_at);
+CREATE INDEX idx_data_export_status ON data_export(status);
+
+-- Deferred Task table (outbox for after-commit side effects, see task_queue.py)
+CREATE TABLE deferred_task (
+    id BIGSERIAL PRIMARY KEY,
+    key VARCHAR(200) UNIQUE NOT NULL,
+    task VARCHAR(200) NOT NULL,
+    args JSONB DEFAULT '[]',
+    queue VARCHAR(50) NOT NULL DEFAULT 'default',
+    business_id BIGINT REFERENCES business(id) ON DELETE SET NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'dead')),
+    attempts INTEGER DEFAULT 0 CHECK (attempts >= 0),
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP DEFAULT NOW(),
+    completed_at TIMESTAMP
+);
+
+CREATE INDEX idx_deferred_task_pending ON deferred_task(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX idx_deferred_task_dead ON deferred_task(created_at) WHERE status = 'dead';
+
+-- Sales Rollup table (day/week/month sales totals, maintained by analytics.py)
+CREATE TABLE sales_rollup (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    grain VARCHAR(10) NOT NULL CHECK (grain IN ('day', 'week', 'month')),
+    period_start DATE NOT NULL,
+    stream VARCHAR(10) NOT NULL CHECK (stream IN ('water', 'laundry', 'retail', 'lpg')),
+    transactions INTEGER DEFAULT 0 CHECK (transactions >= 0),
+    revenue MONEY DEFAULT 0.00,
+    tax_amount MONEY DEFAULT 0.00,
+    cost_amount MONEY DEFAULT 0.00,
+    computed_at TIMESTAMP NOT NULL,
+    CONSTRAINT unique_sales_rollup_period UNIQUE (business_id, grain, period_start, stream)
+);
+
+-- Product Sales Rollup table (day/week/month quantity and revenue per product)
+CREATE TABLE product_sales_rollup (
+    id BIGSERIAL PRIMARY KEY,
+    business_id BIGINT NOT NULL REFERENCES business(id) ON DELETE CASCADE,
+    grain VARCHAR(10) NOT NULL CHECK (grain IN ('day', 'week', 'month')),
+    period_start DATE NOT NULL,
+    product_key VARCHAR(50) NOT NULL,
+    product_name VARCHAR(200) NOT NULL,
+    quantity NUMERIC(15, 2) DEFAULT 0.00,
+    revenue MONEY DEFAULT 0.00,
+    computed_at TIMESTAMP NOT NULL,
+    CONSTRAINT unique_product_rollup_period UNIQUE (business_id, grain, period_start, product_key)
+);
+
 -- =============================================================================
 -- TABLES: AUDIT LOG (7-Year Retention - KRA Compliance)
 -- =============================================================================
@@ -606,18 +789,44 @@ CREATE TABLE audit_log (
     action audit_action_enum NOT NULL,
     old_data JSONB,
     new_data JSONB,
+    is_snapshot BOOLEAN NOT NULL DEFAULT FALSE,  -- full state vs changed fields, see audit_history.py
     changed_fields JSONB,
     changed_by BIGINT REFERENCES user(id) ON DELETE SET NULL,
     business_id BIGINT REFERENCES business(id) ON DELETE SET NULL,
     ip_address INET,
     user_agent TEXT,
+    prev_hash VARCHAR(64) NOT NULL DEFAULT '',  -- hash chain, see hash_chain.py
+    row_hash VARCHAR(64) NOT NULL DEFAULT '',
     created_at TIMESTAMP DEFAULT NOW()
 );
 
-CREATE INDEX idx_audit_log_table_record ON audit_log(table_name, record_id);
-CREATE INDEX idx_audit_log_business_date ON audit_log(business_id, created_at);
-CREATE INDEX idx_audit_log_user_date ON audit_log(changed_by, created_at);
-CREATE INDEX idx_audit_log_action_date ON audit_log(action, created_at);
+-- Every index ends in (created_at, id), the history API keyset (audit_history.py)
+CREATE INDEX idx_audit_log_date ON audit_log(created_at, id);
+CREATE INDEX idx_audit_log_table_record ON audit_log(table_name, record_id, created_at, id);
+CREATE INDEX idx_audit_log_table_date ON audit_log(table_name, created_at, id);
+CREATE INDEX idx_audit_log_business_date ON audit_log(business_id, created_at, id);
+CREATE INDEX idx_audit_log_user_date ON audit_log(changed_by, created_at, id);
+CREATE INDEX idx_audit_log_action_date ON audit_log(action, created_at, id);
+
+-- Hash Chain Head table (tip of each tamper-evident chain)
+CREATE TABLE hash_chain_head (
+    id BIGSERIAL PRIMARY KEY,
+    chain VARCHAR(50) NOT NULL UNIQUE,
+    last_hash VARCHAR(64) NOT NULL,
+    length BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Hash Chain Anchor table (daily copies of the chain heads)
+CREATE TABLE hash_chain_anchor (
+    id BIGSERIAL PRIMARY KEY,
+    chain VARCHAR(50) NOT NULL,
+    anchor_date DATE NOT NULL,
+    last_hash VARCHAR(64) NOT NULL,
+    length BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT unique_hash_chain_anchor UNIQUE (chain, anchor_date)
+);
 
 -- =============================================================================
 -- FUNCTIONS AND TRIGGERS
@@ -787,7 +996,7 @@ CREATE POLICY ledger_business_isolation ON ledger
 -- END OF SCHEMA
 -- =============================================================================
 
--- Total Tables: 32
+-- Total Tables: 44
 -- Total Indexes: 70+
 -- Total Views: 3
 -- Total Functions: 2
@@ -23,14 +23,15 @@ INSERT INTO account_type (id, name, code, type, normal_balance, description) VAL
 -- TRANSACTION TYPES
 -- =============================================================================
 
-INSERT INTO transaction_type (name, code, description, is_active) VALUES
-('Sale', 'SALE', 'Sales revenue from goods or services', TRUE),
-('Expense', 'EXP', 'Business expense payment', TRUE),
-('Deposit', 'DEP', 'Deposit cash or M-Pesa to bank account', TRUE),
-('Withdrawal', 'WD', 'Withdraw from bank or owner drawing', TRUE),
-('Transfer', 'TRF', 'Transfer between accounts', TRUE),
-('Adjustment', 'ADJ', 'Accounting adjustment (requires approval)', TRUE),
-('Payment Received', 'PAY', 'Payment received from customer', TRUE);
+INSERT INTO transaction_type (name, code, description, cashflow_activity, is_active) VALUES
+('Sale', 'SALE', 'Sales revenue from goods or services', 'operating', TRUE),
+('Expense', 'EXP', 'Business expense payment', 'operating', TRUE),
+('Deposit', 'DEP', 'Deposit cash or M-Pesa to bank account', 'transfer', TRUE),
+('Withdrawal', 'WD', 'Withdraw from bank or owner drawing', 'financing', TRUE),
+('Transfer', 'TRF', 'Transfer between accounts', 'transfer', TRUE),
+('Adjustment', 'ADJ', 'Accounting adjustment (requires approval)', 'operating', TRUE),
+('Payment Received', 'PAY', 'Payment received from customer', 'operating', TRUE),
+('Period Close', 'CLS', 'Month-end closing of revenue and expenses into retained earnings', 'operating', TRUE);
 
 -- =============================================================================
 -- BUSINESSES
@@ -68,7 +69,8 @@ INSERT INTO account (account_number, name, account_type_id, parent_account_id, b
 -- Accounts Payable (Shared)
 INSERT INTO account (account_number, name, account_type_id, parent_account_id, business_id, current_balance, is_active) VALUES
 ('2110', 'Accounts Payable', 2, NULL, NULL, 0.00, TRUE),
-('2120', 'M-Pesa Payable', 2, NULL, NULL, 0.00, TRUE);
+('2120', 'M-Pesa Payable', 2, NULL, NULL, 0.00, TRUE),
+('2130', 'VAT Payable', 2, NULL, NULL, 0.00, TRUE);
 
 -- =============================================================================
 -- CHART OF ACCOUNTS (Water Business)
@@ -210,6 +212,11 @@ INSERT INTO retail_product (name, product_code, category_id, description, unit_o
 ('Sugar 1kg', 'GRN001', 6, 'White sugar 1kg', 'packet', FALSE, TRUE),
 ('Maize Flour 2kg', 'GRN002', 6, 'Maize meal flour 2kg', 'packet', FALSE, TRUE);
 
+-- LPG refills (product code convention: LPG-<BRAND>-<CAPACITY>KG)
+INSERT INTO retail_product (name, product_code, category_id, description, unit_of_measure, is_lpg, is_active) VALUES
+('Shell Gas Refill 6kg', 'LPG-SHELL-6KG', 4, 'Shell LPG refill for 6kg cylinder', 'refill', TRUE, TRUE),
+('Shell Gas Refill 13kg', 'LPG-SHELL-13KG', 4, 'Shell LPG refill for 13kg cylinder', 'refill', TRUE, TRUE);
+
 -- =============================================================================
 -- RETAIL INVENTORY (Initial Stock)
 -- =============================================================================
@@ -220,7 +227,9 @@ INSERT INTO retail_inventory (business_id, product_id, quantity_in_stock, buying
 (3, 3, 50, 40.00, 60.00, 15),    -- Chips
 (3, 4, 60, 55.00, 70.00, 20),    -- Milk
 (3, 5, 40, 120.00, 150.00, 10),  -- Sugar
-(3, 6, 35, 130.00, 160.00, 10);  -- Maize Flour
+(3, 6, 35, 130.00, 160.00, 10),  -- Maize Flour
+(3, 7, 20, 950.00, 1200.00, 5),  -- Shell 6kg refill
+(3, 8, 10, 2300.00, 2800.00, 3); -- Shell 13kg refill
 
 -- =============================================================================
 -- LPG CYLINDERS (Initial Stock)
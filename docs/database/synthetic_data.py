@@ -0,0 +1,612 @@
+"""
+Synthetic Data Generator - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Realistic, reproducible trading histories for load and performance work.
+Copy into core/synthetic_data.py. Run against a database that has
+seed_data.sql loaded, never against production:
+
+    from synthetic_data import generate_history
+    generate_history(date(2024, 1, 1), days=730, seed=42)
+
+For every day it produces:
+- water production runs and sales
+- laundry jobs with items, their status moved along by age (old jobs
+  collected, a few left uncollected for the overdue sweeper)
+- retail sales with items
+- LPG exchanges that circulate a cylinder pool, with refills and events
+- one posted journal entry (with ledger rows) per sale, job and exchange
+
+Water production and sales, retail deliveries and retail sales go
+through their services (water_services, retail_services), so stock moves
+and every sale is costed from the cost layers the way live sales are.
+Production is sized to cover the day's water sales, empty containers are
+topped up directly, and retail stock is delivered at a drifting cost
+whenever the day's sales would run it short. Laundry jobs and LPG
+exchanges are bulk-loaded with their journal entries posted in one
+post_journal_entries() call per day. Each day is one transaction.
+
+The same seed, start date and volumes always produce the same data, so
+every performance feature can be measured against the same dataset.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import logging
+import random
+import string
+from collections import defaultdict
+from datetime import time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, When
+from decimal import Decimal
+
+from django_models import (
+    Business,
+    Customer,
+    LaundryCustomer,
+    LaundryJob,
+    LaundryJobItem,
+    LaundryServiceType,
+    InventoryCostLayer,
+    RetailInventory,
+    RetailLPGCylinder,
+    RetailLPGCylinderEvent,
+    RetailLPGExchange,
+    TransactionType,
+    WaterInventory,
+    WaterProductSize,
+)
+from costing import load_opening_layers
+from laundry_services import price_job_item
+from ledger_posting import cogs_lines, get_accounts, post_journal_entries, sale_lines
+from lpg_services import lpg_product_code, rebuild_fleet_summary
+from retail_services import receive_retail_stock, record_retail_sales
+from tax import get_tax_rate, split_inclusive, tax_exclusive
+from water_services import record_production_runs, record_water_sales
+
+
+logger = logging.getLogger(__name__)
+
+# Average rows per weekday; weekends are WEEKEND_FACTOR busier
+DEFAULT_VOLUMES = {
+    'water_production_runs': 3,
+    'water_sales': 80,
+    'laundry_jobs': 15,
+    'retail_sales': 60,
+    'lpg_exchanges': 6,
+}
+WEEKEND_FACTOR = 1.3
+
+# Units delivered on top of what the day's retail sales need
+RESTOCK_UNITS = 100
+# Delivered unit cost relative to the seeded buying price
+COST_DRIFT = (0.95, 1.08)
+
+DEFAULT_CUSTOMERS = 500
+DEFAULT_CYLINDERS = 120
+
+PAYMENT_METHODS = ['cash', 'm_pesa', 'bank']
+PAYMENT_WEIGHTS = [45, 50, 5]
+
+# Share of water/retail/LPG sales made to a registered customer
+NAMED_CUSTOMER_SHARE = 0.3
+
+# Water size popularity, in WaterProductSize name order of seed_data.sql
+WATER_SIZE_WEIGHTS = {'500ml': 30, '1 Litre': 25, '5 Litres': 20, '10 Litres': 10, '20 Litres': 15}
+
+FIRST_NAMES = [
+    'John', 'Mary', 'Peter', 'Grace', 'James', 'Faith', 'David', 'Esther',
+    'Joseph', 'Mercy', 'Daniel', 'Ann', 'Samuel', 'Joyce', 'Brian', 'Purity',
+]
+LAST_NAMES = [
+    'Kamau', 'Wanjiku', 'Omondi', 'Njeri', 'Otieno', 'Mwangi', 'Achieng',
+    'Kiprono', 'Wambui', 'Mutua', 'Chebet', 'Odhiambo', 'Njoroge', 'Auma',
+]
+
+# Synthetic rows are recognisable by these prefixes
+PHONE_PREFIX = '+254799'
+LAUNDRY_CODE_PREFIX = 'SYN'
+CYLINDER_SERIAL_PREFIX = 'SYN-'
+
+LAUNDRY_ITEM_NAMES = ['Shirts', 'Trousers', 'Dresses', 'Bedsheets', 'Towels', 'Curtains', 'Jackets']
+
+
+def _scaled(rng, average, weekend):
+    """Day-to-day variation around an average volume."""
+    if weekend:
+        average *= WEEKEND_FACTOR
+    return max(0, round(rng.gauss(average, average * 0.2)))
+
+
+def _payment(rng):
+    method = rng.choices(PAYMENT_METHODS, PAYMENT_WEIGHTS)[0]
+    reference = ''
+    if method == 'm_pesa':
+        reference = ''.join(rng.choices(string.ascii_uppercase + string.digits, k=10))
+    return method, reference
+
+
+def _sale_time(rng):
+    return time(rng.randint(7, 19), rng.randint(0, 59), rng.randint(0, 59))
+
+
+def _next_sequence(model, field, prefix):
+    """Next free XX-YYYYMMDD-NNNN sequence number for a day."""
+    last = model.objects.filter(
+        **{f'{field}__startswith': prefix}
+    ).order_by(f'-{field}').values_list(field, flat=True).first()
+    return int(last.split('-')[-1]) + 1 if last else 1
+
+
+def _ensure_customers(rng, count):
+    """Create (or reuse) the synthetic customer pool; about a third get laundry profiles."""
+    Customer.objects.bulk_create(
+        [
+            Customer(
+                name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                phone_number=f"{PHONE_PREFIX}{number:06d}",
+                customer_type='business' if number % 25 == 0 else 'individual',
+            )
+            for number in range(count)
+        ],
+        ignore_conflicts=True,
+    )
+    customers = list(
+        Customer.objects.filter(phone_number__startswith=PHONE_PREFIX).order_by('id')
+    )
+    LaundryCustomer.objects.bulk_create(
+        [
+            LaundryCustomer(
+                customer=customer,
+                customer_code=f"{LAUNDRY_CODE_PREFIX}{index:05d}",
+                credit_limit=Decimal('5000.00'),
+            )
+            for index, customer in enumerate(customers)
+            if index % 3 == 0
+        ],
+        ignore_conflicts=True,
+    )
+    laundry_customers = list(
+        LaundryCustomer.objects.filter(customer_code__startswith=LAUNDRY_CODE_PREFIX)
+        .select_related('customer').order_by('id')
+    )
+    return customers, laundry_customers
+
+
+def _ensure_cylinders(rng, business, count, start_date):
+    """Create the synthetic cylinder pool for the LPG refills that exist in stock."""
+    refills = set(
+        RetailInventory.objects.filter(business=business, product__is_lpg=True)
+        .values_list('product__product_code', flat=True)
+    )
+    sizes = [
+        (brand, capacity)
+        for brand, capacity in (('Shell', Decimal('6.00')), ('Shell', Decimal('13.00')))
+        if lpg_product_code(brand, capacity) in refills
+    ]
+    if not sizes:
+        return []
+    RetailLPGCylinder.objects.bulk_create(
+        [
+            RetailLPGCylinder(
+                business=business,
+                brand=brand,
+                capacity_kg=capacity,
+                serial_number=f"{CYLINDER_SERIAL_PREFIX}{brand[:2].upper()}{capacity:.0f}-{number:05d}",
+                status='full' if rng.random() < 0.6 else 'customer',
+                purchase_date=start_date,
+                current_location='Shop',
+            )
+            for number in range(count)
+            for brand, capacity in [sizes[number % len(sizes)]]
+        ],
+        ignore_conflicts=True,
+    )
+    return list(
+        RetailLPGCylinder.objects.filter(
+            business=business, serial_number__startswith=CYLINDER_SERIAL_PREFIX
+        ).order_by('id')
+    )
+
+
+def _load_reference(user):
+    businesses = {business.code: business for business in Business.objects.filter(code__in=['WTR', 'LND', 'RTL'])}
+    water, laundry, retail = businesses['WTR'], businesses['LND'], businesses['RTL']
+    sizes = list(WaterProductSize.objects.filter(is_active=True).order_by('id'))
+    stock = list(
+        RetailInventory.objects.filter(business=retail).select_related('product')
+    )
+    return {
+        'user': user,
+        'sale_type': TransactionType.objects.get(code='SALE'),
+        'water': water,
+        'laundry': laundry,
+        'retail': retail,
+        'laundry_accounts': get_accounts(laundry, *PAYMENT_METHODS, 'revenue', 'vat_payable'),
+        'retail_accounts': get_accounts(
+            retail, *PAYMENT_METHODS, 'revenue', 'lpg_revenue', 'vat_payable', 'cogs', 'inventory'
+        ),
+        'tax_rates': {code: get_tax_rate(business) for code, business in businesses.items()},
+        'water_sizes': sizes,
+        'water_weights': [WATER_SIZE_WEIGHTS.get(size.name, 10) for size in sizes],
+        'service_types': list(LaundryServiceType.objects.filter(is_active=True).order_by('id')),
+        'retail_stock': [row for row in stock if not row.product.is_lpg],
+        'lpg_stock': {row.product.product_code: row for row in stock if row.product.is_lpg},
+    }
+
+
+def _journal(ref, business, day, description, lines):
+    return {
+        'business': business,
+        'transaction_type': ref['sale_type'],
+        'transaction_date': day,
+        'description': description,
+        'created_by': ref['user'],
+        'lines': lines,
+    }
+
+
+def _water_day(ref, rng, day, weekend, volumes, customers):
+    business = ref['water']
+
+    sales = []
+    demand = defaultdict(int)
+    for _ in range(_scaled(rng, volumes['water_sales'], weekend)):
+        size = rng.choices(ref['water_sizes'], ref['water_weights'])[0]
+        quantity = rng.randint(1, 24) if size.volume_ml <= 1000 else rng.randint(1, 3)
+        method, reference = _payment(rng)
+        sales.append({
+            'product_size_id': size.id,
+            'quantity_sold': quantity,
+            'unit_price': size.default_price,
+            'payment_method': method,
+            'm_pesa_transaction_id': reference,
+            'customer': rng.choice(customers) if rng.random() < NAMED_CUSTOMER_SHARE else None,
+            'sale_time': _sale_time(rng),
+        })
+        demand[size.id] += quantity
+
+    produced = defaultdict(int)
+    for _ in range(_scaled(rng, volumes['water_production_runs'], weekend)):
+        size = rng.choices(ref['water_sizes'], ref['water_weights'])[0]
+        produced[size.id] += rng.randint(50, 300)
+    # Extra runs so the day's sales never run out of filled stock
+    filled = dict(
+        WaterInventory.objects.filter(business=business, inventory_type='filled')
+        .values_list('product_size_id', 'quantity')
+    )
+    runs = [(size_id, quantity) for size_id, quantity in produced.items()]
+    for size_id, quantity in demand.items():
+        shortfall = quantity - filled.get(size_id, 0) - produced[size_id]
+        if shortfall > 0:
+            runs.append((size_id, shortfall + rng.randint(50, 300)))
+    runs = [
+        {
+            'product_size_id': size_id,
+            'quantity_produced': quantity,
+            'production_cost': (quantity * Decimal(rng.uniform(1, 3))).quantize(Decimal('0.01')),
+        }
+        for size_id, quantity in runs
+    ]
+
+    if runs:
+        # Container purchases are not modelled; the empties arrive as needed
+        containers = defaultdict(int)
+        for run in runs:
+            containers[run['product_size_id']] += run['quantity_produced']
+        WaterInventory.objects.filter(
+            business=business, inventory_type='empty', product_size_id__in=containers
+        ).update(quantity=Case(
+            *[When(product_size_id=size_id, then=F('quantity') + quantity) for size_id, quantity in containers.items()],
+            output_field=IntegerField(),
+        ))
+        record_production_runs(business, runs, day, ref['user'])
+    record_water_sales(business, sales, day, ref['user'])
+    return {'water_production_runs': len(runs), 'water_sales': len(sales)}
+
+
+def _laundry_status(rng, age):
+    """Where a job received ``age`` days before the end of the history would be now."""
+    if age == 0:
+        return rng.choice(['received', 'washing'])
+    if age == 1:
+        return rng.choice(['washing', 'drying'])
+    if age == 2:
+        return rng.choice(['drying', 'ready'])
+    roll = rng.random()
+    if roll < 0.01:
+        return 'cancelled'
+    if roll < 0.93:
+        return 'collected'
+    return 'ready'
+
+
+def _laundry_day(ref, rng, day, end_date, weekend, volumes, laundry_customers, journals):
+    business = ref['laundry']
+    accounts = ref['laundry_accounts']
+    rate = ref['tax_rates']['LND']
+    date_str = day.strftime('%Y%m%d')
+    sequence = _next_sequence(LaundryJob, 'job_number', f'LJ-{date_str}')
+
+    jobs, job_items = [], []
+    for number in range(sequence, sequence + _scaled(rng, volumes['laundry_jobs'], weekend)):
+        items = []
+        for _ in range(rng.randint(1, 5)):
+            service_type = rng.choice(ref['service_types'])
+            weight = None
+            if service_type.pricing_type == 'per_kg':
+                weight = Decimal(rng.uniform(2, 10)).quantize(Decimal('0.1'))
+            quantity = rng.randint(1, 2) if service_type.pricing_type == 'per_bundle' else rng.randint(1, 6)
+            unit_price, line_total = price_job_item(service_type, quantity, weight_kg=weight)
+            items.append(LaundryJobItem(
+                service_type=service_type,
+                item_description=rng.choice(LAUNDRY_ITEM_NAMES),
+                quantity=quantity,
+                unit_price=unit_price,
+                line_total=line_total,
+            ))
+        subtotal = sum((item.line_total for item in items), Decimal('0.00'))
+        tax = tax_exclusive(subtotal, rate)
+        total = subtotal + tax
+
+        status = _laundry_status(rng, (end_date - day).days)
+        completed = day + timedelta(days=2) if status in ('ready', 'collected') else None
+        collected = None
+        if status == 'collected':
+            collected = min(completed + timedelta(days=rng.randint(0, 3)), end_date)
+        paid = total if status == 'collected' or rng.random() < 0.8 else Decimal('0.00')
+
+        jobs.append(LaundryJob(
+            business=business,
+            customer=rng.choice(laundry_customers),
+            job_number=f'LJ-{date_str}-{number:04d}',
+            status=status,
+            received_date=day,
+            received_time=_sale_time(rng),
+            expected_completion_date=day + timedelta(days=2),
+            actual_completion_date=completed,
+            collected_date=collected,
+            subtotal_amount=subtotal,
+            tax_rate=rate,
+            tax_amount=tax,
+            total_amount=total,
+            amount_paid=paid,
+            balance_due=total - paid,
+            received_by=ref['user'],
+        ))
+        job_items.append(items)
+
+    LaundryJob.objects.bulk_create(jobs)
+    for job, items in zip(jobs, job_items):
+        for item in items:
+            item.job = job
+    LaundryJobItem.objects.bulk_create([item for items in job_items for item in items])
+
+    for job in jobs:
+        if not job.amount_paid or job.status == 'cancelled':
+            continue
+        method, _ = _payment(rng)
+        # Paid jobs are posted on the drop-off date
+        description = f"Laundry job {job.job_number}"
+        journals.append((job, _journal(
+            ref, business, day, description,
+            sale_lines(accounts, method, 'revenue', job.amount_paid, description, job.tax_amount),
+        )))
+    return {'laundry_jobs': len(jobs), 'laundry_job_items': sum(map(len, job_items))}
+
+
+def _restock(ref, rng, day, demand):
+    """Deliver every product the day's sales would take below its reorder level."""
+    in_stock = dict(
+        RetailInventory.objects.filter(business=ref['retail'], product_id__in=list(demand))
+        .values_list('product_id', 'quantity_in_stock')
+    )
+    receipts = []
+    for stock in ref['retail_stock']:
+        needed = demand.get(stock.product_id, 0) + stock.reorder_level - in_stock.get(stock.product_id, 0)
+        if needed > 0:
+            receipts.append({
+                'product_id': stock.product_id,
+                'quantity': needed + RESTOCK_UNITS,
+                'unit_cost': (stock.buying_price * Decimal(rng.uniform(*COST_DRIFT))).quantize(Decimal('0.01')),
+            })
+    receive_retail_stock(ref['retail'], receipts, day)
+    return len(receipts)
+
+
+def _retail_day(ref, rng, day, weekend, volumes, customers):
+    sales = []
+    demand = defaultdict(int)
+    for _ in range(_scaled(rng, volumes['retail_sales'], weekend)):
+        items = []
+        for stock in rng.sample(ref['retail_stock'], k=min(len(ref['retail_stock']), rng.randint(1, 4))):
+            quantity = rng.randint(1, 3)
+            items.append({'product_id': stock.product_id, 'quantity': quantity})
+            demand[stock.product_id] += quantity
+        method, reference = _payment(rng)
+        sales.append({
+            'items': items,
+            'payment_method': method,
+            'm_pesa_transaction_id': reference,
+            'customer': rng.choice(customers) if rng.random() < NAMED_CUSTOMER_SHARE else None,
+            'sale_time': _sale_time(rng),
+        })
+
+    deliveries = _restock(ref, rng, day, demand)
+    record_retail_sales(ref['retail'], sales, day, ref['user'])
+    return {
+        'retail_deliveries': deliveries,
+        'retail_sales': len(sales),
+        'retail_sale_items': sum(len(sale['items']) for sale in sales),
+    }
+
+
+def _lpg_day(ref, rng, day, weekend, volumes, customers, pool, journals):
+    """Circulate the cylinder pool: exchanges during the day, refills at closing."""
+    business = ref['retail']
+    accounts = ref['retail_accounts']
+    rate = ref['tax_rates']['RTL']
+
+    exchanges, events = [], []
+    for _ in range(_scaled(rng, volumes['lpg_exchanges'], weekend)):
+        if not pool['full']:
+            break
+        full = pool['full'].pop(rng.randrange(len(pool['full'])))
+        refill = ref['lpg_stock'][lpg_product_code(full.brand, full.capacity_kg)]
+        same_size = [
+            index for index, cylinder in enumerate(pool['customer'])
+            if cylinder.capacity_kg == full.capacity_kg
+        ]
+        empty = None
+        if same_size and rng.random() < 0.9:
+            empty = pool['customer'].pop(rng.choice(same_size))
+
+        price_per_kg = (refill.selling_price / full.capacity_kg).quantize(Decimal('0.01'))
+        total = (full.capacity_kg * price_per_kg).quantize(Decimal('0.01'))
+        net, tax = split_inclusive(total, rate)
+        method, reference = _payment(rng)
+        customer = rng.choice(customers) if rng.random() < NAMED_CUSTOMER_SHARE else None
+        exchanges.append(RetailLPGExchange(
+            business=business,
+            customer=customer,
+            full_cylinder=full,
+            empty_cylinder=empty,
+            capacity_kg=full.capacity_kg,
+            price_per_kg=price_per_kg,
+            total_amount=total,
+            cost_amount=refill.buying_price,
+            tax_rate=rate,
+            net_amount=net,
+            tax_amount=tax,
+            payment_method=method,
+            m_pesa_transaction_id=reference,
+            exchange_date=day,
+            exchange_time=_sale_time(rng),
+            recorded_by=ref['user'],
+        ))
+        full.status = 'customer'
+        full.current_location = customer.name if customer else 'Walk-in customer'
+        full.last_exchange_date = day
+        pool['customer'].append(full)
+        pool['touched'][full.id] = full
+        if empty is not None:
+            empty.status = 'empty'
+            empty.current_location = 'Shop'
+            empty.last_exchange_date = day
+            pool['empty'].append(empty)
+            pool['touched'][empty.id] = empty
+
+    RetailLPGExchange.objects.bulk_create(exchanges)
+    for exchange in exchanges:
+        events.append(RetailLPGCylinderEvent(
+            cylinder=exchange.full_cylinder, business=business, event_type='issued',
+            from_status='full', to_status='customer', exchange=exchange,
+            customer=exchange.customer, event_date=day,
+        ))
+        if exchange.empty_cylinder is not None:
+            events.append(RetailLPGCylinderEvent(
+                cylinder=exchange.empty_cylinder, business=business, event_type='returned',
+                from_status='customer', to_status='empty', exchange=exchange,
+                customer=exchange.customer, event_date=day,
+            ))
+        description = (
+            f"LPG exchange {exchange.full_cylinder.brand} {exchange.capacity_kg}kg "
+            f"({exchange.full_cylinder.serial_number})"
+        )
+        lines = sale_lines(
+            accounts, exchange.payment_method, 'lpg_revenue', exchange.total_amount,
+            description, exchange.tax_amount,
+        )
+        lines += cogs_lines(accounts, exchange.cost_amount, description)
+        journals.append((exchange, _journal(ref, business, day, description, lines)))
+
+    # Empties go out for refilling and come back full the same evening
+    for cylinder in pool['empty']:
+        cylinder.status = 'full'
+        pool['full'].append(cylinder)
+        pool['touched'][cylinder.id] = cylinder
+        events.append(RetailLPGCylinderEvent(
+            cylinder=cylinder, business=business, event_type='refilled',
+            from_status='empty', to_status='full', event_date=day,
+        ))
+    pool['empty'] = []
+    RetailLPGCylinderEvent.objects.bulk_create(events)
+    return {'lpg_exchanges': len(exchanges), 'lpg_cylinder_events': len(events)}
+
+
+def _post_journals(journals):
+    """Post the day's entries in one batch and link each to its source row."""
+    if not journals:
+        return 0
+    headers = post_journal_entries([spec for _, spec in journals])
+    linked = defaultdict(list)
+    for (row, _), header in zip(journals, headers):
+        row.journal_entry = header
+        linked[type(row)].append(row)
+    for model, rows in linked.items():
+        model.objects.bulk_update(rows, ['journal_entry'], batch_size=1000)
+    return len(headers)
+
+
+def generate_history(start_date, days, volumes=None, seed=42, user=None,
+                     customers=DEFAULT_CUSTOMERS, cylinders=DEFAULT_CYLINDERS):
+    """
+    Generate ``days`` days of trading starting at ``start_date``.
+
+    ``volumes`` overrides entries of DEFAULT_VOLUMES (average rows per
+    weekday). ``user`` records the rows; defaults to the first superuser.
+    Returns row counts per table.
+    """
+    rng = random.Random(seed)
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    if user is None:
+        user = get_user_model().objects.filter(is_superuser=True).order_by('id').first()
+
+    ref = _load_reference(user)
+    # The seeded stock becomes the first cost layers
+    for business in (ref['water'], ref['retail']):
+        if not InventoryCostLayer.objects.filter(business=business).exists():
+            load_opening_layers(business, start_date)
+    customer_pool, laundry_pool = _ensure_customers(rng, customers)
+    cylinder_pool = _ensure_cylinders(rng, ref['retail'], cylinders, start_date)
+    pool = {
+        'full': [cylinder for cylinder in cylinder_pool if cylinder.status == 'full'],
+        'customer': [cylinder for cylinder in cylinder_pool if cylinder.status == 'customer'],
+        'empty': [cylinder for cylinder in cylinder_pool if cylinder.status == 'empty'],
+        'touched': {},
+    }
+
+    end_date = start_date + timedelta(days=days - 1)
+    totals = defaultdict(int)
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        weekend = day.weekday() >= 5
+        journals = []
+        with transaction.atomic():
+            counts = {}
+            counts.update(_water_day(ref, rng, day, weekend, volumes, customer_pool))
+            counts.update(_laundry_day(ref, rng, day, end_date, weekend, volumes, laundry_pool, journals))
+            counts.update(_retail_day(ref, rng, day, weekend, volumes, customer_pool))
+            if cylinder_pool:
+                counts.update(_lpg_day(ref, rng, day, weekend, volumes, customer_pool, pool, journals))
+            # Water and retail sales post their own entries, one per sale
+            counts['journal_entries'] = (
+                counts['water_sales'] + counts['retail_sales'] + _post_journals(journals)
+            )
+        for table, count in counts.items():
+            totals[table] += count
+        if offset % 30 == 29 or offset == days - 1:
+            logger.info("Synthetic data: %s done (%d/%d days)", day, offset + 1, days)
+
+    with transaction.atomic():
+        RetailLPGCylinder.objects.bulk_update(
+            pool['touched'].values(),
+            ['status', 'current_location', 'last_exchange_date'],
+            batch_size=1000,
+        )
+        rebuild_fleet_summary(ref['retail'])
+    return dict(totals)
@@ -0,0 +1,301 @@
+"""
+Deferred Side Effects - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+Task Queue: Django-RQ + RQ-Scheduler (DEC-P04)
+
+Runs the secondary effects of a sale after commit instead of inside
+save(). Copy into core/task_queue.py and import it from an
+AppConfig.ready() (it connects the audit signals).
+
+What runs where
+---------------
+Inline, in the service transaction: anything that must hold at commit -
+inventory decrements, the journal entry and ledger rows, customer
+balances and credit limits.
+
+Deferred, with defer(): audit log entries, aggregates, notifications.
+defer() writes a DeferredTask row in the caller's transaction (an
+outbox) and enqueues it on commit, so:
+- nothing is enqueued for a rolled-back sale
+- a task is not lost if Redis is down at commit; requeue_stale() picks up
+  pending rows the queue has not run STALE_AFTER past their
+  next_attempt_at
+- the idempotency key makes a second defer() with the same key a no-op,
+  and a task runs at most once even if the job is delivered twice
+
+Retries and dead letters
+------------------------
+A failing task is retried with backoff (RETRY_DELAYS) through
+RQ-Scheduler; next_attempt_at records when the retry is due, so the
+stale sweep leaves a task alone while it waits out its backoff. After
+MAX_ATTEMPTS it is marked 'dead' and kept with its traceback;
+dead_letter_view lists dead tasks and requeues them on POST.
+
+Tests
+-----
+django-rq runs jobs in-process when the queue is synchronous, so no Redis
+is needed:
+
+    RQ_QUEUES = {'default': {'ASYNC': False}, 'notifications': {'ASYNC': False}}
+
+Tasks then run at commit (use TestCase.captureOnCommitCallbacks).
+
+LAST UPDATED: 2026-10-19
+"""
+
+import json
+import logging
+import traceback
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+import django_rq
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponseForbidden, JsonResponse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from django_models import (
+    DeferredTask,
+    LaundryJob,
+    RetailLPGExchange,
+    RetailSale,
+    WaterSale,
+)
+from audit_history import write_audit_entries
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# Delay before retry n (the last one repeats)
+RETRY_DELAYS = (timedelta(seconds=10), timedelta(minutes=1), timedelta(minutes=5), timedelta(minutes=30))
+STALE_AFTER = timedelta(minutes=10)
+DEAD_LETTER_PAGE = 100
+
+
+def _task_path(func):
+    return func if isinstance(func, str) else f'{func.__module__}.{func.__qualname__}'
+
+
+def _json_safe(value):
+    """Round-trip through the Django encoder (dates, Decimals, UUIDs -> strings)."""
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def defer(func, *args, key=None, queue='default', business_id=None):
+    """
+    Run ``func(*args)`` after the current transaction commits.
+
+    ``func`` is a module-level function or its dotted path; ``args`` must
+    be JSON-serializable (dates and Decimals arrive as strings). Returns
+    the DeferredTask, or the existing one if ``key`` was already used.
+    """
+    fields = {
+        'task': _task_path(func),
+        'args': _json_safe(list(args)),
+        'queue': queue,
+        'business_id': business_id,
+    }
+    if key is None:
+        # Nothing to deduplicate against: a single INSERT
+        task = DeferredTask.objects.create(key=f'{fields["task"]}:{uuid.uuid4().hex}', **fields)
+    else:
+        task, created = DeferredTask.objects.get_or_create(key=key, defaults=fields)
+        if not created:
+            return task
+    transaction.on_commit(lambda: _enqueue(task))
+    return task
+
+
+def _enqueue(task, delay=None):
+    try:
+        if delay:
+            django_rq.get_scheduler(task.queue).enqueue_in(delay, run_deferred, task.id)
+        else:
+            django_rq.get_queue(task.queue).enqueue(run_deferred, task.id)
+    except Exception:
+        # The row stays pending; requeue_stale() retries the enqueue
+        logger.exception("Could not enqueue deferred task %s", task.id)
+
+
+@django_rq.job('default')
+def run_deferred(task_id):
+    """
+    Run one deferred task, at most once.
+
+    The row is locked while the task runs and marked done in the same
+    transaction, so the database effects of a task and its completion
+    commit together; a duplicate delivery finds it done (or locked) and
+    returns.
+    """
+    with transaction.atomic():
+        task = (
+            DeferredTask.objects.select_for_update(skip_locked=True)
+            .filter(id=task_id, status='pending')
+            .first()
+        )
+        if task is None:
+            return None
+
+        task.attempts += 1
+        try:
+            with transaction.atomic():
+                import_string(task.task)(*task.args)
+        except Exception:
+            task.last_error = traceback.format_exc()[-4000:]
+            if task.attempts >= MAX_ATTEMPTS:
+                task.status = 'dead'
+                logger.error("Deferred task %s (%s) is dead after %d attempts", task.id, task.task, task.attempts)
+            else:
+                delay = RETRY_DELAYS[min(task.attempts, len(RETRY_DELAYS)) - 1]
+                task.next_attempt_at = timezone.now() + delay
+                transaction.on_commit(lambda: _enqueue(task, delay))
+            task.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+            return task.status
+
+        task.status = 'done'
+        task.completed_at = timezone.now()
+        task.save(update_fields=['attempts', 'status', 'completed_at'])
+        return task.status
+
+
+@django_rq.job('default')
+def requeue_stale():
+    """Enqueue pending tasks overdue by STALE_AFTER (enqueue failed or job lost)."""
+    stale = list(
+        DeferredTask.objects.filter(
+            status='pending', next_attempt_at__lt=timezone.now() - STALE_AFTER
+        ).order_by('next_attempt_at')[:1000]
+    )
+    for task in stale:
+        _enqueue(task)
+    return len(stale)
+
+
+def schedule_requeue(cron_string='*/10 * * * *'):
+    """Register the stale-task sweep with RQ-Scheduler (call once at deploy)."""
+    scheduler = django_rq.get_scheduler('default')
+    for scheduled in scheduler.get_jobs():
+        if scheduled.func_name.endswith('requeue_stale'):
+            scheduler.cancel(scheduled)
+    return scheduler.cron(cron_string, func=requeue_stale, queue_name='default')
+
+
+def requeue_dead(task_ids):
+    """Give dead tasks a fresh set of attempts."""
+    with transaction.atomic():
+        tasks = list(DeferredTask.objects.select_for_update().filter(id__in=task_ids, status='dead'))
+        DeferredTask.objects.filter(id__in=[task.id for task in tasks]).update(
+            status='pending', attempts=0, next_attempt_at=timezone.now()
+        )
+        for task in tasks:
+            transaction.on_commit(lambda task=task: _enqueue(task))
+    return len(tasks)
+
+
+def dead_letter_view(request):
+    """
+    Staff view of dead tasks: GET lists them, POST with ``ids`` (comma
+    separated) requeues them.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    if request.method == 'POST':
+        ids = [int(value) for value in request.POST.get('ids', '').split(',') if value.strip().isdigit()]
+        return JsonResponse({'requeued': requeue_dead(ids)})
+
+    tasks = DeferredTask.objects.filter(status='dead').order_by('-created_at')[:DEAD_LETTER_PAGE]
+    return JsonResponse({'tasks': [
+        {
+            'id': task.id,
+            'task': task.task,
+            'key': task.key,
+            'business_id': task.business_id,
+            'attempts': task.attempts,
+            'created_at': task.created_at,
+            'error': task.last_error.strip().splitlines()[-1] if task.last_error else '',
+        }
+        for task in tasks
+    ]}, encoder=DjangoJSONEncoder)
+
+
+# -----------------------------------------------------------------------------
+# Deferred audit logging
+# -----------------------------------------------------------------------------
+
+# Audited model -> field holding the user who recorded it
+AUDITED_MODELS = {
+    WaterSale: 'recorded_by_id',
+    RetailSale: 'recorded_by_id',
+    RetailLPGExchange: 'recorded_by_id',
+    LaundryJob: 'received_by_id',
+}
+
+
+def write_audit_log(table_name, record_id, action, data, changed_by_id, business_id):
+    # Stored as a diff against the record's last audited state (audit_history.py)
+    write_audit_entries([{
+        'table_name': table_name,
+        'record_id': record_id,
+        'action': action,
+        'data': data,
+        'changed_by_id': changed_by_id,
+        'business_id': business_id,
+    }])
+
+
+def audit_data(instance):
+    """The full state of an audited record, as stored in its audit rows."""
+    return {field.attname: field.value_from_object(instance) for field in type(instance)._meta.concrete_fields}
+
+
+def _audit(sender, instance, action):
+    data = audit_data(instance)
+    defer(
+        write_audit_log,
+        sender._meta.db_table, instance.pk, action, data,
+        getattr(instance, AUDITED_MODELS[sender]), instance.business_id,
+        business_id=instance.business_id,
+    )
+
+
+def audit_created(model, instances):
+    """
+    Audit bulk-created rows of an audited model, one deferred write per business.
+
+    bulk_create() sends no post_save. Services that send it themselves
+    for the cache and realtime handlers call this first and pass
+    ``audited=True``, so a batch costs one task instead of one per row.
+    """
+    entries = defaultdict(list)
+    for instance in instances:
+        entries[instance.business_id].append({
+            'table_name': model._meta.db_table,
+            'record_id': instance.pk,
+            'action': 'create',
+            'data': audit_data(instance),
+            'changed_by_id': getattr(instance, AUDITED_MODELS[model]),
+            'business_id': instance.business_id,
+        })
+    for business_id in sorted(entries):
+        defer(write_audit_entries, entries[business_id], business_id=business_id)
+
+
+def _audit_saved(sender, instance, created, audited=False, **kwargs):
+    if audited:
+        return
+    _audit(sender, instance, 'create' if created else 'update')
+
+
+def _audit_deleted(sender, instance, **kwargs):
+    _audit(sender, instance, 'delete')
+
+
+for _model in AUDITED_MODELS:
+    post_save.connect(_audit_saved, sender=_model, dispatch_uid=f'audit_save_{_model._meta.db_table}')
+    post_delete.connect(_audit_deleted, sender=_model, dispatch_uid=f'audit_delete_{_model._meta.db_table}')
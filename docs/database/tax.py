@@ -0,0 +1,217 @@
+"""
+VAT Engine - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+VAT computation at write time and the monthly KRA VAT return. Copy into
+financial/tax.py.
+
+Every sale line stores tax_rate, net_amount and tax_amount when it is
+written, using the business's BusinessSettings.tax_rate:
+- water, retail and LPG prices are VAT-inclusive, so VAT is extracted
+  from the gross amount (after any discount: a retail sale's discount is
+  spread over its lines first)
+- laundry jobs are priced before VAT, so VAT is added on top
+  (see laundry_services.create_laundry_job)
+
+The VAT return is produced in a single streaming pass over one
+UNION ALL query through a server-side cursor, so memory use stays
+constant whatever the number of lines.
+
+LAST UPDATED: 2026-10-19
+"""
+
+import calendar
+import csv
+from collections import defaultdict
+from datetime import date
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from decimal import Decimal, ROUND_HALF_UP
+
+from db_routing import reporting_alias
+from django_models import BusinessSettings
+
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+STREAM_CHUNK_SIZE = 2000
+
+
+def _money(value):
+    """Round a Decimal to shillings and cents."""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_tax_rate(business):
+    """Return the business VAT rate in percent (falls back to the model default)."""
+    tax_rate = BusinessSettings.objects.filter(
+        business=business
+    ).values_list('tax_rate', flat=True).first()
+    if tax_rate is None:
+        tax_rate = BusinessSettings._meta.get_field('tax_rate').default
+    return tax_rate
+
+
+def split_inclusive(gross, tax_rate):
+    """Split a VAT-inclusive amount into (net, tax)."""
+    gross = _money(gross)
+    net = _money(gross * HUNDRED / (HUNDRED + tax_rate))
+    return net, gross - net
+
+
+def tax_exclusive(net, tax_rate):
+    """VAT to add on top of a net amount."""
+    return _money(net * tax_rate / HUNDRED)
+
+
+def apply_retail_sale_tax(sale, items, tax_rate=None):
+    """
+    Set VAT on the lines of a retail sale and on its header.
+
+    Call in the sale transaction, before the sale and its lines are
+    inserted. The header discount is spread over the lines in proportion
+    to their totals (the last line takes the rounding), and VAT is
+    extracted from each line's discounted amount. Returns the sale's VAT.
+    """
+    if tax_rate is None:
+        tax_rate = get_tax_rate(sale.business)
+    subtotal = sum((item.line_total for item in items), Decimal('0.00'))
+    discount = _money(sale.discount_amount or 0)
+    undistributed = discount
+    total_tax = Decimal('0.00')
+    for index, item in enumerate(items):
+        if index == len(items) - 1:
+            share = undistributed
+        else:
+            share = _money(discount * item.line_total / subtotal) if subtotal else Decimal('0.00')
+            undistributed -= share
+        item.tax_rate = tax_rate
+        item.net_amount, item.tax_amount = split_inclusive(item.line_total - share, tax_rate)
+        total_tax += item.tax_amount
+    sale.tax_amount = total_tax
+    return total_tax
+
+
+def apply_water_sale_tax(business, sales, tax_rate=None):
+    """Set VAT on a batch of water sales before they are inserted."""
+    if tax_rate is None:
+        tax_rate = get_tax_rate(business)
+    for sale in sales:
+        sale.tax_rate = tax_rate
+        sale.net_amount, sale.tax_amount = split_inclusive(sale.total_amount, tax_rate)
+    return sales
+
+
+# One row per taxable line, in date order, across all sales tables.
+# Reversed sales and cancelled laundry jobs are left out, as in the
+# sales rollups and gross_margin().
+# Columns: invoice_date, invoice_number, customer_name, customer_pin,
+#          description, tax_rate, net_amount, tax_amount
+VAT_LINES_SQL = """
+    SELECT ws.sale_date, 'WS-' || ws.id, c.name, c.kra_pin,
+           'Water ' || wps.name, ws.tax_rate, ws.net_amount, ws.tax_amount
+    FROM water_sale ws
+    JOIN water_product_size wps ON wps.id = ws.product_size_id
+    LEFT JOIN customer c ON c.id = ws.customer_id
+    LEFT JOIN journal_entry je ON je.id = ws.journal_entry_id
+    WHERE ws.business_id = %(business_id)s
+      AND ws.sale_date BETWEEN %(date_from)s AND %(date_to)s
+      AND je.status IS DISTINCT FROM 'reversed'
+UNION ALL
+    SELECT rs.sale_date, rs.sale_number, c.name, c.kra_pin,
+           rp.name, rsi.tax_rate, rsi.net_amount, rsi.tax_amount
+    FROM retail_sale_item rsi
+    JOIN retail_sale rs ON rs.id = rsi.sale_id
+    JOIN retail_product rp ON rp.id = rsi.product_id
+    LEFT JOIN customer c ON c.id = rs.customer_id
+    LEFT JOIN journal_entry je ON je.id = rs.journal_entry_id
+    WHERE rs.business_id = %(business_id)s
+      AND rs.sale_date BETWEEN %(date_from)s AND %(date_to)s
+      AND je.status IS DISTINCT FROM 'reversed'
+UNION ALL
+    SELECT le.exchange_date, 'LPG-' || le.id, c.name, c.kra_pin,
+           'LPG refill ' || le.capacity_kg || 'kg', le.tax_rate, le.net_amount, le.tax_amount
+    FROM retail_lpg_exchange le
+    LEFT JOIN customer c ON c.id = le.customer_id
+    LEFT JOIN journal_entry je ON je.id = le.journal_entry_id
+    WHERE le.business_id = %(business_id)s
+      AND le.exchange_date BETWEEN %(date_from)s AND %(date_to)s
+      AND je.status IS DISTINCT FROM 'reversed'
+UNION ALL
+    SELECT lj.received_date, lj.job_number, c.name, c.kra_pin,
+           'Laundry services', lj.tax_rate, lj.total_amount - lj.tax_amount, lj.tax_amount
+    FROM laundry_job lj
+    JOIN laundry_customer lc ON lc.id = lj.customer_id
+    JOIN customer c ON c.id = lc.customer_id
+    WHERE lj.business_id = %(business_id)s
+      AND lj.received_date BETWEEN %(date_from)s AND %(date_to)s
+      AND lj.status <> 'cancelled'
+ORDER BY 1, 2
+"""
+
+VAT_SCHEDULE_HEADER = [
+    'Invoice Date', 'Invoice Number', 'Purchaser Name', 'Purchaser PIN',
+    'Description', 'VAT Rate (%)', 'Taxable Value (KSh)', 'VAT (KSh)',
+]
+
+
+def iter_vat_lines(business, date_from, date_to, using=DEFAULT_DB_ALIAS):
+    """
+    Stream taxable lines for a period through a server-side cursor.
+
+    Yields tuples in VAT_LINES_SQL column order, STREAM_CHUNK_SIZE rows
+    per round trip. Must be consumed inside a transaction on ``using``.
+    """
+    params = {'business_id': business.id, 'date_from': date_from, 'date_to': date_to}
+    with connections[using].chunked_cursor() as cursor:
+        cursor.execute(VAT_LINES_SQL, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+
+def generate_vat_return(business, year, month, schedule_file=None):
+    """
+    Produce the monthly VAT return for a business in one pass.
+
+    Totals are accumulated per VAT rate while the lines stream past. If
+    ``schedule_file`` (a text file object) is given, the per-invoice sales
+    schedule is written to it as CSV in the same pass.
+
+    Lines recorded before the VAT engine was enabled have no stored
+    breakdown; they are counted under rate None so they can be reviewed.
+    Reads from the reporting replica when it is usable.
+    """
+    date_from = date(year, month, 1)
+    date_to = date(year, month, calendar.monthrange(year, month)[1])
+
+    writer = None
+    if schedule_file is not None:
+        writer = csv.writer(schedule_file)
+        writer.writerow(VAT_SCHEDULE_HEADER)
+
+    by_rate = defaultdict(lambda: {'lines': 0, 'net_amount': Decimal('0.00'), 'tax_amount': Decimal('0.00')})
+    using = reporting_alias()
+    with transaction.atomic(using=using):
+        for line in iter_vat_lines(business, date_from, date_to, using=using):
+            invoice_date, number, name, pin, description, rate, net, tax = line
+            bucket = by_rate[rate]
+            bucket['lines'] += 1
+            bucket['net_amount'] += net or 0
+            bucket['tax_amount'] += tax or 0
+            if writer is not None:
+                writer.writerow([
+                    invoice_date.strftime('%d/%m/%Y'), number, name or '', pin or '',
+                    description, rate if rate is not None else '', net or '', tax or '',
+                ])
+
+    return {
+        'business': business.code,
+        'period': f'{year}-{month:02d}',
+        'by_rate': dict(by_rate),
+        'total_net_amount': sum((b['net_amount'] for b in by_rate.values()), Decimal('0.00')),
+        'total_output_vat': sum((b['tax_amount'] for b in by_rate.values()), Decimal('0.00')),
+    }
@@ -0,0 +1,335 @@
+"""
+Water Services - Multi-Business ERP System
+Database: PostgreSQL 15+
+Django: 5.0+
+
+Service layer for the water packaging business (DOMAIN 4 in
+django_models.py). Copy into water/services.py.
+
+LAST UPDATED: 2026-10-19
+"""
+
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from caching import invalidate
+from costing import cost_water_sales, receive_stock
+from django_models import TransactionType, WaterInventory, WaterProduction, WaterProductSize, WaterSale
+from instrumentation import instrumented
+from ledger_posting import cogs_lines, get_accounts, post_journal_entries, sale_lines
+from task_queue import audit_created
+from tax import apply_water_sale_tax
+
+
+def _lock_inventory(business, product_size_ids):
+    """
+    Lock the empty and filled inventory rows for the given sizes.
+
+    Rows are always locked in (product_size_id, inventory_type) order, so
+    concurrent production runs, sales and stock adjustments cannot
+    deadlock on each other. Returns {(product_size_id, inventory_type): row}.
+    """
+    rows = (
+        WaterInventory.objects.select_for_update()
+        .filter(business=business, product_size_id__in=product_size_ids)
+        .order_by('product_size_id', 'inventory_type')
+    )
+    return {(row.product_size_id, row.inventory_type): row for row in rows}
+
+
+# Sizes 1, stock rows 3, production insert 1, cost layers 6, savepoint in
+# a caller's transaction 2 - for any number of runs
+@instrumented(max_queries=13)
+@transaction.atomic
+def record_production_runs(business, runs, production_date, recorded_by):
+    """
+    Record a batch of production runs (e.g. a whole day) atomically.
+
+    Each run is a dict with product_size_id, quantity_produced,
+    production_cost and optional notes.
+
+    For every product size in the batch:
+    - empty containers are reduced by the quantity produced
+    - filled products are increased by the quantity produced
+    - the filled unit_cost becomes the weighted average of the existing
+      stock and the new units, where a new unit costs its empty container
+      plus its share of production_cost
+
+    All inventory rows are updated with a single UPDATE after being locked
+    in a consistent order. Every run is also received into the costing
+    engine so later water sales are costed from it.
+    """
+    runs = list(runs)
+    if not runs:
+        return []
+
+    quantities = defaultdict(int)
+    costs = defaultdict(Decimal)
+    for run in runs:
+        if run['quantity_produced'] < 1:
+            raise ValidationError("Quantity produced must be at least 1.")
+        if run['production_cost'] < 0:
+            raise ValidationError("Production cost cannot be negative.")
+        quantities[run['product_size_id']] += run['quantity_produced']
+        costs[run['product_size_id']] += Decimal(run['production_cost'])
+
+    size_ids = sorted(quantities)
+    product_sizes = WaterProductSize.objects.in_bulk(size_ids)
+    unknown = set(size_ids) - set(product_sizes)
+    if unknown:
+        raise ValidationError(f"Unknown water product sizes: {sorted(unknown)}")
+
+    # First production of a size creates its filled stock row
+    WaterInventory.objects.bulk_create(
+        [
+            WaterInventory(
+                business=business,
+                product_size=product_sizes[size_id],
+                inventory_type='filled',
+                quantity=0,
+                selling_price=product_sizes[size_id].default_price,
+            )
+            for size_id in size_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+    inventory = _lock_inventory(business, size_ids)
+
+    new_quantity = {}
+    new_unit_cost = {}
+    empty_unit_cost = {}
+    for size_id in size_ids:
+        empty = inventory.get((size_id, 'empty'))
+        filled = inventory[(size_id, 'filled')]
+        produced = quantities[size_id]
+        size_name = product_sizes[size_id].name
+
+        if empty is None or empty.quantity < produced:
+            available = empty.quantity if empty else 0
+            raise ValidationError(
+                f"Not enough empty {size_name} containers: "
+                f"{available} available, {produced} needed."
+            )
+
+        empty_unit_cost[size_id] = empty.unit_cost
+        added_cost = produced * empty.unit_cost + costs[size_id]
+        total_quantity = filled.quantity + produced
+        weighted_cost = (filled.quantity * filled.unit_cost + added_cost) / total_quantity
+
+        new_quantity[empty.id] = empty.quantity - produced
+        new_quantity[filled.id] = total_quantity
+        new_unit_cost[filled.id] = weighted_cost.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    WaterInventory.objects.filter(id__in=new_quantity).update(
+        quantity=Case(
+            *[When(id=row_id, then=Value(quantity)) for row_id, quantity in new_quantity.items()],
+            output_field=IntegerField(),
+        ),
+        unit_cost=Case(
+            *[When(id=row_id, then=Value(cost)) for row_id, cost in new_unit_cost.items()],
+            default=F('unit_cost'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        last_updated=timezone.now(),
+    )
+    invalidate(WaterInventory, business)
+
+    productions = WaterProduction.objects.bulk_create([
+        WaterProduction(
+            business=business,
+            product_size=product_sizes[run['product_size_id']],
+            quantity_produced=run['quantity_produced'],
+            production_cost=run['production_cost'],
+            production_date=production_date,
+            notes=run.get('notes', ''),
+            recorded_by=recorded_by,
+        )
+        for run in runs
+    ])
+
+    # Each run becomes a cost layer: container cost plus its production cost
+    receive_stock(
+        business,
+        [
+            (
+                'water',
+                production.product_size_id,
+                production.quantity_produced,
+                empty_unit_cost[production.product_size_id]
+                + Decimal(production.production_cost) / production.quantity_produced,
+                production.id,
+            )
+            for production in productions
+        ],
+        production_date,
+        'production',
+    )
+    return productions
+
+
+def record_production(business, product_size_id, quantity_produced,
+                      production_cost, production_date, recorded_by, notes=''):
+    """Record a single production run (see record_production_runs)."""
+    return record_production_runs(
+        business,
+        [{
+            'product_size_id': product_size_id,
+            'quantity_produced': quantity_produced,
+            'production_cost': production_cost,
+            'notes': notes,
+        }],
+        production_date,
+        recorded_by,
+    )[0]
+
+
+# Sizes 1, stock 2, VAT 1, costing 5, accounts 2, posting 13 (its
+# savepoint and a business's first chain head included), insert 1, audit
+# 1, savepoint in a caller's transaction 2 - for any number of sales
+@instrumented(max_queries=28)
+@transaction.atomic
+def record_water_sales(business, sales, sale_date, recorded_by):
+    """
+    Record a batch of water sales (e.g. a till's offline queue) atomically.
+
+    Each sale is a dict with product_size_id, quantity_sold,
+    payment_method and optional unit_price (default: the filled selling
+    price), customer, m_pesa_transaction_id, sale_time and notes.
+
+    Filled stock is locked and reduced with a single UPDATE, every sale
+    takes its VAT from the tax engine and its cost from the costing
+    engine's layers, and the journal entries are posted in one batch
+    before the sales are inserted with one bulk_create.
+    """
+    sales = list(sales)
+    if not sales:
+        return []
+
+    quantities = defaultdict(int)
+    for sale in sales:
+        if sale['quantity_sold'] < 1:
+            raise ValidationError("Quantity sold must be at least 1.")
+        quantities[sale['product_size_id']] += sale['quantity_sold']
+
+    size_ids = sorted(quantities)
+    product_sizes = WaterProductSize.objects.in_bulk(size_ids)
+    inventory = _lock_inventory(business, size_ids)
+
+    new_quantity = {}
+    for size_id in size_ids:
+        filled = inventory.get((size_id, 'filled'))
+        available = filled.quantity if filled else 0
+        if available < quantities[size_id]:
+            size_name = product_sizes[size_id].name if size_id in product_sizes else f"#{size_id}"
+            raise ValidationError(
+                f"Not enough filled {size_name} water: "
+                f"{available} available, {quantities[size_id]} needed."
+            )
+        new_quantity[filled.id] = available - quantities[size_id]
+
+    if len(quantities) == 1:
+        # The common single-size sale: fixed SQL text, so it gets prepared
+        [(size_id, quantity)] = quantities.items()
+        WaterInventory.objects.filter(id=inventory[(size_id, 'filled')].id).update(
+            quantity=F('quantity') - quantity, last_updated=timezone.now(),
+        )
+    else:
+        WaterInventory.objects.filter(id__in=new_quantity).update(
+            quantity=Case(
+                *[When(id=row_id, then=Value(quantity)) for row_id, quantity in new_quantity.items()],
+                output_field=IntegerField(),
+            ),
+            last_updated=timezone.now(),
+        )
+    invalidate(WaterInventory, business)
+
+    rows = []
+    for sale in sales:
+        filled = inventory[(sale['product_size_id'], 'filled')]
+        unit_price = sale.get('unit_price')
+        if unit_price is None:
+            unit_price = filled.selling_price
+        total_amount = (sale['quantity_sold'] * Decimal(unit_price)).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+        row = WaterSale(
+            business=business,
+            customer=sale.get('customer'),
+            product_size=product_sizes[sale['product_size_id']],
+            quantity_sold=sale['quantity_sold'],
+            unit_price=unit_price,
+            total_amount=total_amount,
+            payment_method=sale['payment_method'],
+            m_pesa_transaction_id=sale.get('m_pesa_transaction_id', ''),
+            sale_date=sale_date,
+            notes=sale.get('notes', ''),
+            recorded_by=recorded_by,
+        )
+        if sale.get('sale_time'):
+            row.sale_time = sale['sale_time']
+        rows.append(row)
+    apply_water_sale_tax(business, rows)
+    cost_water_sales(business, rows)
+
+    accounts = get_accounts(
+        business, *sorted({row.payment_method for row in rows}),
+        'revenue', 'vat_payable', 'cogs', 'inventory',
+    )
+    sale_type = TransactionType.objects.get(code='SALE')
+    entries = []
+    for row in rows:
+        description = f"Water sale {row.quantity_sold}x {row.product_size.name}"
+        lines = sale_lines(
+            accounts, row.payment_method, 'revenue', row.total_amount, description, row.tax_amount
+        )
+        if row.cost_amount:
+            lines += cogs_lines(accounts, row.cost_amount, description)
+        entries.append({
+            'business': business,
+            'transaction_type': sale_type,
+            'transaction_date': sale_date,
+            'description': description,
+            'reference_number': row.m_pesa_transaction_id,
+            'created_by': recorded_by,
+            'lines': lines,
+        })
+    for row, journal_entry in zip(rows, post_journal_entries(entries)):
+        row.journal_entry = journal_entry
+
+    WaterSale.objects.bulk_create(rows)
+    # bulk_create() sends no post_save: audit the batch in one task, then
+    # send it for the cache and realtime handlers
+    audit_created(WaterSale, rows)
+    for row in rows:
+        post_save.send(
+            sender=WaterSale, instance=row, created=True, update_fields=None, raw=False,
+            using=row._state.db, audited=True,
+        )
+    return rows
+
+
+def record_water_sale(business, product_size_id, quantity_sold, payment_method,
+                      recorded_by, sale_date=None, unit_price=None, customer=None,
+                      m_pesa_transaction_id='', notes=''):
+    """Record a single water sale (see record_water_sales)."""
+    return record_water_sales(
+        business,
+        [{
+            'product_size_id': product_size_id,
+            'quantity_sold': quantity_sold,
+            'payment_method': payment_method,
+            'unit_price': unit_price,
+            'customer': customer,
+            'm_pesa_transaction_id': m_pesa_transaction_id,
+            'notes': notes,
+        }],
+        sale_date or timezone.localdate(),
+        recorded_by,
+    )[0]